@@ -1,13 +1,28 @@
-from typing import TypedDict, Annotated, List, Dict, Any
+from typing import TypedDict, Annotated, List, Dict, Any, Optional, Tuple
 from langchain_core.messages import BaseMessage, AIMessage
+from langgraph.graph.message import add_messages
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain_community.tools import DuckDuckGoSearchRun
 from langchain_core.tools import Tool
-from vectorstore import cache_get, cache_set, cache_search
-import requests
-from bs4 import BeautifulSoup
+from vectorstore import cache_get_many, cache_set_many, cache_search_many
+from parallel import run_parallel, run_parallel_async
+from evidence import dedupe_snippets, normalize_text
+from fetcher import fetch_text, afetch_text
+from search_cache import CachedSearch
+from llm_cache import CachedRunnable, cache_hit, LLM_CACHE_TTL
+from router import router
+from context import context
+from resources import registry
+from metrics import InstrumentedRunnable, instrument_tool
+from model_routing import RoutedRunnable, model_router
+from throttle import Throttled
+from rerank import rerank_safely
+from planner import plan_sub_queries
+import asyncio
 import os
+import re
+import time
 from dotenv import load_dotenv
 
 from prompts import runnable_prompt, simple_prompt, analyzer_prompt, retriever_prompt, checker_prompt, \
@@ -15,25 +30,72 @@ from prompts import runnable_prompt, simple_prompt, analyzer_prompt, retriever_p
 
 load_dotenv()
 
-llm = ChatOpenAI(
-    model="Qwen/Qwen3-Next-80B-A3B-Instruct",
-    base_url="https://foundation-models.api.cloud.ru/v1",
-    api_key=os.getenv("MAIN_LLM_KEY"),
-    temperature=0
-)
+RETRIEVER_MAX_WORKERS = int(os.getenv("RETRIEVER_MAX_WORKERS", "4"))
+RETRIEVER_TOOL_WORKERS = int(os.getenv("RETRIEVER_TOOL_WORKERS", "4"))
+RETRIEVER_SUBQUERY_TIMEOUT = float(os.getenv("RETRIEVER_SUBQUERY_TIMEOUT", "90"))
+COUNTER_MAX_WORKERS = int(os.getenv("COUNTER_MAX_WORKERS", "5"))
+COUNTER_BUDGET = float(os.getenv("COUNTER_BUDGET", "45"))
+MAX_RETRIEVAL_ROUNDS = int(os.getenv("MAX_RETRIEVAL_ROUNDS", "3"))
+SCRAPE_MAX_CHARS = 2000
+# Маркеры списка в ответе чекера: "- ", "* ", "1. ", "## "
+_LIST_MARKER_RE = re.compile(r"^\s*(?:[-*•]+|\d+[.)]|#+)\s*")
+# Явно пустой список MISSING
+_NOTHING_MISSING = {"none", "nothing", "n/a", "no", "нет"}
+
+MAIN_MODEL = "Qwen/Qwen3-Next-80B-A3B-Instruct"
+DEEPSEEK_MODEL = "deepseek-chat"
+# Registry name -> model, for every backend a runnable can be routed to
+BACKEND_MODELS = {"llm": MAIN_MODEL, "deepseek_llm": DEEPSEEK_MODEL}
+
+
+# Клиенты не повторяют запросы сами: повторы делает только лимитер провайдера (Throttled),
+# дальше failover на другой бэкенд в пределах MODEL_CALL_DEADLINE
+def create_llm():
+    return ChatOpenAI(
+        model=MAIN_MODEL,
+        base_url="https://foundation-models.api.cloud.ru/v1",
+        api_key=os.getenv("MAIN_LLM_KEY"),
+        temperature=0,
+        max_retries=0
+    )
+
+
+def create_deepseek_llm():
+    return ChatOpenAI(
+        model=DEEPSEEK_MODEL,
+        base_url="https://api.deepseek.com",
+        api_key=os.getenv("DEEPSEEK_API_KEY"),
+        temperature=0.7,
+        max_tokens=4096,
+        max_retries=0
+    )
+
+
+# Клиенты создаются один раз на процесс при первом обращении и общие для всех сессий
+registry.register("llm", create_llm)
+registry.register("deepseek_llm", create_deepseek_llm)
+registry.register("search_tool", DuckDuckGoSearchRun)
+# Все вызовы поиска идут через кэш, к LLM привязан исходный инструмент
+registry.register("cached_search", lambda: CachedSearch(Throttled(registry.get("search_tool"), "duckduckgo")))
+
+llm = registry.lazy("llm")
+deepseek_llm = registry.lazy("deepseek_llm")
+search_tool = registry.lazy("search_tool")
+cached_search = registry.lazy("cached_search")
+
+
+def scrape_page(url: str) -> str:
+    return fetch_text(url, SCRAPE_MAX_CHARS)
+
+
+async def ascrape_page(url: str) -> str:
+    return await afetch_text(url, SCRAPE_MAX_CHARS)
 
-deepseek_llm = ChatOpenAI(
-    model="deepseek-chat",
-    base_url="https://api.deepseek.com",
-    api_key=os.getenv("DEEPSEEK_API_KEY"),
-    temperature=0.7,
-    max_tokens=4096
-)
 
-search_tool = DuckDuckGoSearchRun()
 scrape_tool = Tool(
     name="scrape_page",
-    func=lambda url: BeautifulSoup(requests.get(url).text, 'html.parser').get_text()[:2000],
+    func=scrape_page,
+    coroutine=ascrape_page,
     description="Scrapes content from a URL"
 )
 
@@ -41,220 +103,577 @@ tools = [search_tool, scrape_tool]
 
 
 class AgentState(TypedDict):
+    """Graph state. Nodes return only the keys they change.
+
+    The counter-argument branch runs in parallel with retriever/checker, so
+    `messages` is the only key both branches write in the same step: it is
+    merged by `add_messages` (appends, and replaces messages with a known id,
+    so passing the restored history back in does not duplicate it). The other
+    keys have a single writer per step and keep last-value semantics, so a run
+    invoked with `orchestrator.initial_state(query)` starts them empty while the
+    thread's message history is kept by the checkpointer.
+    """
     query: str
-    sub_queries: Annotated[List[str], "add"]
-    data: Annotated[Dict[str, Any], "add"]
-    verified_facts: Annotated[Dict[str, Any], "add"]
-    counter_arguments: Annotated[Dict[str, Any], "add"]
+    sub_queries: List[str]
+    data: Dict[str, Any]
+    verified_facts: Dict[str, Any]
+    counter_arguments: Dict[str, Any]
     final_answer: str
-    messages: Annotated[List[BaseMessage], "add"]
+    messages: Annotated[List[BaseMessage], add_messages]
+    retrieval_round: int
+    missing_sub_queries: List[str]
 
 
-def create_runnable(llm, tools, system_prompt):
+def create_runnable(llm, tools, system_prompt, name=None, cache_ttl=LLM_CACHE_TTL, semantic_cache=False,
+                    provider=None):
     prompt = ChatPromptTemplate.from_messages([
         ("system", system_prompt),
         ("human", "{input}"),
         ("placeholder", "{agent_scratchpad}"),
     ])
     if tools:
-        return prompt | llm.bind_tools(tools)
+        chain = prompt | llm.bind_tools(tools)
     else:
-        return prompt | llm
+        chain = prompt | llm
+    if provider is not None:
+        # Лимитер стоит за кэшем: ответы из кэша не тратят квоту провайдера
+        chain = Throttled(chain, provider)
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", "") or type(llm).__name__
+    if name is not None and cache_ttl > 0:
+        chain = CachedRunnable(chain, prompt, llm, name, tools=tools, ttl=cache_ttl,
+                               semantic=cache_semantic(semantic_cache))
+    return InstrumentedRunnable(chain, name or "chain", model)
+
+
+def resolve_tools(names: List[str]) -> List[Any]:
+    available = {"search": lambda: registry.get("search_tool"), "scrape": lambda: scrape_tool}
+    return [available[name]() for name in names]
+
+
+def lazy_runnable(llm_name: str, tool_names: List[str], system_prompt: str, name: str, **kwargs):
+    """Регистрирует runnable в реестре; цепочка собирается при первом вызове.
+
+    `llm_name` - основной бэкенд узла, остальные используются для failover и hedging.
+    """
+
+    def factory(backend):
+        return lambda: create_runnable(registry.get(backend), resolve_tools(tool_names), system_prompt, name=name,
+                                       provider=backend, **kwargs)
+
+    backends = model_router.policy(name, llm_name, list(BACKEND_MODELS))
+    registry.register(
+        f"{name}_runnable",
+        lambda: RoutedRunnable(name, {b: factory(b) for b in backends}, BACKEND_MODELS),
+    )
+    return registry.lazy(f"{name}_runnable")
+
+
+def cache_semantic(enabled: bool) -> bool:
+    return enabled and os.getenv("LLM_SEMANTIC_CACHE", "1") == "1"
+
+
+def cache_notes(name: str, results) -> List[AIMessage]:
+    """Сообщение для CoT о том, сколько ответов LLM взято из кэша"""
+    hits = [cache_hit(r) for r in results]
+    hits = [h for h in hits if h]
+    if not hits:
+        return []
+    return [AIMessage(content=f"[cache] {name}: {len(hits)}/{len(results)} LLM responses from cache "
+                              f"({', '.join(sorted(set(hits)))})")]
 
 
-router_runnable = create_runnable(
-    llm,
+@instrument_tool
+def run_tool_call(tc) -> Any:
+    tool_name = tc['name']
+    tool_args = tc['args']
+    if tool_name == 'duckduckgo_search':
+        return cached_search.run(tool_args['query'])
+    elif tool_name == 'scrape_page':
+        return scrape_tool.func(tool_args['url'])
+    return None
+
+
+@instrument_tool
+async def arun_tool_call(tc) -> Any:
+    tool_name = tc['name']
+    tool_args = tc['args']
+    if tool_name == 'duckduckgo_search':
+        return await cached_search.arun(tool_args['query'])
+    elif tool_name == 'scrape_page':
+        return await scrape_tool.coroutine(tool_args['url'])
+    return None
+
+
+router_runnable = lazy_runnable(
+    "llm",
     [],
-    runnable_prompt
+    runnable_prompt,
+    name="router",
+    semantic_cache=True
 )
 
 
-def router_node(state: AgentState) -> AgentState:
+def local_route(state: AgentState) -> Optional[Dict[str, Any]]:
+    decision = router.route_local(state["query"])
+    if decision is None:
+        return None
+    return {"messages": [
+        AIMessage(content=f"[router] {decision.backend}: {decision.mode} ({decision.confidence:.2f})"),
+        AIMessage(content=decision.mode),
+    ]}
+
+
+def router_node(state: AgentState) -> Dict[str, Any]:
+    local = local_route(state)
+    if local:
+        return local
     result = router_runnable.invoke({"input": state["query"], "agent_scratchpad": []})
     mode = result.content.lower()
-    state["messages"] += [AIMessage(content=mode)]
-    return state
+    router.record_llm(state["query"], mode)
+    return {"messages": cache_notes("router", [result]) + [AIMessage(content=mode)]}
+
+
+async def arouter_node(state: AgentState) -> Dict[str, Any]:
+    # Локальный роутер может считать эмбеддинг, поэтому не блокируем event loop
+    local = await asyncio.to_thread(local_route, state)
+    if local:
+        return local
+    result = await router_runnable.ainvoke({"input": state["query"], "agent_scratchpad": []})
+    mode = result.content.lower()
+    await asyncio.to_thread(router.record_llm, state["query"], mode)
+    return {"messages": cache_notes("router", [result]) + [AIMessage(content=mode)]}
 
 
-simple_runnable = create_runnable(
-    llm,
-    [search_tool],
-    simple_prompt
+simple_runnable = lazy_runnable(
+    "llm",
+    ["search"],
+    simple_prompt,
+    name="simple",
+    cache_ttl=3600
 )
 
 
-def simple_node(state: AgentState) -> AgentState:
-    result = simple_runnable.invoke({"input": state["query"], "agent_scratchpad": state["messages"]})
+def simple_node(state: AgentState) -> Dict[str, Any]:
+    result = simple_runnable.invoke({"input": state["query"],
+                                     "agent_scratchpad": context.scratchpad("simple", state["messages"])})
     if hasattr(result, 'tool_calls') and result.tool_calls:
-        tool_outputs = []
-        for tc in result.tool_calls:
-            tool_name = tc['name']
-            tool_args = tc['args']
-            if tool_name == 'duckduckgo_search':
-                output = search_tool.run(tool_args['query'])
-            tool_outputs.append(output)
-        state["final_answer"] = "\n".join(tool_outputs)
+        tool_outputs = [run_tool_call(tc) for tc in result.tool_calls]
+        final_answer = "\n".join(o for o in tool_outputs if o is not None)
     else:
-        state["final_answer"] = result.content
-    return state
+        final_answer = result.content
+    return {"messages": cache_notes("simple", [result]), "final_answer": final_answer}
 
 
-analyzer_runnable = create_runnable(
-    llm,
+async def asimple_node(state: AgentState) -> Dict[str, Any]:
+    result = await simple_runnable.ainvoke({"input": state["query"],
+                                            "agent_scratchpad": context.scratchpad("simple", state["messages"])})
+    if hasattr(result, 'tool_calls') and result.tool_calls:
+        tool_outputs = await asyncio.gather(*(arun_tool_call(tc) for tc in result.tool_calls))
+        final_answer = "\n".join(o for o in tool_outputs if o is not None)
+    else:
+        final_answer = result.content
+    return {"messages": cache_notes("simple", [result]), "final_answer": final_answer}
+
+
+# Только точный кэш: близкие по смыслу вопросы ("... в 2020" / "... в 2021") требуют разных подзапросов
+analyzer_runnable = lazy_runnable(
+    "deepseek_llm",
     [],
-    analyzer_prompt
+    analyzer_prompt,
+    name="analyzer"
 )
 
 
-def analyzer_node(state: AgentState) -> AgentState:
+def apply_analysis(state: AgentState, result) -> Dict[str, Any]:
+    plan = plan_sub_queries(result.content)
+    notes = cache_notes("analyzer", [result])
+    if plan.duplicates or plan.answered or plan.over_cap:
+        notes.append(AIMessage(content=f"[planner] {len(plan.sub_queries)} sub-queries: "
+                                       f"{len(plan.duplicates)} duplicates merged, "
+                                       f"{len(plan.answered)} answered by the verified cache, "
+                                       f"{len(plan.over_cap)} over the cap"))
+    # Подзапросы, уже отвеченные кэшем, приходят с данными и пропускаются ретривером
+    answered = {sq: format_cached([fact]) for sq, fact in plan.answered.items()}
+    return {
+        "sub_queries": state["sub_queries"] + plan.sub_queries,
+        "data": {**state["data"], **answered},
+        "messages": notes + [AIMessage(content="\n".join(plan.sub_queries))],
+    }
+
+
+def analyzer_node(state: AgentState) -> Dict[str, Any]:
     result = analyzer_runnable.invoke({"input": state["query"], "agent_scratchpad": []})
-    sub_queries = [q.strip() for q in result.content.split("\n") if q.strip()]
-    state["sub_queries"] += sub_queries
-    state["messages"] += [AIMessage(content=result.content)]
-    return state
+    return apply_analysis(state, result)
+
 
+async def aanalyzer_node(state: AgentState) -> Dict[str, Any]:
+    result = await analyzer_runnable.ainvoke({"input": state["query"], "agent_scratchpad": []})
+    # Планировщик ходит в Chroma и считает эмбеддинги
+    return await asyncio.to_thread(apply_analysis, state, result)
 
-retriever_runnable = create_runnable(
-    llm,
-    [search_tool, scrape_tool],
-    retriever_prompt
+
+retriever_runnable = lazy_runnable(
+    "llm",
+    ["search", "scrape"],
+    retriever_prompt,
+    name="retriever",
+    cache_ttl=3600
 )
 
 
-def retriever_node(state: AgentState) -> AgentState:
-    data = {}
-    for sq in state["sub_queries"]:
-
-        collected = []
-        cached_results = cache_search(sq)
-
-        if cached_results:
-            formatted = [
-                f"[CACHED FACT] {r['facts']} (source: {r['source']}, date: {r['date']})"
-                for r in cached_results
-            ]
-            collected.extend(formatted)
-        result = retriever_runnable.invoke({
-            "input": sq,
-            "agent_scratchpad": state["messages"]
-        })
+def format_cached(cached_results) -> List[str]:
+    return [
+        f"[CACHED FACT] {r['facts']} (source: {r['source']}, date: {r['date']})"
+        for r in cached_results
+    ]
 
-        if hasattr(result, 'tool_calls') and result.tool_calls:
-            for tc in result.tool_calls:
-                tool_name = tc['name']
-                tool_args = tc['args']
-                if tool_name == 'duckduckgo_search':
-                    collected.append(search_tool.run(tool_args['query']))
-                elif tool_name == 'scrape_page':
-                    collected.append(scrape_tool.func(tool_args['url']))
+
+def retrieve_sub_query(sq: str, messages: List[BaseMessage], cached_results: List[Dict]):
+    collected = format_cached(cached_results)
+    result = retriever_runnable.invoke({
+        "input": sq,
+        "agent_scratchpad": context.scratchpad("retriever", messages, sq)
+    })
+
+    if hasattr(result, 'tool_calls') and result.tool_calls:
+        outputs = run_parallel(run_tool_call, result.tool_calls,
+                               max_workers=RETRIEVER_TOOL_WORKERS, timeout=RETRIEVER_SUBQUERY_TIMEOUT)
+        collected.extend(r.value for r in outputs if r.ok and r.value is not None)
+    else:
+        collected.append(result.content)
+
+    return collected, result
+
+
+async def aretrieve_sub_query(sq: str, messages: List[BaseMessage], cached_results: List[Dict]):
+    collected = format_cached(cached_results)
+    result = await retriever_runnable.ainvoke({
+        "input": sq,
+        "agent_scratchpad": context.scratchpad("retriever", messages, sq)
+    })
+
+    if hasattr(result, 'tool_calls') and result.tool_calls:
+        outputs = await run_parallel_async(arun_tool_call, result.tool_calls,
+                                           max_concurrency=RETRIEVER_TOOL_WORKERS)
+        collected.extend(r.value for r in outputs if r.ok and r.value is not None)
+    else:
+        collected.append(result.content)
+
+    return collected, result
+
+
+def retrieval_targets(state: AgentState) -> List[str]:
+    """Подзапросы для текущего раунда: только недостающие, уже найденное переносится как есть"""
+    sub_queries = list(dict.fromkeys(state["sub_queries"]))
+    missing = [sq for sq in state.get("missing_sub_queries") or [] if sq in sub_queries]
+    if missing:
+        return missing
+    return [sq for sq in sub_queries if not state["data"].get(sq)]
+
+
+def apply_retrieval(state: AgentState, results) -> Dict[str, Any]:
+    # Results come back in sub-query order, so `data` does not depend on completion order
+    data = {}
+    llm_results = []
+    for r in results:
+        previous = state["data"].get(r.item) or []
+        if r.ok:
+            collected, llm_result = r.value
+            data[r.item] = previous + [c for c in collected if c not in previous]
+            llm_results.append(llm_result)
         else:
-            collected.append(result.content)
+            data[r.item] = previous
+
+    # Only sub-queries touched in this round are reranked; the rest were ranked earlier
+    data, rerank_stats = rerank_safely(data)
+    retrieval_round = state.get("retrieval_round", 0) + 1
+    notes = cache_notes("retriever", llm_results)
+    if rerank_stats.get("chunks"):
+        notes.append(AIMessage(content=f"[rerank] kept {rerank_stats['kept']}/{rerank_stats['chunks']} chunks "
+                                       f"(~{rerank_stats['tokens']} tokens)"))
+    return {
+        "data": {**state["data"], **data},
+        "retrieval_round": retrieval_round,
+        "missing_sub_queries": [],
+        "messages": notes + [
+            AIMessage(content=f"Data retrieved (round {retrieval_round}, {len(results)} sub-queries)")
+        ],
+    }
+
+
+def retriever_node(state: AgentState) -> Dict[str, Any]:
+    sub_queries = retrieval_targets(state)
+    # Один запрос к Chroma на все подзапросы вместо отдельного на каждый
+    cached = dict(zip(sub_queries, cache_search_many(sub_queries)))
+    results = run_parallel(
+        lambda sq: retrieve_sub_query(sq, state["messages"], cached[sq]),
+        sub_queries,
+        max_workers=RETRIEVER_MAX_WORKERS,
+        timeout=RETRIEVER_SUBQUERY_TIMEOUT,
+    )
+    return apply_retrieval(state, results)
 
-        data[sq] = collected
 
-    state["data"].update(data)
-    state["messages"] += [AIMessage(content="Data retrieved")]
-    return state
+async def aretriever_node(state: AgentState) -> Dict[str, Any]:
+    sub_queries = retrieval_targets(state)
+    cached = dict(zip(sub_queries, await asyncio.to_thread(cache_search_many, sub_queries)))
+    results = await run_parallel_async(
+        lambda sq: aretrieve_sub_query(sq, state["messages"], cached[sq]),
+        sub_queries,
+        max_concurrency=RETRIEVER_MAX_WORKERS,
+        timeout=RETRIEVER_SUBQUERY_TIMEOUT,
+    )
+    # Эмбеддинги для реранкинга считаются на CPU, не держим event loop
+    return await asyncio.to_thread(apply_retrieval, state, results)
 
 
-checker_runnable = create_runnable(
-    llm,
-    [search_tool],
-    checker_prompt
+checker_runnable = lazy_runnable(
+    "deepseek_llm",
+    ["search"],
+    checker_prompt,
+    name="checker",
+    cache_ttl=3600
 )
 
 
-def checker_node(state: AgentState) -> AgentState:
+def apply_cached_check(cached) -> Dict[str, Any]:
+    return {
+        "verified_facts": {"facts": cached["facts"], "source": cached["source"], "cached": True},
+        "messages": [AIMessage(content=f"Cached fact used from {cached['date']}")],
+    }
+
+
+def checker_source(result) -> str:
+    used_source = ""
+    for tc in result.tool_calls:
+        if tc['name'] == 'duckduckgo_search':
+            used_source = tc['args']['query']
+    return used_source
+
+
+def missing_key(line: str) -> str:
+    return normalize_text(line.strip(" .`'\""))
+
+
+def parse_missing(verification: str, state: AgentState) -> List[str]:
+    """Sub-queries the checker reported as lacking data.
+
+    Lines after 'MISSING:' are matched as whole lines against the sub-query
+    headings; sub-queries that came back empty are always included. An
+    explicitly empty list ("none") adds nothing to the empty ones. Without a
+    'MISSING:' list, or if no line matches, every sub-query is retried.
+    """
+    sub_queries = list(dict.fromkeys(state["sub_queries"]))
+    empty = [sq for sq in sub_queries if not state["data"].get(sq)]
+    _, marker, tail = verification.partition("MISSING:")
+    if not marker:
+        return sub_queries
+    reported = {missing_key(_LIST_MARKER_RE.sub("", line)) for line in tail.splitlines()}
+    reported.discard("")
+    if not reported or reported <= _NOTHING_MISSING:
+        return empty
+    matched = {sq for sq in sub_queries if missing_key(sq) in reported}
+    if not matched:
+        return sub_queries
+    return [sq for sq in sub_queries if sq in matched or sq in empty]
+
+
+def apply_verification(state: AgentState, result, verification: str,
+                       used_source: str) -> Tuple[Dict[str, Any], bool]:
+    """Обновление state по результату проверки и флаг, подтверждены ли факты"""
+    messages = cache_notes("checker", [result])
+    if "needs_more" in verification.lower():
+        missing = parse_missing(verification, state)
+        if missing and state.get("retrieval_round", 0) < MAX_RETRIEVAL_ROUNDS:
+            messages.append(AIMessage(content=f"Needs more data: {len(missing)} sub-queries"))
+            return {"missing_sub_queries": missing, "messages": messages}, False
+        # Бюджет раундов исчерпан или чекер не назвал, что искать: идём дальше с тем, что есть,
+        # но результат неполный и в кэш не пишется
+        if missing:
+            messages.append(AIMessage(content=f"Retrieval budget exhausted after {MAX_RETRIEVAL_ROUNDS} rounds"))
+        else:
+            messages.append(AIMessage(content="Checker needs more data but named no sub-query to retry"))
+        facts = {**state["verified_facts"], "facts": verification, "source": used_source, "complete": False}
+        return {"verified_facts": facts, "missing_sub_queries": [], "messages": messages}, False
+
+    messages.append(AIMessage(content=verification))
+    facts = {**state["verified_facts"], "facts": verification, "source": used_source}
+    return {"verified_facts": facts, "missing_sub_queries": [], "messages": messages}, True
+
+
+def checker_node(state: AgentState) -> Dict[str, Any]:
     query = state["query"]
 
-    cached = cache_get(query)
+    cached = cache_get_many([query])[0]
     if cached:
-        state["verified_facts"] = {"facts": cached["facts"], "source": cached["source"], "cached": True}
-        state["messages"] += [AIMessage(content=f"Cached fact used from {cached['date']}")]
-        return state
+        return apply_cached_check(cached)
 
+    verify_input = f"Verify:\n{context.compact_data('checker', state['data'])}"
     result = checker_runnable.invoke(
-        {"input": f"Verify: {state['data']}", "agent_scratchpad": state["messages"]}
+        {"input": verify_input, "agent_scratchpad": context.scratchpad("checker", state["messages"], verify_input)}
     )
 
     if hasattr(result, 'tool_calls') and result.tool_calls:
-        tool_outputs = []
-        used_source = ""
-        for tc in result.tool_calls:
-            if tc['name'] == 'duckduckgo_search':
-                q = tc['args']['query']
-                output = search_tool.run(q)
-                tool_outputs.append(output)
-                used_source = q
+        tool_outputs = [run_tool_call(tc) for tc in result.tool_calls if tc['name'] == 'duckduckgo_search']
         verification = "\n".join(tool_outputs)
+        used_source = checker_source(result)
     else:
         verification = result.content
         used_source = "unknown"
 
-    if "needs_more" in verification.lower():
-        state["messages"] += [AIMessage(content="Needs more data")]
-        return state
+    update, verified = apply_verification(state, result, verification, used_source)
+    if verified:
+        cache_set_many([(query, verification, used_source)])
+
+    return update
+
+
+async def achecker_node(state: AgentState) -> Dict[str, Any]:
+    query = state["query"]
 
-    state["verified_facts"].update({"facts": verification, "source": used_source})
-    state["messages"] += [AIMessage(content=verification)]
+    cached = (await asyncio.to_thread(cache_get_many, [query]))[0]
+    if cached:
+        return apply_cached_check(cached)
+
+    verify_input = f"Verify:\n{context.compact_data('checker', state['data'])}"
+    result = await checker_runnable.ainvoke(
+        {"input": verify_input, "agent_scratchpad": context.scratchpad("checker", state["messages"], verify_input)}
+    )
+
+    if hasattr(result, 'tool_calls') and result.tool_calls:
+        tool_outputs = await asyncio.gather(
+            *(arun_tool_call(tc) for tc in result.tool_calls if tc['name'] == 'duckduckgo_search')
+        )
+        verification = "\n".join(tool_outputs)
+        used_source = checker_source(result)
+    else:
+        verification = result.content
+        used_source = "unknown"
 
-    cache_set(query, verification, used_source)
+    update, verified = apply_verification(state, result, verification, used_source)
+    if verified:
+        await asyncio.to_thread(cache_set_many, [(query, verification, used_source)])
 
-    return state
+    return update
 
 
-counter_argument_runnable = create_runnable(
-    llm,
-    [search_tool, scrape_tool],
-    counter_prompt
+counter_argument_runnable = lazy_runnable(
+    "deepseek_llm",
+    ["search", "scrape"],
+    counter_prompt,
+    name="counter_argument",
+    cache_ttl=3600
 )
 
 
-def counter_argument_node(state: AgentState) -> AgentState:
+def build_counter_queries(state: AgentState) -> List[str]:
+    # Ветка стартует сразу после анализатора, параллельно с retriever/checker,
+    # поэтому опирается на запрос и подзапросы, а не на проверенные факты
     query = state["query"]
-    facts = state["verified_facts"]
-    counter_queries = [
+    claims = "; ".join(dict.fromkeys(state.get("sub_queries") or [])) or query
+    return [
         f"criticism of {query}",
         f"opposing views {query}",
         f"alternative perspectives {query}",
         f"debate controversy {query}",
-        f"counter-arguments for {facts}",
+        f"counter-arguments for {claims}",
     ]
 
+
+def apply_counter_arguments(state: AgentState, results) -> Dict[str, Any]:
+    # Probes are merged in query order, so earlier probes win when results overlap
+    seen = set()
     counter_data = {}
-    for cq in counter_queries:
-        result = counter_argument_runnable.invoke({"input": cq, "agent_scratchpad": state["messages"]})
-        if hasattr(result, 'tool_calls') and result.tool_calls:
-            for tc in result.tool_calls:
-                tool_name = tc['name']
-                tool_args = tc['args']
-                if tool_name == 'duckduckgo_search':
-                    output = search_tool.run(tool_args['query'])
-                elif tool_name == 'scrape_page':
-                    output = scrape_tool.func(tool_args['url'])
-                counter_data.setdefault(cq, []).append(output)
+    llm_results = []
+    for r in results:
+        if not r.ok:
+            continue
+        value, llm_result = r.value
+        llm_results.append(llm_result)
+        if isinstance(value, list):
+            outputs = dedupe_snippets(value, seen)
+            if outputs:
+                counter_data[r.item] = outputs
         else:
-            counter_data[cq] = result.content
+            counter_data[r.item] = value
 
-    state.get("counter_arguments", {}).update(counter_data)
-    state["messages"] += [AIMessage(content="Counter-arguments collected")]
-    return state
+    completed = sum(r.ok for r in results)
+    return {
+        "counter_arguments": {**(state.get("counter_arguments") or {}), **counter_data},
+        "messages": cache_notes("counter_argument", llm_results) + [
+            AIMessage(content=f"Counter-arguments collected ({completed}/{len(results)} probes)")
+        ],
+    }
 
 
-synthesizer_runnable = create_runnable(
-    llm,
+def counter_argument_node(state: AgentState) -> Dict[str, Any]:
+    deadline = time.monotonic() + COUNTER_BUDGET
+
+    def probe(cq):
+        result = counter_argument_runnable.invoke(
+            {"input": cq, "agent_scratchpad": context.scratchpad("counter_argument", state["messages"], cq)}
+        )
+        if hasattr(result, 'tool_calls') and result.tool_calls:
+            outputs = run_parallel(run_tool_call, result.tool_calls, max_workers=COUNTER_MAX_WORKERS,
+                                   budget=max(deadline - time.monotonic(), 0))
+            return [r.value for r in outputs if r.ok and r.value is not None], result
+        return result.content, result
+
+    results = run_parallel(probe, build_counter_queries(state), max_workers=COUNTER_MAX_WORKERS,
+                           budget=COUNTER_BUDGET)
+    return apply_counter_arguments(state, results)
+
+
+async def acounter_argument_node(state: AgentState) -> Dict[str, Any]:
+
+    async def probe(cq):
+        result = await counter_argument_runnable.ainvoke(
+            {"input": cq, "agent_scratchpad": context.scratchpad("counter_argument", state["messages"], cq)}
+        )
+        if hasattr(result, 'tool_calls') and result.tool_calls:
+            outputs = await run_parallel_async(arun_tool_call, result.tool_calls,
+                                               max_concurrency=COUNTER_MAX_WORKERS)
+            return [r.value for r in outputs if r.ok and r.value is not None], result
+        return result.content, result
+
+    # The overall budget cancels in-flight probes together with their tool calls
+    results = await run_parallel_async(probe, build_counter_queries(state), max_concurrency=COUNTER_MAX_WORKERS,
+                                       budget=COUNTER_BUDGET)
+    return apply_counter_arguments(state, results)
+
+
+synthesizer_runnable = lazy_runnable(
+    "deepseek_llm",
     [],
-    synthesizer_prompt
+    synthesizer_prompt,
+    name="synthesizer",
+    # Финальный ответ всегда генерируется заново по свежим фактам
+    cache_ttl=0
 )
 
 
-def synthesizer_node(state: AgentState) -> AgentState:
-    synthesis_input = f"""
-    Verified Facts: {state['verified_facts']}
-    Counter-Arguments: {state.get('counter_arguments', {})}
+def build_synthesis_input(state: AgentState) -> str:
+    facts = context.fit_text("synthesizer", str(state['verified_facts']), share=0.4)
+    counter = context.compact_data("synthesizer", state.get('counter_arguments', {}), share=0.3)
+    return f"""
+    Verified Facts: {facts}
+    Counter-Arguments: {counter}
 
     Provide a balanced answer that considers both the verified facts and counter-arguments.
     """
-    result = synthesizer_runnable.invoke({"input": synthesis_input, "agent_scratchpad": state["messages"]})
-    state["final_answer"] = result.content
-    return state
\ No newline at end of file
+
+
+def synthesizer_node(state: AgentState) -> Dict[str, Any]:
+    synthesis_input = build_synthesis_input(state)
+    result = synthesizer_runnable.invoke(
+        {"input": synthesis_input, "agent_scratchpad": context.scratchpad("synthesizer", state["messages"], synthesis_input)}
+    )
+    return {"final_answer": result.content}
+
+
+async def asynthesizer_node(state: AgentState) -> Dict[str, Any]:
+    synthesis_input = build_synthesis_input(state)
+    result = await synthesizer_runnable.ainvoke(
+        {"input": synthesis_input, "agent_scratchpad": context.scratchpad("synthesizer", state["messages"], synthesis_input)}
+    )
+    return {"final_answer": result.content}
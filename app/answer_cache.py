@@ -0,0 +1,151 @@
+"""Whole-query answer cache in front of the graph.
+
+The verified-facts cache only saves the checker step; a repeated question
+still goes through router, analyzer, retriever, counter-arguments and the
+synthesizer. Finished answers are stored here per query:
+    * exact - the normalised query (case, whitespace and punctuation folded)
+      is hashed; hits are served from an in-process LRU, then from Chroma;
+    * near-duplicate (opt-in) - nearest stored query by embedding, accepted
+      only under ANSWER_CACHE_MAX_DISTANCE (cosine) and with the same numbers
+      in both queries. Off by default: "population in 2020" and "population
+      in 2021" are a few hundredths apart and must not share an answer.
+Entries older than ANSWER_CACHE_TTL are ignored, so answers about
+fast-moving topics are regenerated. Incomplete answers (retrieval budget
+exhausted) are never stored.
+"""
+
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from embeddings import embed_cached
+from evidence import normalize_text
+from metrics import metrics
+from resources import registry
+from search_cache import LRUCache
+from vectorstore import fresh_where, make_hash
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+
+_PUNCT_RE = re.compile(r"[^\w\s]+")
+_NUMBER_RE = re.compile(r"\d+")
+
+registry.register(
+    "answer_cache",
+    lambda: registry.get("chroma").get_or_create_collection(name="answer_cache", metadata={"hnsw:space": "cosine"}),
+    health_check=lambda c: c.count(),
+    retry_after=15,
+)
+answer_collection = registry.lazy("answer_cache")
+
+
+def normalize_query(query: str) -> str:
+    return normalize_text(_PUNCT_RE.sub(" ", query))
+
+
+def query_key(query: str) -> str:
+    return make_hash(normalize_query(query))
+
+
+def query_numbers(query: str) -> List[str]:
+    return _NUMBER_RE.findall(query)
+
+
+def same_numbers(a: str, b: str) -> bool:
+    """Years, counts and versions differ by a token but change the answer."""
+    return query_numbers(a) == query_numbers(b)
+
+
+def is_complete(values: Dict[str, Any]) -> bool:
+    """Whether a finished run produced an answer worth caching."""
+    return bool(values.get("final_answer")) and (values.get("verified_facts") or {}).get("complete", True)
+
+
+class AnswerCache:
+    """Two-level answer cache (in-process LRU, then the `answer_cache` Chroma collection).
+
+    Args:
+        ttl (float): Freshness window in seconds.
+        max_distance (float): Largest cosine distance accepted as a near-duplicate; 0 (default) disables it.
+        size (int): Entries kept in memory.
+    """
+
+    def __init__(self, ttl: float = ANSWER_CACHE_TTL, max_distance: float = ANSWER_CACHE_MAX_DISTANCE,
+                 size: int = ANSWER_CACHE_SIZE, enabled: bool = ANSWER_CACHE_ENABLED):
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.enabled = enabled and ttl > 0
+        self._memory = LRUCache(size)
+
+    def _hit(self, kind: str, answer: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+        metrics.inc("answer_cache_total", help="Answer cache lookups", result=kind)
+        return {"answer": answer, "kind": kind, "query": meta.get("query", ""),
+                "age": time.time() - float(meta.get("ts", time.time()))}
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Fresh answer for the query or a near-duplicate of it.
+
+        Returns:
+            Optional[Dict[str, Any]]: {"answer", "kind" ("exact"/"semantic"), "query", "age"} or None.
+        """
+        if not self.enabled:
+            return None
+        normalized = normalize_query(query)
+        key = make_hash(normalized)
+        cached = self._memory.get(key)
+        if cached is not None:
+            return self._hit("exact", *cached)
+
+        try:
+            where = fresh_where(self.ttl)
+            found = answer_collection.get(ids=[key], where=where, include=["documents", "metadatas"])
+            if found["ids"]:
+                answer, meta = found["documents"][0], found["metadatas"][0]
+                self._memory.set(key, (answer, meta), max(self.ttl - (time.time() - meta["ts"]), 1.0))
+                return self._hit("exact", answer, meta)
+
+            if self.max_distance > 0:
+                nearest = answer_collection.query(
+                    query_embeddings=embed_cached([normalized]).tolist(), n_results=1, where=where,
+                    include=["documents", "metadatas", "distances"],
+                )
+                if (nearest["ids"] and nearest["ids"][0] and nearest["distances"][0][0] <= self.max_distance
+                        and same_numbers(query, nearest["metadatas"][0][0].get("query", ""))):
+                    return self._hit("semantic", nearest["documents"][0][0], nearest["metadatas"][0][0])
+        except Exception as exc:
+            logger.warning("answer cache lookup failed: %s", exc)
+            metrics.inc("answer_cache_total", help="Answer cache lookups", result="error")
+            return None
+        metrics.inc("answer_cache_total", help="Answer cache lookups", result="miss")
+        return None
+
+    def store(self, query: str, answer: str):
+        if not self.enabled or not answer:
+            return
+        normalized = normalize_query(query)
+        key = make_hash(normalized)
+        meta = {"query": query, "date": datetime.now(timezone.utc).isoformat(), "ts": time.time()}
+        self._memory.set(key, (answer, meta), self.ttl)
+        try:
+            answer_collection.upsert(ids=[key], embeddings=embed_cached([normalized]).tolist(),
+                                     documents=[answer], metadatas=[meta])
+        except Exception as exc:
+            logger.warning("answer cache write failed: %s", exc)
+
+    def prune(self) -> int:
+        """Physically delete entries past the TTL; reads already skip them."""
+        stale = answer_collection.get(where={"ts": {"$lt": time.time() - self.ttl}}, include=[])["ids"]
+        if stale:
+            answer_collection.delete(ids=stale)
+        return len(stale)
+
+
+answer_cache = AnswerCache()
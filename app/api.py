@@ -0,0 +1,165 @@
+"""Small HTTP/SSE API over the graph for clients other than Streamlit.
+
+    cd app && python api.py --port 8080
+
+    POST /query    {"query": "...", "thread_id": "..."} -> {"thread_id", "final_answer", "seconds"}
+    POST /stream   same body -> text/event-stream with "token" (answer chunks),
+                   "update" (finished node and its CoT messages) and a final "done" event
+    GET  /metrics  Prometheus text format
+    GET  /health   resource health checks
+
+Runs go through the shared SessionLoop like Streamlit sessions do, so they
+share the answer cache, single-flight of identical queries and the session
+limit. Without "thread_id" every request is a new conversation.
+"""
+
+import argparse
+import json
+import logging
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+from uuid import uuid4
+
+from cache_maintenance import start_background_compaction
+from metrics import metrics
+from orchestrator import initial_state
+from resources import registry
+from sessions import get_session_loop
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 64 * 1024
+
+
+def update_event(node: str, payload: Any) -> Dict[str, Any]:
+    """JSON-friendly view of a node update: CoT messages as text, other keys by name."""
+    payload = payload if isinstance(payload, dict) else {}
+    return {
+        "node": node,
+        "messages": [m.content for m in payload.get("messages", [])],
+        "keys": sorted(k for k in payload if k != "messages"),
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _json(self, status: int, body: Any):
+        data = json.dumps(body, ensure_ascii=False, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _request(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("request body too large")
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(body, dict) or not str(body.get("query", "")).strip():
+            raise ValueError("'query' is required")
+        return body
+
+    def _event(self, name: str, data: Any):
+        self.wfile.write(f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode())
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            data = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif self.path == "/health":
+            self._json(200, registry.health())
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path not in ("/query", "/stream"):
+            self._json(404, {"error": "not found"})
+            return
+        try:
+            body = self._request()
+        except ValueError as exc:
+            self._json(400, {"error": str(exc)})
+            return
+
+        thread_id = str(body.get("thread_id") or uuid4())
+        config = {"configurable": {"thread_id": thread_id}}
+        state = initial_state(str(body["query"]).strip())
+        started = time.perf_counter()
+        metrics.inc("api_requests_total", help="API requests", path=self.path)
+
+        if self.path == "/query":
+            try:
+                values = get_session_loop().run(state, config)
+            except Exception as exc:
+                logger.exception("query failed")
+                self._json(500, {"error": repr(exc), "thread_id": thread_id})
+                return
+            seconds = time.perf_counter() - started
+            metrics.observe("api_request_seconds", seconds, help="API request latency", path=self.path)
+            self._json(200, {"thread_id": thread_id, "final_answer": values.get("final_answer", ""),
+                             "seconds": round(seconds, 3)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        # Без Content-Length: поток закрывается вместе с соединением
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        final_answer = ""
+        try:
+            for kind, node, payload in get_session_loop().stream_events(state, config):
+                if kind == "token":
+                    self._event("token", {"node": node, "text": payload})
+                    continue
+                if isinstance(payload, dict) and payload.get("final_answer"):
+                    final_answer = payload["final_answer"]
+                self._event("update", update_event(node, payload))
+            seconds = time.perf_counter() - started
+            metrics.observe("api_request_seconds", seconds, help="API request latency", path=self.path)
+            self._event("done", {"thread_id": thread_id, "final_answer": final_answer, "seconds": round(seconds, 3)})
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент ушёл; выход из stream_events отменяет запуск, если он больше никому не нужен
+            logger.info("client disconnected from %s", thread_id)
+        except Exception as exc:
+            logger.exception("stream failed")
+            self._event("error", {"error": repr(exc), "thread_id": thread_id})
+
+    def log_message(self, fmt, *args):
+        logger.info("%s - %s", self.address_string(), fmt % args)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    registry.warmup_in_background()
+    start_background_compaction()
+    server = serve(args.host, args.port)
+    logger.info("listening on http://%s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
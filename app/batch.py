@@ -0,0 +1,241 @@
+"""Headless batch runner for the orchestrator graph.
+
+Reads queries from JSONL, runs them through the graph and appends one JSON
+line per finished query to the output file as soon as it completes:
+
+    cd app && python batch.py queries.jsonl results.jsonl --concurrency 16
+    cd app && python batch.py queries.jsonl results.jsonl --mode process --concurrency 4
+
+Input lines are objects with "query" and an optional "id" (the line number
+otherwise), or bare JSON strings. Queries whose id already has a successful
+line in the output file are skipped, so a crashed or interrupted run is
+resumed by starting it again with the same arguments; failed ones are retried.
+
+Modes:
+    * async - the shared SessionLoop: async graph, answer cache and one run
+      per group of identical queries; use it to pre-warm the answer cache;
+    * thread - the sync graph on a thread pool;
+    * process - the sync graph in worker processes, for CPU-bound local
+      embedding and reranking.
+The graph runs without a checkpointer in the thread and process modes: every
+query is independent and the output file is the record of progress. The
+async mode goes through the checkpointed graph, so every run gets its own
+thread ids ("batch-<run>-<id>"): ids are line numbers by default, and a
+second file or a retried line must not resume an earlier conversation.
+
+Throughput and p50/p95 latency are printed at the end (and periodically with
+--progress); every output line carries its own "seconds".
+"""
+
+import argparse
+import asyncio
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Set
+from uuid import uuid4
+
+from benchmark import percentiles
+
+logger = logging.getLogger(__name__)
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def read_queries(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"query": item}
+            if not item.get("query"):
+                logger.warning("line %d has no query, skipped", number)
+                continue
+            yield {**item, "id": item.get("id", number)}
+
+
+def completed_ids(path: str) -> Set[str]:
+    """Ids with a successful result in an existing output file.
+
+    A line cut short by a crash is not valid JSON and is ignored, so that
+    query runs again.
+    """
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if "error" not in result:
+                done.add(str(result["id"]))
+    return done
+
+
+def open_output(path: str):
+    """Append-mode output; a trailing partial line from a crash is terminated first."""
+    f = open(path, "a+", encoding="utf-8")
+    if f.tell():
+        f.seek(f.tell() - 1)
+        if f.read(1) != "\n":
+            f.write("\n")
+    return f
+
+
+def get_graph():
+    """The sync graph without a checkpointer, compiled once per process."""
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            from orchestrator import workflow
+            _graph = workflow.compile()
+    return _graph
+
+
+def result_line(item: Dict[str, Any], started: float, values: Optional[Dict[str, Any]] = None,
+                cached: Optional[str] = None, error: Optional[BaseException] = None) -> Dict[str, Any]:
+    from answer_cache import is_complete
+
+    line = {"id": item["id"], "query": item["query"], "seconds": round(time.perf_counter() - started, 3)}
+    if error is not None:
+        line["error"] = repr(error)
+        return line
+    line.update({
+        "answer": values.get("final_answer", ""),
+        "complete": bool(is_complete(values)),
+        "sub_queries": values.get("sub_queries") or [],
+        "cached": cached,
+    })
+    return line
+
+
+def run_query(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one query through the sync graph; used by the thread and process pools."""
+    from answer_cache import answer_cache, is_complete
+    from metrics import tracer
+    from orchestrator import initial_state
+
+    started = time.perf_counter()
+    thread_id = item["thread_id"]
+    # Как SessionLoop: трасса закрывается после запроса, иначе неявные трассы копятся в tracer
+    tracer.start(thread_id, item["query"])
+    try:
+        hit = answer_cache.lookup(item["query"])
+        if hit is not None:
+            return result_line(item, started, {"final_answer": hit["answer"]}, cached=hit["kind"])
+        values = get_graph().invoke(initial_state(item["query"]), config={"configurable": {"thread_id": thread_id}})
+        if is_complete(values):
+            answer_cache.store(item["query"], values["final_answer"])
+        return result_line(item, started, values)
+    except Exception as exc:
+        return result_line(item, started, error=exc)
+    finally:
+        tracer.finish(thread_id)
+
+
+async def arun_query(session_loop, item: Dict[str, Any]) -> Dict[str, Any]:
+    from orchestrator import initial_state
+
+    started = time.perf_counter()
+    try:
+        values = await session_loop.arun(initial_state(item["query"]),
+                                         {"configurable": {"thread_id": item["thread_id"]}})
+    except Exception as exc:
+        return result_line(item, started, error=exc)
+    messages = values.get("messages") or []
+    note = messages[-1].content if messages else ""
+    cached = note[len("[cache] answer: "):] if note.startswith("[cache] answer: ") else None
+    return result_line(item, started, values, cached=cached)
+
+
+def submit_all(items: List[Dict[str, Any]], mode: str, concurrency: int) -> List[Future]:
+    if mode == "async":
+        from sessions import SessionLoop
+
+        session_loop = SessionLoop(max_sessions=concurrency)
+        # Клиенты, привязанные к циклу, закрываются при выходе, после всех запросов
+        atexit.register(session_loop.shutdown)
+        return [asyncio.run_coroutine_threadsafe(arun_query(session_loop, item), session_loop.loop)
+                for item in items]
+    pool_type = ProcessPoolExecutor if mode == "process" else ThreadPoolExecutor
+    pool = pool_type(max_workers=concurrency)
+    return [pool.submit(run_query, item) for item in items]
+
+
+def summarize(lines: List[Dict[str, Any]], wall: float, skipped: int) -> Dict[str, Any]:
+    ok = [line for line in lines if "error" not in line]
+    return {
+        "queries": len(lines),
+        "ok": len(ok),
+        "failed": len(lines) - len(ok),
+        "skipped": skipped,
+        "cached": sum(1 for line in ok if line.get("cached")),
+        "wall_seconds": round(wall, 3),
+        "throughput_qps": len(lines) / wall if wall else 0.0,
+        "latency": percentiles([line["seconds"] for line in ok]),
+    }
+
+
+def print_summary(report: Dict[str, Any], file=sys.stderr):
+    latency = report["latency"]
+    print(f"{report['queries']} queries ({report['ok']} ok, {report['failed']} failed, {report['cached']} cached, "
+          f"{report['skipped']} skipped) in {report['wall_seconds']:.1f}s, {report['throughput_qps']:.2f} q/s, "
+          f"latency p50 {latency['p50']:.2f}s p95 {latency['p95']:.2f}s max {latency['max']:.2f}s", file=file)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL with queries")
+    parser.add_argument("output", help="JSONL results, appended to and used to resume")
+    parser.add_argument("--mode", choices=["async", "thread", "process"], default="async")
+    parser.add_argument("--concurrency", type=int, default=8, help="queries executed at the same time")
+    parser.add_argument("--no-answer-cache", action="store_true", help="always run the graph")
+    parser.add_argument("--progress", type=float, default=10.0, help="seconds between progress lines, 0 = off")
+    parser.add_argument("--report", help="write the summary as JSON to this file")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.no_answer_cache:
+        # Before any app module is imported; worker processes inherit it
+        os.environ["ANSWER_CACHE_ENABLED"] = "0"
+
+    done = completed_ids(args.output)
+    queries = list(read_queries(args.input))
+    run_id = uuid4().hex[:8]
+    items = [{**item, "thread_id": f"batch-{run_id}-{item['id']}"}
+             for item in queries if str(item["id"]) not in done]
+    skipped = len(queries) - len(items)
+    print(f"{len(items)} queries to run, {skipped} already done", file=sys.stderr)
+
+    lines: List[Dict[str, Any]] = []
+    started = last_progress = time.perf_counter()
+    with open_output(args.output) as out:
+        for future in as_completed(submit_all(items, args.mode, args.concurrency)):
+            line = future.result()
+            out.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+            lines.append(line)
+            if args.progress and time.perf_counter() - last_progress >= args.progress:
+                last_progress = time.perf_counter()
+                print_summary(summarize(lines, last_progress - started, skipped))
+
+    report = summarize(lines, time.perf_counter() - started, skipped)
+    print_summary(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
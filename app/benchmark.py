@@ -0,0 +1,355 @@
+"""Offline benchmark of the whole graph against local stand-ins.
+
+No network is needed. The registry resources are replaced with:
+    * a fake chat model with configurable latency and deterministic,
+      role-aware answers (routing, sub-queries, tool calls, verdicts);
+    * a fake search tool with configurable latency;
+    * an in-process (ephemeral) Chroma client and hash-based embeddings;
+    * a local HTTP server serving pages for `scrape_page`.
+All file caches are pointed at a temporary directory, so every run starts cold.
+
+Reports per-node and end-to-end p50/p95 latency, throughput with N
+concurrent sessions and memory use:
+
+    cd app && python benchmark.py --queries 40 --sessions 8
+    cd app && python benchmark.py --mode sync --llm-latency 0.05 --json bench.json
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+SAMPLE_QUERIES = [
+    "Кто написал роман Война и мир",
+    "Столица Австралии",
+    "Сравни экономическую политику Японии и Германии после 2008 года и её влияние на рынок труда",
+    "Почему Ада Лавлейс считается первым программистом и как менялась оценка её вклада",
+    "Какие аргументы за и против ядерной энергетики в Европе",
+    "Год основания Санкт-Петербурга",
+    "Как изменение климата влияет на миграцию птиц и сельское хозяйство в Сибири",
+    "Кто изобрёл телефон",
+]
+
+
+def stable_hash(text: str) -> int:
+    return int(hashlib.sha1(text.encode()).hexdigest()[:8], 16)
+
+
+# --- Local stand-ins -------------------------------------------------------------------------------------------
+
+def make_fake_llm(args, page_url: str):
+    """Chat model answering like each node expects, chosen by the system prompt."""
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    import prompts
+
+    roles = {
+        prompts.runnable_prompt: "router",
+        prompts.simple_prompt: "simple",
+        prompts.analyzer_prompt: "analyzer",
+        prompts.retriever_prompt: "retriever",
+        prompts.checker_prompt: "checker",
+        prompts.counter_prompt: "counter_argument",
+        prompts.synthesizer_prompt: "synthesizer",
+    }
+
+    class FakeChatModel(BaseChatModel):
+        model_name: str = "fake-chat"
+        temperature: float = 0.0
+        latency: float = 0.2
+        token_latency: float = 0.0
+        answer_tokens: int = 300
+        needs_more_rate: float = 0.0
+
+        @property
+        def _llm_type(self) -> str:
+            return "fake-chat"
+
+        def bind_tools(self, tools, **kwargs):
+            return self.bind(tools=[getattr(t, "name", str(t)) for t in tools], **kwargs)
+
+        def _respond(self, messages, tools) -> AIMessage:
+            role = roles.get(messages[0].content, "simple") if messages else "simple"
+            query = next((m.content for m in messages if m.type == "human"), "")
+            h = stable_hash(f"{role}:{query}")
+
+            if role == "router":
+                content = "simple" if len(query.split()) <= 6 else "pro"
+            elif role == "analyzer":
+                # Как у настоящей модели: приоритеты и один перефразированный повтор
+                plan = [{"query": f"{query[:80]} — аспект {i + 1}", "priority": i + 1} for i in range(3)]
+                plan.append({"query": f"{query[:80]} — аспект 1", "priority": 4})
+                content = json.dumps(plan, ensure_ascii=False)
+            elif role in ("retriever", "counter_argument") and tools:
+                calls = [{"name": "duckduckgo_search", "args": {"query": query}, "id": f"s{h}"}]
+                if role == "retriever" and "scrape_page" in tools:
+                    calls.append({"name": "scrape_page", "args": {"url": f"{page_url}/page/{h}"}, "id": f"p{h}"})
+                return AIMessage(content="", tool_calls=calls)
+            elif role == "checker" and (h % 1000) / 1000 < self.needs_more_rate:
+                headings = [line[3:] for line in query.splitlines() if line.startswith("## ")]
+                content = "needs_more\nMISSING:\n" + "\n".join(headings[:1])
+            elif role == "synthesizer":
+                content = " ".join(f"token{(h + i) % 997}" for i in range(self.answer_tokens))
+            else:
+                content = f"{role} answer {h}: " + " ".join(f"w{(h + i) % 101}" for i in range(40))
+            return AIMessage(content=content)
+
+        def _delay(self, message: AIMessage) -> float:
+            return self.latency + self.token_latency * len(str(message.content).split())
+
+        def _generate(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+            message = self._respond(messages, tools)
+            time.sleep(self._delay(message))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+            message = self._respond(messages, tools)
+            await asyncio.sleep(self._delay(message))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    return FakeChatModel(latency=args.llm_latency, token_latency=args.token_latency,
+                         answer_tokens=args.answer_tokens, needs_more_rate=args.needs_more_rate)
+
+
+def make_fake_search(latency: float):
+    from langchain_core.tools import Tool
+
+    def search(query: str) -> str:
+        time.sleep(latency)
+        h = stable_hash(query)
+        return " ".join(f"Result {i} for {query}: fact{(h + i) % 211} snippet text." for i in range(5))
+
+    return Tool(name="duckduckgo_search", func=search, description="Fake search")
+
+
+class HashEmbeddingFunction:
+    """Deterministic bag-of-words hashing into a fixed-size vector."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def __call__(self, input: List[str]) -> List[np.ndarray]:
+        vectors = []
+        for text in input:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for word in text.lower().split():
+                vector[stable_hash(word) % self.dim] += 1.0
+            vectors.append(vector)
+        return vectors
+
+
+def start_page_server(latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            h = stable_hash(self.path)
+            body = "".join(f"<p>Paragraph {i} of {self.path}: fact{(h + i) % 313}.</p>" for i in range(50))
+            data = f"<html><head><title>{self.path}</title></head><body>{body}</body></html>".encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, name="bench-http", daemon=True).start()
+    return server
+
+
+def isolate_caches(args) -> str:
+    """Point every on-disk cache at a temp dir; must run before app modules are imported."""
+    tmp = tempfile.mkdtemp(prefix="team4-bench-")
+    os.environ.update({
+        "SEARCH_CACHE_PATH": os.path.join(tmp, "search.sqlite3"),
+        "LLM_CACHE_PATH": os.path.join(tmp, "llm.sqlite3"),
+        "FETCH_CACHE_DIR": os.path.join(tmp, "fetch"),
+        "ROUTER_LOG_PATH": os.path.join(tmp, "router_log.jsonl"),
+        # Бенчмарк-треды не должны попадать в рабочую базу чекпоинтов и её GC
+        "CHECKPOINT_PATH": os.path.join(tmp, "checkpoints.sqlite3"),
+        "LLM_CACHE_ENABLED": "1" if args.llm_cache else "0",
+        "ANSWER_CACHE_ENABLED": "1" if args.answer_cache else "0",
+        "LLM_SEMANTIC_CACHE": "0",
+        # Every run's trace must survive until the report is built
+        "TRACE_HISTORY": str(max(200, args.queries + args.warmup)),
+    })
+    if not args.rate_limits:
+        # Measure the graph itself, not the provider quotas
+        unlimited = {"rate": 1e6, "burst": 1e6, "concurrency": 1024, "max_concurrency": 1024}
+        os.environ["RATE_LIMITS"] = json.dumps({p: unlimited for p in ("llm", "deepseek_llm", "duckduckgo", "scrape")})
+    return tmp
+
+
+def install_stand_ins(args, page_url: str):
+    import chromadb
+
+    import agents  # noqa: F401 - registers the resources being overridden
+    from resources import registry
+
+    registry.override("llm", make_fake_llm(args, page_url))
+    registry.override("deepseek_llm", make_fake_llm(args, page_url))
+    registry.override("search_tool", make_fake_search(args.search_latency))
+    registry.override("embeddings", HashEmbeddingFunction())
+    registry.override("chroma", chromadb.EphemeralClient())
+
+
+# --- Runs ------------------------------------------------------------------------------------------------------
+
+def build_queries(n: int, repeat: bool) -> List[str]:
+    # Unique suffixes keep every query cold unless --repeat is given
+    return [SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)] + ("" if repeat else f" #{i}") for i in range(n)]
+
+
+def run_sync(queries: List[str], sessions: int, prefix: str) -> List[str]:
+    from metrics import tracer
+    from orchestrator import graph, initial_state
+    from parallel import run_parallel
+
+    def one(item):
+        i, query = item
+        thread_id = f"{prefix}-{i}"
+        tracer.start(thread_id, query)
+        try:
+            graph.invoke(initial_state(query), config={"configurable": {"thread_id": thread_id}})
+        finally:
+            tracer.finish(thread_id)
+        return thread_id
+
+    results = run_parallel(one, list(enumerate(queries)), max_workers=sessions)
+    failed = [r for r in results if not r.ok]
+    if failed:
+        print(f"{len(failed)} runs failed, first error: {failed[0].error!r}", file=sys.stderr)
+    return [f"{prefix}-{i}" for i in range(len(queries))]
+
+
+def run_async(queries: List[str], sessions: int, prefix: str) -> List[str]:
+    from orchestrator import initial_state
+    from sessions import SessionLoop
+
+    session_loop = SessionLoop(max_sessions=sessions)
+
+    async def all_runs():
+        return await asyncio.gather(*(
+            session_loop.arun(initial_state(q), {"configurable": {"thread_id": f"{prefix}-{i}"}})
+            for i, q in enumerate(queries)
+        ), return_exceptions=True)
+
+    results = asyncio.run_coroutine_threadsafe(all_runs(), session_loop.loop).result()
+    session_loop.shutdown()
+    failed = [r for r in results if isinstance(r, BaseException)]
+    if failed:
+        print(f"{len(failed)} runs failed, first error: {failed[0]!r}", file=sys.stderr)
+    return [f"{prefix}-{i}" for i in range(len(queries))]
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"n": 0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    arr = np.asarray(values)
+    return {"n": len(values), "p50": float(np.percentile(arr, 50)), "p95": float(np.percentile(arr, 95)),
+            "max": float(arr.max())}
+
+
+def collect(thread_ids: List[str]) -> Dict[str, Any]:
+    from metrics import tracer
+
+    traces = [t for t in (tracer.last(tid) for tid in thread_ids) if t is not None]
+    per_node: Dict[str, List[float]] = {}
+    llm_calls = tool_calls = 0
+    for trace in traces:
+        for span in trace.spans:
+            if span.kind == "node":
+                per_node.setdefault(span.name, []).append(span.seconds)
+            llm_calls += span.kind == "llm"
+            tool_calls += span.kind == "tool"
+    return {
+        "end_to_end": percentiles([t.seconds for t in traces if t.seconds is not None]),
+        "nodes": {name: percentiles(values) for name, values in per_node.items()},
+        "llm_calls": llm_calls,
+        "tool_calls": tool_calls,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=24)
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions")
+    parser.add_argument("--mode", choices=["async", "sync"], default="async",
+                        help="async: SessionLoop + async graph; sync: orchestrator.graph on a thread pool")
+    parser.add_argument("--warmup", type=int, default=1, help="runs excluded from the report")
+    parser.add_argument("--repeat", action="store_true", help="reuse identical queries (warm caches)")
+    parser.add_argument("--llm-cache", action="store_true", help="keep the LLM response cache enabled")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="keep the whole-query answer cache enabled (async mode)")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the production provider rate limits")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.0, help="extra seconds per output word")
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    parser.add_argument("--needs-more-rate", type=float, default=0.2, help="share of checker calls asking for more")
+    parser.add_argument("--search-latency", type=float, default=0.05)
+    parser.add_argument("--http-latency", type=float, default=0.02)
+    parser.add_argument("--tracemalloc", action="store_true", help="trace Python allocations (slower)")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    cache_dir = isolate_caches(args)
+    server = start_page_server(args.http_latency)
+    install_stand_ins(args, f"http://127.0.0.1:{server.server_address[1]}")
+    run = run_async if args.mode == "async" else run_sync
+
+    if args.warmup:
+        run(build_queries(args.warmup, args.repeat), 1, "warmup")
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    thread_ids = run(build_queries(args.queries, args.repeat), args.sessions, "bench")
+    wall = time.perf_counter() - started
+
+    report = collect(thread_ids)
+    report.update({
+        "mode": args.mode,
+        "queries": args.queries,
+        "sessions": args.sessions,
+        "wall_seconds": wall,
+        "throughput_qps": args.queries / wall if wall else 0.0,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024,
+        "cache_dir": cache_dir,
+    })
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        report["python_heap_mb"] = {"current": current / 2 ** 20, "peak": peak / 2 ** 20}
+        tracemalloc.stop()
+    server.shutdown()
+
+    print(f"{args.mode}: {args.queries} queries, {args.sessions} sessions, {wall:.2f}s, "
+          f"{report['throughput_qps']:.2f} q/s, max RSS {report['max_rss_mb']:.0f} MB")
+    print(f"{'node':<20}{'n':>6}{'p50, s':>10}{'p95, s':>10}{'max, s':>10}")
+    for name, row in [("end_to_end", report["end_to_end"])] + sorted(report["nodes"].items()):
+        print(f"{name:<20}{row['n']:>6}{row['p50']:>10.3f}{row['p95']:>10.3f}{row['max']:>10.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
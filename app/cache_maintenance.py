@@ -0,0 +1,232 @@
+"""Compaction and metrics for the `verified_cache` Chroma collection.
+
+`cache_set` only ever upserts, so without maintenance the collection grows
+without bound and `cache_search` keeps returning stale facts. Reads already
+filter by freshness (see `vectorstore.fresh_where`); this module physically
+removes expired entries and near-duplicates and enforces a size cap with
+LFU eviction based on the recorded hit counts.
+
+Near-duplicates are only looked for among entries whose stored queries
+carry the same numbers: "X in 2020" and "X in 2021" are a few hundredths
+apart but hold different facts. Entries written before the query was
+stored are never treated as duplicates.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import vectorstore
+from answer_cache import answer_cache, query_numbers
+from vectorstore import cache_collection, flush_hits, VERIFIED_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+VERIFIED_CACHE_MAX_ENTRIES = int(os.getenv("VERIFIED_CACHE_MAX_ENTRIES", "20000"))
+VERIFIED_CACHE_DUP_SIMILARITY = float(os.getenv("VERIFIED_CACHE_DUP_SIMILARITY", "0.99"))
+VERIFIED_CACHE_COMPACT_INTERVAL = float(os.getenv("VERIFIED_CACHE_COMPACT_INTERVAL", "3600"))
+PAGE_SIZE = 1000
+DEDUPE_BLOCK = 512
+
+last_compaction: Dict[str, Any] = {}
+# Размер коллекции обновляет фоновый поток; UI читает его без обращения к Chroma
+last_size: Dict[str, Any] = {"size": None}
+_compaction_lock = threading.Lock()
+_compaction_thread: Optional[threading.Thread] = None
+
+
+def entry_ts(meta: Dict) -> float:
+    """Write time of an entry; entries from before `ts` existed fall back to `date`."""
+    if meta.get("ts") is not None:
+        return float(meta["ts"])
+    try:
+        date = datetime.fromisoformat(meta["date"])
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+    # Старые записи писались через utcnow() без зоны; это UTC, а не локальное время
+    return (date if date.tzinfo else date.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def load_all() -> Dict[str, List]:
+    ids, metadatas, embeddings = [], [], []
+    offset = 0
+    while True:
+        page = cache_collection.get(include=["metadatas", "embeddings"], limit=PAGE_SIZE, offset=offset)
+        if not page["ids"]:
+            break
+        ids += page["ids"]
+        metadatas += [m or {} for m in page["metadatas"]]
+        embeddings += list(page["embeddings"])
+        offset += len(page["ids"])
+    return {"ids": ids, "metadatas": metadatas, "embeddings": embeddings}
+
+
+def number_key(meta: Dict) -> Optional[Tuple[str, ...]]:
+    """Numbers of the stored query; None for entries written before the query was stored."""
+    query = meta.get("query")
+    return tuple(query_numbers(query)) if query is not None else None
+
+
+def greedy_duplicates(vectors: np.ndarray, threshold: float) -> List[int]:
+    """Rows of `vectors` (unit, in priority order) within `threshold` of an earlier kept row."""
+    # Оставленные векторы копятся в заранее выделенной матрице; сравнение идёт блоками:
+    # блок против всех оставленных одним умножением, внутри блока - по матрице block @ block.T
+    kept = np.empty_like(vectors)
+    n_kept = 0
+    duplicates = []
+    for start in range(0, len(vectors), DEDUPE_BLOCK):
+        block = vectors[start:start + DEDUPE_BLOCK]
+        if n_kept:
+            covered = (kept[:n_kept] @ block.T).max(axis=0) >= threshold
+        else:
+            covered = np.zeros(len(block), dtype=bool)
+        inner = block @ block.T
+        block_kept: List[int] = []
+        for j in range(len(block)):
+            if covered[j] or (block_kept and float(inner[block_kept, j].max()) >= threshold):
+                duplicates.append(start + j)
+            else:
+                block_kept.append(j)
+        kept[n_kept:n_kept + len(block_kept)] = block[block_kept]
+        n_kept += len(block_kept)
+    return duplicates
+
+
+def find_duplicates(ids: List[str], metadatas: List[Dict], embeddings: List, threshold: float) -> List[str]:
+    """Greedy near-duplicate removal within groups of queries with the same numbers.
+
+    The most used (then newest) entry of each cluster survives.
+    """
+    if len(ids) < 2:
+        return []
+    order = sorted(range(len(ids)), key=lambda i: (-int(metadatas[i].get("hits", 0)), -entry_ts(metadatas[i])))
+    groups: Dict[Tuple[str, ...], List[int]] = {}
+    for i in order:
+        key = number_key(metadatas[i])
+        if key is not None:
+            groups.setdefault(key, []).append(i)
+
+    duplicates = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        vectors = np.asarray([embeddings[i] for i in members], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        duplicates += [ids[members[j]] for j in greedy_duplicates(vectors, threshold)]
+    return duplicates
+
+
+def delete_ids(ids: List[str]):
+    for start in range(0, len(ids), PAGE_SIZE):
+        cache_collection.delete(ids=ids[start:start + PAGE_SIZE])
+
+
+def compact(ttl: float = VERIFIED_CACHE_TTL, max_entries: int = VERIFIED_CACHE_MAX_ENTRIES,
+            dup_similarity: float = VERIFIED_CACHE_DUP_SIMILARITY) -> Dict[str, Any]:
+    """Remove expired and near-duplicate entries, then evict LFU entries above `max_entries`.
+
+    Returns:
+        Dict[str, Any]: Counts of removed entries and the resulting size.
+    """
+    with _compaction_lock:
+        started = time.perf_counter()
+        flush_hits()
+        data = load_all()
+        ids, metadatas, embeddings = data["ids"], data["metadatas"], data["embeddings"]
+
+        cutoff = time.time() - ttl
+        alive = [i for i, meta in enumerate(metadatas) if entry_ts(meta) >= cutoff]
+        expired = [ids[i] for i in range(len(ids)) if entry_ts(metadatas[i]) < cutoff]
+
+        duplicates = find_duplicates([ids[i] for i in alive], [metadatas[i] for i in alive],
+                                     [embeddings[i] for i in alive], dup_similarity)
+        dropped = set(duplicates)
+        survivors = [i for i in alive if ids[i] not in dropped]
+
+        evicted = []
+        if len(survivors) > max_entries:
+            # LFU, ties broken by least recent use
+            survivors.sort(key=lambda i: (int(metadatas[i].get("hits", 0)),
+                                          float(metadatas[i].get("last_hit", entry_ts(metadatas[i])))))
+            evicted = [ids[i] for i in survivors[:len(survivors) - max_entries]]
+
+        delete_ids(expired + duplicates + evicted)
+
+        last_compaction.clear()
+        last_compaction.update({
+            "at": datetime.now(timezone.utc).isoformat(),
+            "seconds": round(time.perf_counter() - started, 3),
+            "expired": len(expired),
+            "duplicates": len(duplicates),
+            "evicted": len(evicted),
+            "size": len(ids) - len(expired) - len(duplicates) - len(evicted),
+        })
+        set_size({"size": last_compaction["size"], "size_at": last_compaction["at"]})
+        logger.info("verified_cache compaction: %s", last_compaction)
+        return dict(last_compaction)
+
+
+def set_size(entry: Dict[str, Any]):
+    # Замена целиком, чтобы читатель не увидел наполовину обновлённый словарь
+    global last_size
+    last_size = entry
+
+
+def refresh_size() -> Optional[int]:
+    """Count the collection and remember the result for `cache_metrics`."""
+    checked = {"size_at": datetime.now(timezone.utc).isoformat()}
+    try:
+        checked["size"] = cache_collection.count()
+    except Exception as exc:
+        checked.update({"size": None, "size_error": str(exc)})
+    set_size(checked)
+    return checked["size"]
+
+
+def cache_metrics() -> Dict[str, Any]:
+    """Lookup hit rate, the last known collection size and the result of the last compaction.
+
+    Never touches Chroma: the size is the one recorded by the background
+    thread (`refresh_size`, `compact`), so calling this on every UI rerun is free.
+    """
+    with vectorstore._stats_lock:
+        stats = dict(vectorstore.stats)
+    stats.update(dict(last_size))
+    stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+    stats["last_compaction"] = dict(last_compaction)
+    return stats
+
+
+def start_background_compaction(interval: float = VERIFIED_CACHE_COMPACT_INTERVAL) -> Optional[threading.Thread]:
+    """Run `compact` every `interval` seconds in a daemon thread (once per process)."""
+    global _compaction_thread
+    if interval <= 0 or _compaction_thread is not None:
+        return _compaction_thread
+
+    def loop():
+        refresh_size()
+        while True:
+            time.sleep(interval)
+            try:
+                compact()
+            except Exception as exc:
+                logger.warning("verified_cache compaction failed: %s", exc)
+            try:
+                answer_cache.prune()
+            except Exception as exc:
+                logger.warning("answer_cache prune failed: %s", exc)
+
+    _compaction_thread = threading.Thread(target=loop, name="cache-compaction", daemon=True)
+    _compaction_thread.start()
+    return _compaction_thread
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(compact())
+    print(cache_metrics())
@@ -0,0 +1,344 @@
+"""Disk-backed LangGraph checkpointer with bounded history.
+
+`MemorySaver` kept every checkpoint of every session in process memory
+forever, and lost all of them on restart. `SqliteCheckpointer` uses the same
+layout as LangGraph's in-memory saver, but stores it in SQLite:
+    * a checkpoint row holds only the channel versions, not the values;
+    * channel values are stored as blobs keyed by (channel, version), so a
+      checkpoint only writes the channels that changed since its parent;
+    * only the last `max_history` checkpoints of a thread are kept; blobs
+      that are no longer referenced are deleted together with them;
+    * threads that have not been updated for `thread_ttl` seconds are removed.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+
+try:
+    from langgraph.checkpoint.base import get_checkpoint_metadata
+except ImportError:  # older langgraph-checkpoint
+    def get_checkpoint_metadata(config: RunnableConfig, metadata: CheckpointMetadata) -> CheckpointMetadata:
+        return metadata
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", os.path.join(".cache", "checkpoints.sqlite3"))
+CHECKPOINT_MAX_HISTORY = int(os.getenv("CHECKPOINT_MAX_HISTORY", "20"))
+CHECKPOINT_THREAD_TTL = float(os.getenv("CHECKPOINT_THREAD_TTL", str(7 * 24 * 3600)))
+CHECKPOINT_GC_INTERVAL = float(os.getenv("CHECKPOINT_GC_INTERVAL", "600"))
+# Old checkpoints are pruned in batches of this size rather than on every put
+PRUNE_SLACK = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    versions TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE INDEX IF NOT EXISTS checkpoints_created ON checkpoints (thread_id, created_at);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    blob BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class SqliteCheckpointer(BaseCheckpointSaver):
+    """LangGraph checkpointer backed by a single SQLite file.
+
+    Args:
+        path (str): Database file.
+        max_history (int): Checkpoints kept per thread and namespace.
+        thread_ttl (float): Seconds after the last checkpoint before a thread is deleted.
+        gc_interval (float): Minimum seconds between TTL sweeps, run from `put`.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_PATH, max_history: int = CHECKPOINT_MAX_HISTORY,
+                 thread_ttl: float = CHECKPOINT_THREAD_TTL, gc_interval: float = CHECKPOINT_GC_INTERVAL,
+                 serde=None):
+        super().__init__(serde=serde)
+        self.path = path
+        self.max_history = max_history
+        self.thread_ttl = thread_ttl
+        self.gc_interval = gc_interval
+        self._last_gc = 0.0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    # --- reads -----------------------------------------------------------------------------------------------
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> Dict[str, Any]:
+        if not versions:
+            return {}
+        wanted = {(channel, str(version)) for channel, version in versions.items()}
+        rows = self._conn.execute(
+            f"SELECT channel, version, type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? "
+            f"AND channel IN ({','.join('?' * len(versions))})",
+            (thread_id, checkpoint_ns, *versions),
+        ).fetchall()
+        return {
+            channel: self.serde.loads_typed((type_, blob))
+            for channel, version, type_, blob in rows
+            if (channel, version) in wanted and type_ != "empty"
+        }
+
+    def _to_tuple(self, row: Tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, blob, meta_type, meta = row
+        checkpoint = self.serde.loads_typed((type_, blob))
+        writes = self._conn.execute(
+            "SELECT task_id, channel, type, blob FROM writes WHERE thread_id = ? AND checkpoint_ns = ? "
+            "AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint, "channel_values": self._load_blobs(
+                thread_id, checkpoint_ns, checkpoint["channel_versions"])},
+            metadata=self.serde.loads_typed((meta_type, meta)),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((t, b))) for task_id, channel, t, b in writes],
+            parent_config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                            "checkpoint_id": parent_id}} if parent_id else None,
+        )
+
+    _COLUMNS = "thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self._conn.execute(
+                    f"SELECT {self._COLUMNS} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "AND checkpoint_id = ?", (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    f"SELECT {self._COLUMNS} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1", (thread_id, checkpoint_ns),
+                ).fetchone()
+            return self._to_tuple(row) if row else None
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        query, params = f"SELECT {self._COLUMNS} FROM checkpoints WHERE 1 = 1", []
+        if config is not None:
+            query += " AND thread_id = ?"
+            params.append(config["configurable"]["thread_id"])
+            if "checkpoint_ns" in config["configurable"]:
+                query += " AND checkpoint_ns = ?"
+                params.append(config["configurable"]["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                query += " AND checkpoint_id = ?"
+                params.append(checkpoint_id)
+        if before is not None and (before_id := get_checkpoint_id(before)):
+            query += " AND checkpoint_id < ?"
+            params.append(before_id)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        count = 0
+        for row in rows:
+            if limit is not None and count >= limit:
+                break
+            with self._lock:
+                item = self._to_tuple(row)
+            if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            count += 1
+            yield item
+
+    # --- writes ----------------------------------------------------------------------------------------------
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        c = checkpoint.copy()
+        values = c.pop("channel_values")
+        # Only channels updated since the parent are written
+        blobs = [
+            (thread_id, checkpoint_ns, channel, str(version),
+             *(self.serde.dumps_typed(values[channel]) if channel in values else ("empty", None)))
+            for channel, version in new_versions.items()
+        ]
+        type_, blob = self.serde.dumps_typed(c)
+        meta_type, meta = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        versions = json.dumps({k: str(v) for k, v in checkpoint["channel_versions"].items()})
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", blobs)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                     type_, blob, meta_type, meta, versions, time.time()),
+                )
+                self._prune(thread_id, checkpoint_ns)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        if time.monotonic() - self._last_gc >= self.gc_interval:
+            self._last_gc = time.monotonic()
+            self.gc()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, write_idx, channel,
+                         *self.serde.dumps_typed(value), task_path, write_idx >= 0))
+        with self._lock:
+            for *row, keep_existing in rows:
+                # Regular writes are idempotent per (task, idx); special channels overwrite
+                verb = "INSERT OR IGNORE" if keep_existing else "INSERT OR REPLACE"
+                self._conn.execute(f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    # --- bounds ----------------------------------------------------------------------------------------------
+
+    def _prune(self, thread_id: str, checkpoint_ns: str):
+        """Keep the newest `max_history` checkpoints; drop the rest with their writes and orphaned blobs."""
+        count = self._conn.execute(
+            "SELECT COUNT(*) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+            (thread_id, checkpoint_ns),
+        ).fetchone()[0]
+        if count <= self.max_history + PRUNE_SLACK:
+            return
+        old = [r[0] for r in self._conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.max_history),
+        )]
+        self._conn.executemany(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            [(thread_id, checkpoint_ns, cid) for cid in old])
+        self._conn.executemany(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            [(thread_id, checkpoint_ns, cid) for cid in old])
+
+        referenced = set()
+        for (versions,) in self._conn.execute(
+                "SELECT versions FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns)):
+            referenced.update(json.loads(versions).items())
+        orphaned = [
+            (thread_id, checkpoint_ns, channel, version)
+            for channel, version in self._conn.execute(
+                "SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns))
+            if (channel, version) not in referenced
+        ]
+        self._conn.executemany(
+            "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?", orphaned)
+
+    def gc(self) -> int:
+        """Delete threads whose newest checkpoint is older than `thread_ttl`; returns how many."""
+        with self._lock:
+            expired = [r[0] for r in self._conn.execute(
+                "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(created_at) < ?",
+                (time.time() - self.thread_ttl,),
+            )]
+        for thread_id in expired:
+            self.delete_thread(thread_id)
+        if expired:
+            logger.info("checkpoint gc: removed %d expired threads", len(expired))
+        return len(expired)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for table in ("checkpoints", "blobs", "writes"):
+                self._conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            self._conn.execute("COMMIT")
+
+    def get_next_version(self, current: Optional[str], channel: Any) -> str:
+        # Same scheme as the in-memory saver: sortable counter plus a random tiebreak
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(str(current).split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # --- async: SQLite calls run in a worker thread to keep the event loop free ------------------------------
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items: List[CheckpointTuple] = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
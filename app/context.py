@@ -0,0 +1,170 @@
+"""Token budgets for node prompts.
+
+`messages` and `data` only ever grow, and every node used to pass the whole
+message history as `agent_scratchpad` (the checker also stringified the
+whole `data` dict). The context manager selects the messages each node
+needs, deduplicates retrieved snippets, trims everything to a per-node token
+budget and records how many tokens were saved.
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage
+
+from evidence import dedupe_snippets
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on prompt tokens for any node. The backend is chosen by the model
+# router after the prompt is built, so this must fit the smallest context window.
+CONTEXT_MODEL_BUDGET = int(os.getenv("CONTEXT_MODEL_BUDGET", "24000"))
+CONTEXT_MESSAGE_MAX_TOKENS = int(os.getenv("CONTEXT_MESSAGE_MAX_TOKENS", "1500"))
+
+# Input budget (tokens) and scratchpad policy per node:
+#   last  - how many recent messages the node may see;
+#   human - always keep the latest user message.
+NODE_POLICIES: Dict[str, Dict[str, Any]] = {
+    "simple": {"budget": 4000, "last": 6, "human": True},
+    "retriever": {"budget": 3000, "last": 2, "human": True},
+    "checker": {"budget": 12000, "last": 4, "human": True},
+    "counter_argument": {"budget": 3000, "last": 2, "human": True},
+    "synthesizer": {"budget": 16000, "last": 8, "human": True},
+}
+
+# Служебные заметки графа, которые модели видеть не нужно
+NOTE_PREFIXES = ("[cache]", "[router]", "[rerank]", "[planner]")
+
+TRUNCATED = " …[truncated]"
+
+
+def _load_encoding():
+    try:
+        import tiktoken
+    except ImportError:  # pragma: no cover - tiktoken comes with langchain-openai
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as exc:
+        # Файл кодировки скачивается при первом обращении; без сети считаем приблизительно
+        logger.warning("tiktoken encoding unavailable, estimating 4 chars per token: %s", exc)
+        return None
+
+
+_encoding = _load_encoding()
+
+if _encoding is not None:
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text, disallowed_special=()))
+
+    def truncate_tokens(text: str, max_tokens: int) -> str:
+        tokens = _encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return _encoding.decode(tokens[:max_tokens]) + TRUNCATED
+else:
+    def count_tokens(text: str) -> int:
+        return max(len(text) // 4, 1) if text else 0
+
+    def truncate_tokens(text: str, max_tokens: int) -> str:
+        if len(text) <= max_tokens * 4:
+            return text
+        return text[:max_tokens * 4] + TRUNCATED
+
+
+def message_text(message: BaseMessage) -> str:
+    return message.content if isinstance(message.content, str) else str(message.content)
+
+
+def count_message_tokens(messages: List[BaseMessage]) -> int:
+    # ~4 tokens of per-message overhead in the chat format
+    return sum(count_tokens(message_text(m)) + 4 for m in messages)
+
+
+class ContextManager:
+    """Fits node inputs into their token budgets and tracks the savings."""
+
+    def __init__(self, policies: Optional[Dict[str, Dict[str, Any]]] = None,
+                 model_budget: int = CONTEXT_MODEL_BUDGET):
+        self.policies = policies or NODE_POLICIES
+        self.model_budget = model_budget
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def budget(self, node: str) -> int:
+        return min(self.policies.get(node, {}).get("budget", self.model_budget), self.model_budget)
+
+    def record(self, node: str, before: int, after: int):
+        with self._lock:
+            stats = self.stats.setdefault(node, {"calls": 0, "tokens_in": 0, "tokens_sent": 0, "tokens_saved": 0})
+            stats["calls"] += 1
+            stats["tokens_in"] += before
+            stats["tokens_sent"] += after
+            stats["tokens_saved"] += max(before - after, 0)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {node: dict(stats) for node, stats in self.stats.items()}
+
+    def scratchpad(self, node: str, messages: List[BaseMessage], input_text: str = "") -> List[BaseMessage]:
+        """Messages `node` needs, newest first under the budget left after `input_text`."""
+        policy = self.policies.get(node, {})
+        before = count_message_tokens(messages)
+        available = self.budget(node) - count_tokens(input_text)
+
+        relevant = [m for m in messages if not message_text(m).startswith(NOTE_PREFIXES)]
+        selected = relevant[-policy["last"]:] if policy.get("last") else list(relevant)
+        if policy.get("human"):
+            humans = [m for m in relevant if isinstance(m, HumanMessage)]
+            if humans and humans[-1] not in selected:
+                selected = [humans[-1]] + selected
+
+        fitted: List[BaseMessage] = []
+        used = 0
+        for message in reversed(selected):
+            text = truncate_tokens(message_text(message), CONTEXT_MESSAGE_MAX_TOKENS)
+            cost = count_tokens(text) + 4
+            if used + cost > available:
+                break
+            fitted.append(message if text == message.content else message.model_copy(update={"content": text}))
+            used += cost
+        fitted.reverse()
+
+        self.record(node, before, used)
+        return fitted
+
+    def fit_text(self, node: str, text: str, share: float = 1.0) -> str:
+        """Truncate a prompt input to `share` of the node budget."""
+        limit = int(self.budget(node) * share)
+        fitted = truncate_tokens(text, limit)
+        self.record(node, count_tokens(text), count_tokens(fitted))
+        return fitted
+
+    def compact_data(self, node: str, data: Dict[str, Any], share: float = 0.7) -> str:
+        """Render retrieved data as text: snippets deduplicated across sub-queries,
+        budget split evenly between sub-queries."""
+        before = count_tokens(str(data))
+        if not data:
+            self.record(node, before, 0)
+            return ""
+
+        per_query = max(int(self.budget(node) * share) // len(data), 64)
+        seen: set = set()
+        sections = []
+        for sq, items in data.items():
+            items = items if isinstance(items, list) else [items]
+            snippets = dedupe_snippets([str(i) for i in items], seen)
+            if snippets:
+                body = truncate_tokens("\n".join(snippets), per_query)
+            else:
+                body = "(covered above)" if items else "(no data)"
+            sections.append(f"## {sq}\n{body}")
+        text = "\n\n".join(sections)
+
+        self.record(node, before, count_tokens(text))
+        return text
+
+
+context = ContextManager()
@@ -0,0 +1,79 @@
+"""Local text embeddings shared by the router, caches and reranker.
+
+Uses Chroma's default embedding function (all-MiniLM-L6-v2 over ONNX), so
+the vectors match what the Chroma collections compute server-side and no
+extra model download or API call is needed.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Sequence
+
+import numpy as np
+
+from resources import registry
+
+EMBEDDING_MEMO_SIZE = int(os.getenv("EMBEDDING_MEMO_SIZE", "10000"))
+
+_memo: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def create_embedding_function():
+    from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+    return DefaultEmbeddingFunction()
+
+
+# Загрузка ONNX-модели занимает секунды, поэтому прогреваем её в фоне при старте
+registry.register("embeddings", create_embedding_function, warmup=lambda ef: ef(["warm-up"]))
+
+
+def get_embedding_function():
+    return registry.get("embeddings")
+
+
+def embed(texts: Sequence[str]) -> np.ndarray:
+    """Embed texts in one batch; returns an (n, dim) float32 array of unit vectors."""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    vectors = np.asarray(get_embedding_function()(list(texts)), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def embed_one(text: str) -> List[float]:
+    return embed([text])[0].tolist()
+
+
+def embed_cached(texts: Sequence[str]) -> np.ndarray:
+    """`embed` with a process-wide LRU memo keyed by text hash.
+
+    Only texts not seen recently are sent to the model, in a single batch.
+    """
+    keys = [hashlib.sha1(t.encode()).hexdigest() for t in texts]
+    vectors: List[np.ndarray] = [None] * len(texts)
+    missing = {}
+    with _memo_lock:
+        for i, key in enumerate(keys):
+            vector = _memo.get(key)
+            if vector is not None:
+                _memo.move_to_end(key)
+                vectors[i] = vector
+            else:
+                missing.setdefault(key, []).append(i)
+
+    if missing:
+        computed = embed([texts[idx[0]] for idx in missing.values()])
+        with _memo_lock:
+            for (key, indexes), vector in zip(missing.items(), computed):
+                _memo[key] = vector
+                for i in indexes:
+                    vectors[i] = vector
+            while len(_memo) > EMBEDDING_MEMO_SIZE:
+                _memo.popitem(last=False)
+
+    if not vectors:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack(vectors)
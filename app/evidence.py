@@ -0,0 +1,60 @@
+"""Helpers for cleaning up search and scrape output before it reaches prompts."""
+
+import hashlib
+import re
+from typing import Iterable, List, Optional, Set
+
+_SPLIT_RE = re.compile(r"(?<=[.!?…])\s+|\n+|\s*\.\.\.\s*")
+_WS_RE = re.compile(r"\s+")
+
+MIN_SNIPPET_CHARS = 20
+
+
+def normalize_text(text: str) -> str:
+    return _WS_RE.sub(" ", text).strip().lower()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode()).hexdigest()
+
+
+def split_snippets(text: str) -> List[str]:
+    """Split a search or scrape result into sentence-sized snippets."""
+    return [s.strip() for s in _SPLIT_RE.split(text) if s and s.strip()]
+
+
+def dedupe_snippets(outputs: Iterable[str], seen: Optional[Set[str]] = None) -> List[str]:
+    """Drop snippets that already appeared in earlier outputs.
+
+    DuckDuckGo returns overlapping result lists for similar queries, so the
+    same sentence often shows up in several outputs. Each output is split
+    into snippets, snippets whose normalized hash is in `seen` are removed,
+    and outputs left empty are dropped entirely.
+
+    Args:
+        outputs (Iterable[str]): Raw tool outputs, in priority order.
+        seen (Optional[Set[str]]): Hashes shared between calls. Updated in place.
+
+    Returns:
+        List[str]: Outputs with repeated snippets removed.
+    """
+    if seen is None:
+        seen = set()
+
+    result = []
+    for output in outputs:
+        if not isinstance(output, str):
+            output = str(output)
+        kept = []
+        for snippet in split_snippets(output):
+            if len(snippet) < MIN_SNIPPET_CHARS:
+                kept.append(snippet)
+                continue
+            h = text_hash(snippet)
+            if h in seen:
+                continue
+            seen.add(h)
+            kept.append(snippet)
+        if any(len(s) >= MIN_SNIPPET_CHARS for s in kept):
+            result.append(" ".join(kept))
+    return result
@@ -0,0 +1,324 @@
+"""Shared HTTP fetcher for scraping pages.
+
+Every scrape used to be a bare `requests.get` that downloaded the whole page
+and parsed the full DOM with BeautifulSoup just to keep the first couple of
+thousand characters. The fetcher keeps pooled keep-alive connections per
+host, caches extracted text on disk with TTL and LRU eviction, revalidates
+stale entries with conditional GET, stops reading the body once the byte
+budget is reached and extracts text with a streaming stdlib parser.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from resources import registry
+from throttle import governor
+
+logger = logging.getLogger(__name__)
+
+FETCH_TIMEOUT = float(os.getenv("SCRAPE_TIMEOUT", "15"))
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", "262144"))
+FETCH_MAX_CHARS = int(os.getenv("FETCH_MAX_CHARS", "8000"))
+FETCH_POOL_HOSTS = int(os.getenv("FETCH_POOL_HOSTS", "32"))
+FETCH_POOL_PER_HOST = int(os.getenv("FETCH_POOL_PER_HOST", "8"))
+FETCH_CACHE_DIR = os.getenv("FETCH_CACHE_DIR", os.path.join(".cache", "fetch"))
+FETCH_CACHE_TTL = float(os.getenv("FETCH_CACHE_TTL", "86400"))
+FETCH_CACHE_MAX_ENTRIES = int(os.getenv("FETCH_CACHE_MAX_ENTRIES", "5000"))
+
+USER_AGENT = "Mozilla/5.0 (compatible; team4-chat/0.1)"
+
+_SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "head"}
+_BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article"}
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class _TextExtractor(HTMLParser):
+    """Collects visible text and stops as soon as `max_chars` are gathered."""
+
+    def __init__(self, max_chars: Optional[int]):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.parts = []
+        self.size = 0
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        text = data.strip()
+        if not text:
+            return
+        self.parts.append(text + " ")
+        self.size += len(text) + 1
+        if self.max_chars is not None and self.size >= self.max_chars:
+            raise _StopParsing
+
+
+def html_to_text(html: str, max_chars: Optional[int] = None) -> str:
+    """Extract visible text from HTML without building a DOM.
+
+    Args:
+        html (str): Raw HTML.
+        max_chars (Optional[int]): Stop parsing once this many characters are collected.
+
+    Returns:
+        str: Extracted text, at most `max_chars` long.
+    """
+    parser = _TextExtractor(max_chars)
+    try:
+        parser.feed(html)
+        parser.close()
+    except _StopParsing:
+        pass
+    lines = (" ".join(line.split()) for line in "".join(parser.parts).split("\n"))
+    text = "\n".join(line for line in lines if line)
+    return text[:max_chars] if max_chars is not None else text
+
+
+@dataclass
+class FetchResult:
+    url: str
+    status: int
+    text: str
+    from_cache: bool = False
+
+
+class DiskCache:
+    """Extracted page text on disk, one JSON file per URL.
+
+    Entries older than `ttl` are stale but are kept for conditional GET.
+    File mtime doubles as the LRU clock: it is bumped on every hit and the
+    least recently used files are removed once `max_entries` is exceeded.
+    """
+
+    def __init__(self, path: str = FETCH_CACHE_DIR, ttl: float = FETCH_CACHE_TTL,
+                 max_entries: int = FETCH_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        path = self._file(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        entry["fresh"] = time.time() - entry.get("stored_at", 0) < self.ttl
+        return entry
+
+    def set(self, key: str, entry: Dict):
+        entry = {k: v for k, v in entry.items() if k != "fresh"}
+        entry["stored_at"] = time.time()
+        path = self._file(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as exc:
+            logger.warning("fetch cache write failed: %s", exc)
+            return
+        with self._lock:
+            self._writes += 1
+            check = self._writes % 50 == 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries above `max_entries`."""
+        with self._lock:
+            try:
+                files = [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith(".json")]
+            except OSError:
+                return
+            excess = len(files) - self.max_entries
+            if excess <= 0:
+                return
+            files.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+            for p in files[:excess]:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+
+def _encoding(content_type: str) -> str:
+    for part in content_type.split(";"):
+        part = part.strip()
+        if part.lower().startswith("charset="):
+            return part[8:].strip("\"'")
+    return "utf-8"
+
+
+class Fetcher:
+    """Pooled, cached page fetcher shared by all nodes and sessions."""
+
+    def __init__(self, cache: Optional[DiskCache] = None, max_bytes: int = FETCH_MAX_BYTES,
+                 max_chars: int = FETCH_MAX_CHARS, timeout: float = FETCH_TIMEOUT):
+        self.cache = cache or DiskCache()
+        self.max_bytes = max_bytes
+        # Узлы берут первые SCRAPE_MAX_CHARS символов; парсер останавливается на лимите (0 - без лимита)
+        self.max_chars = max_chars or None
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=FETCH_POOL_HOSTS, pool_maxsize=FETCH_POOL_PER_HOST)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = USER_AGENT
+
+        # Пул httpx привязан к циклу, в котором открыты соединения: свой клиент на каждый цикл
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = \
+            weakref.WeakKeyDictionary()
+        self._async_lock = threading.Lock()
+        self.limiter = governor.get("scrape")
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """httpx client of the running event loop, created on first use in that loop."""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = httpx.AsyncClient(
+                    timeout=self.timeout,
+                    follow_redirects=True,
+                    headers={"User-Agent": USER_AGENT},
+                    limits=httpx.Limits(max_connections=FETCH_POOL_HOSTS * FETCH_POOL_PER_HOST,
+                                        max_keepalive_connections=FETCH_POOL_HOSTS),
+                )
+        return client
+
+    @staticmethod
+    def _conditional_headers(entry: Optional[Dict]) -> Dict[str, str]:
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def _store(self, url: str, status: int, headers, body: bytes) -> str:
+        html = body.decode(_encoding(headers.get("content-type", "")), errors="replace")
+        text = html_to_text(html, self.max_chars)
+        if status == 200:
+            self.cache.set(url, {
+                "url": url,
+                "status": status,
+                "text": text,
+                "etag": headers.get("etag"),
+                "last_modified": headers.get("last-modified"),
+            })
+        return text
+
+    def fetch(self, url: str) -> FetchResult:
+        """Fetch a page and return its text, serving from cache when possible."""
+        entry = self.cache.get(url)
+        if entry and entry["fresh"]:
+            return FetchResult(url, entry["status"], entry["text"], from_cache=True)
+        return self.limiter.call(self._get, url, entry)
+
+    def _get(self, url: str, entry: Optional[Dict]) -> FetchResult:
+        with self.session.get(url, headers=self._conditional_headers(entry), timeout=self.timeout,
+                              stream=True) as response:
+            if response.status_code == 304 and entry:
+                self.cache.set(url, entry)
+                return FetchResult(url, entry["status"], entry["text"], from_cache=True)
+
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=16384):
+                body += chunk
+                if len(body) >= self.max_bytes:
+                    break
+            text = self._store(url, response.status_code, response.headers, bytes(body[:self.max_bytes]))
+            return FetchResult(url, response.status_code, text)
+
+    async def afetch(self, url: str) -> FetchResult:
+        """Async counterpart of `fetch` using the httpx client of the running loop.
+
+        The disk cache and HTML parsing run in worker threads, so a slow disk
+        or a large page does not stall the other sessions on the loop.
+        """
+        entry = await asyncio.to_thread(self.cache.get, url)
+        if entry and entry["fresh"]:
+            return FetchResult(url, entry["status"], entry["text"], from_cache=True)
+        return await self.limiter.acall(self._aget, url, entry)
+
+    async def _aget(self, url: str, entry: Optional[Dict]) -> FetchResult:
+        async with self.async_client.stream("GET", url, headers=self._conditional_headers(entry)) as response:
+            status, headers = response.status_code, response.headers
+            body = bytearray()
+            if not (status == 304 and entry):
+                async for chunk in response.aiter_bytes(chunk_size=16384):
+                    body += chunk
+                    if len(body) >= self.max_bytes:
+                        break
+
+        if status == 304 and entry:
+            await asyncio.to_thread(self.cache.set, url, entry)
+            return FetchResult(url, entry["status"], entry["text"], from_cache=True)
+        text = await asyncio.to_thread(self._store, url, status, headers, bytes(body[:self.max_bytes]))
+        return FetchResult(url, status, text)
+
+    async def aclose(self):
+        """Close the httpx client of the running loop; call it before the loop stops."""
+        with self._async_lock:
+            client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+registry.register("fetcher", Fetcher)
+fetcher = registry.lazy("fetcher")
+
+
+async def aclose_loop_client():
+    """Close the running loop's httpx client, if the fetcher was ever created."""
+    instance = registry.peek("fetcher")
+    if instance is not None:
+        await instance.aclose()
+
+
+def fetch_text(url: str, max_chars: Optional[int] = None) -> str:
+    text = fetcher.fetch(url).text
+    return text[:max_chars] if max_chars is not None else text
+
+
+async def afetch_text(url: str, max_chars: Optional[int] = None) -> str:
+    text = (await fetcher.afetch(url)).text
+    return text[:max_chars] if max_chars is not None else text
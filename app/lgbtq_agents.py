@@ -5,9 +5,12 @@ from langchain_openai import ChatOpenAI
 from langchain.agents import initialize_agent, AgentType
 from langgraph.graph import StateGraph, END
 
-import requests
-from bs4 import BeautifulSoup
-from typing import Dict, List, Any
+from fetcher import fetcher, FETCH_CACHE_TTL, FETCH_TIMEOUT
+from parallel import run_parallel
+from resources import registry
+from throttle import governor
+from page_index import InvertedIndex
+from typing import Dict, Iterable, List, Any, Optional
 
 
 TRUSTED_SOURCES: Dict[str, List[str]] = {
@@ -29,44 +32,94 @@ TRUSTED_SOURCES: Dict[str, List[str]] = {
 }
 
 
-def fetch_from_source(url: str, query: str) -> str:
-    """Simple placeholder search request to a trusted source URL.
+class TrustedSearch:
+    """Category-aware search over TRUSTED_SOURCES.
+
+    Pages of the requested category are fetched concurrently through the
+    shared cached fetcher, indexed once and re-fetched only after
+    `ttl` seconds; every lookup after that is answered from the index.
+    """
+
+    def __init__(self, sources: Dict[str, List[str]] = TRUSTED_SOURCES, ttl: float = FETCH_CACHE_TTL):
+        self.sources = sources
+        self.ttl = ttl
+        self.index = InvertedIndex()
+        # Ошибки пишутся из потоков refresh; под той же блокировкой, что и индекс
+        self._lock = self.index._lock
+        self.errors: Dict[str, str] = {}
+
+    def _fetch(self, url: str):
+        response = fetcher.fetch(url)
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+        self.index.add(url, response.text)
+
+    def refresh(self, urls: List[str]):
+        """Fetch and index the pages that are missing or stale, all at once."""
+        stale = [url for url in urls if not self.index.fresh(url, self.ttl)]
+        for res in run_parallel(self._fetch, stale, max_workers=max(len(stale), 1), timeout=FETCH_TIMEOUT * 2):
+            with self._lock:
+                if res.ok:
+                    self.errors.pop(res.item, None)
+                else:
+                    self.errors[res.item] = "timeout" if res.timed_out else str(res.error)
+
+    def errors_for(self, urls: Iterable[str]) -> Dict[str, str]:
+        """Last fetch error of each of `urls` that failed, as a copy."""
+        with self._lock:
+            return {url: self.errors[url] for url in urls if url in self.errors}
+
+    def search(self, query: str, category: Optional[str] = None, k: int = 5) -> List[Dict[str, Any]]:
+        """Ranked results for `query` from one category, or from every source."""
+        categories = [category] if category else list(self.sources)
+        urls = [url for c in categories for url in self.sources.get(c, [])]
+        self.refresh(urls)
+        results = self.index.search(query, urls=urls, k=k)
+        category_of = {url: c for c in categories for url in self.sources.get(c, [])}
+        for result in results:
+            result["category"] = category_of[result["url"]]
+        return results
+
+
+def format_results(results: List[Dict[str, Any]], errors: Dict[str, str]) -> str:
+    if not results:
+        failed = "; ".join(f"{url}: {err}" for url, err in errors.items())
+        return "Ничего не найдено" + (f" (ошибки: {failed})" if failed else "")
+    return "\n\n".join(
+        f"{i}. 🔎 {r['url']} [{r['category']}, score {r['score']}]\n{r['snippet']}"
+        for i, r in enumerate(results, 1)
+    )
+
+
+registry.register("trusted_search", TrustedSearch)
+trusted_search = registry.lazy("trusted_search")
+
 
-    Performs a raw GET request and tries to find the query text.
-    Used only as a stub, should be replaced with real search providers.
+def fetch_from_source(url: str, query: str) -> str:
+    """Search a single trusted source URL.
 
     Args:
         url (str): Target trusted URL.
         query (str): Search query string.
 
     Returns:
-        str: Extracted text preview or a placeholder result.
+        str: Matching snippet or a placeholder result.
     """
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code != 200:
-            return f"Ошибка при доступе: {url}"
-
-        soup = BeautifulSoup(response.text, "html.parser")
-        text = soup.get_text()
-
-        if query.lower() in text.lower():
-            return (
-                f"🔎 Найдено на {url}:\n"
-                f"{text[:800]}\n...\n(Обрезано, заглушка)"
-            )
-
+    trusted_search.refresh([url])
+    # Устаревшая страница в индексе лучше ошибки повторной загрузки
+    results = trusted_search.index.search(query, urls=[url], k=1)
+    if not results and trusted_search.errors_for([url]):
+        return f"Ошибка при доступе: {url}"
+    if not results:
         return f"Ничего не найдено на {url}"
-
-    except Exception as exc:
-        return f"Ошибка: {str(exc)}"
+    return f"🔎 Найдено на {url}:\n{results[0]['snippet']}"
 
 
 def generate_search_tools() -> List[Tool]:
-    """Generate LangChain search tools for all trusted source categories.
+    """Generate LangChain search tools, one per trusted source category.
 
-    Creates a Tool for each URL in each category. Functions are minimal
-    and only provide placeholder functionality.
+    Each tool queries all sources of its category concurrently and returns
+    ranked results from the shared index.
 
     Returns:
         List[Tool]: List of LangChain tools.
@@ -74,15 +127,13 @@ def generate_search_tools() -> List[Tool]:
     tools = []
 
     for category, urls in TRUSTED_SOURCES.items():
-        for url in urls:
-            sanitized = url.replace("https://", "").replace(".", "_")
-
-            tool = Tool(
-                name=f"search_{category}_{sanitized}",
-                func=lambda q, url=url: fetch_from_source(url, q),
-                description=f"Stub search tool for category '{category}' using URL: {url}."
-            )
-            tools.append(tool)
+        tool = Tool(
+            name=f"search_{category}",
+            func=lambda q, category=category, urls=urls: format_results(trusted_search.search(q, category),
+                                                                        trusted_search.errors_for(urls)),
+            description=f"Ranked search over trusted {category} sources: {', '.join(urls)}."
+        )
+        tools.append(tool)
 
     return tools
 
@@ -90,13 +141,14 @@ def generate_search_tools() -> List[Tool]:
 def init_search_agent() -> Any:
     """Initialize a simple LangChain search agent (stub).
 
-    The agent uses ReAct (ZERO_SHOT_REACT_DESCRIPTION) and a set of
-    placeholder search tools. This is not a production search agent.
+    The agent uses ReAct (ZERO_SHOT_REACT_DESCRIPTION) and the
+    per-category trusted search tools. It is built once per process via
+    the resource registry, see `search_step`.
 
     Returns:
         Any: Initialized agent instance.
     """
-    llm = ChatOpenAI(model="gpt-4.1", temperature=0)
+    llm = ChatOpenAI(model="gpt-4.1", temperature=0, rate_limiter=governor.rate_limiter("openai"))
     tools = generate_search_tools()
 
     agent = initialize_agent(
@@ -109,6 +161,9 @@ def init_search_agent() -> Any:
     return agent
 
 
+registry.register("lgbtq_search_agent", init_search_agent)
+
+
 class SearchState(dict):
     """State object for LangGraph search pipeline.
 
@@ -132,7 +187,7 @@ def search_step(state: SearchState) -> SearchState:
     Returns:
         SearchState: Updated state with a search result.
     """
-    agent = init_search_agent()
+    agent = registry.get("lgbtq_search_agent")
     result = agent.run(state["query"])
     return {"result": result}
 
@@ -0,0 +1,175 @@
+"""Response cache for the prompt | llm runnables.
+
+Two levels:
+    * exact - keyed on model, temperature, bound tools, system prompt and the
+      rendered input messages; kept in memory and in SQLite with a TTL;
+    * semantic (optional) - nearest neighbour of the human input in a Chroma
+      collection, accepted only under a distance threshold. Only the router
+      enables it: its output is a label, so a near-duplicate input is safe to
+      reuse, while plans and answers depend on details embeddings blur.
+
+Responses served from cache carry `response_metadata["cache_hit"]` set to
+"exact" or "semantic", so nodes can surface the hit in `state["messages"]`.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, message_to_dict, messages_from_dict
+
+from search_cache import LRUCache, SqliteTTLCache
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "llm.sqlite3"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_SEMANTIC_MAX_DISTANCE = float(os.getenv("LLM_SEMANTIC_MAX_DISTANCE", "0.05"))
+
+_memory = LRUCache(LLM_CACHE_SIZE)
+_store: Optional[SqliteTTLCache] = None
+_semantic_collection = None
+
+
+def get_store() -> SqliteTTLCache:
+    global _store
+    if _store is None:
+        _store = SqliteTTLCache(LLM_CACHE_PATH, table="llm_cache")
+    return _store
+
+
+def get_semantic_collection():
+    global _semantic_collection
+    if _semantic_collection is None:
+        from vectorstore import client
+        _semantic_collection = client.get_or_create_collection(
+            name="llm_cache", metadata={"hnsw:space": "cosine"}
+        )
+    return _semantic_collection
+
+
+def cache_hit(result: Any) -> Optional[str]:
+    """Cache level ("exact" or "semantic") that served the result, None on a miss."""
+    return (getattr(result, "response_metadata", None) or {}).get("cache_hit")
+
+
+def _describe(messages: List[BaseMessage]) -> List[List[str]]:
+    # Only type and content: ids and metadata differ between runs
+    return [[m.type, m.content if isinstance(m.content, str) else json.dumps(m.content, default=str)]
+            for m in messages]
+
+
+class CachedRunnable:
+    """Wraps a `prompt | llm` chain with the two-level response cache.
+
+    Args:
+        chain: The runnable to call on a miss.
+        prompt: The ChatPromptTemplate at the head of `chain`, used to render inputs.
+        llm: The chat model, for the model name and temperature in the key.
+        name (str): Runnable name, scopes both cache levels.
+        tools (List): Tools bound to the model; part of the key.
+        ttl (float): Entry lifetime in seconds. 0 disables caching.
+        semantic (bool): Also look up near-duplicate inputs in Chroma.
+    """
+
+    def __init__(self, chain, prompt, llm, name: str, tools=None, ttl: float = LLM_CACHE_TTL,
+                 semantic: bool = False):
+        self.chain = chain
+        self.prompt = prompt
+        self.name = name
+        self.ttl = ttl
+        self.semantic = semantic
+        self.enabled = LLM_CACHE_ENABLED and ttl > 0
+        self.model = getattr(llm, "model_name", None) or getattr(llm, "model", "") or type(llm).__name__
+        self.scope = {
+            "runnable": name,
+            "model": self.model,
+            "temperature": getattr(llm, "temperature", None),
+            "tools": sorted(getattr(t, "name", str(t)) for t in tools or []),
+        }
+
+    def _key(self, inputs: Dict[str, Any]) -> str:
+        rendered = _describe(self.prompt.format_messages(**inputs))
+        payload = json.dumps({**self.scope, "messages": rendered}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @staticmethod
+    def _load(raw: str, kind: str) -> AIMessage:
+        message = messages_from_dict([json.loads(raw)])[0]
+        message.response_metadata = {**message.response_metadata, "cache_hit": kind}
+        return message
+
+    def _semantic_where(self) -> Dict[str, Any]:
+        return {"$and": [
+            {"runnable": self.name},
+            {"model": self.model},
+            {"expires_at": {"$gt": time.time()}},
+        ]}
+
+    def lookup(self, inputs: Dict[str, Any]) -> tuple:
+        """Return (key, cached message or None)."""
+        key = self._key(inputs)
+        raw = _memory.get(key)
+        if raw is not None:
+            return key, self._load(raw, "exact")
+        raw = get_store().get(key)
+        if raw is not None:
+            _memory.set(key, raw, self.ttl)
+            return key, self._load(raw, "exact")
+
+        if self.semantic and not inputs.get("agent_scratchpad"):
+            try:
+                res = get_semantic_collection().query(
+                    query_texts=[str(inputs.get("input", ""))], n_results=1, where=self._semantic_where()
+                )
+                if res["ids"] and res["ids"][0] and res["distances"][0][0] <= LLM_SEMANTIC_MAX_DISTANCE:
+                    raw = get_store().get(res["metadatas"][0][0]["key"])
+                    if raw is not None:
+                        return key, self._load(raw, "semantic")
+            except Exception as exc:
+                logger.warning("semantic LLM cache lookup failed: %s", exc)
+        return key, None
+
+    def store(self, key: str, inputs: Dict[str, Any], result: Any):
+        if not isinstance(result, AIMessage):
+            return
+        raw = json.dumps(message_to_dict(result), ensure_ascii=False, default=str)
+        _memory.set(key, raw, self.ttl)
+        get_store().set(key, raw, self.ttl)
+
+        if self.semantic and not inputs.get("agent_scratchpad"):
+            try:
+                get_semantic_collection().upsert(
+                    ids=[key],
+                    documents=[str(inputs.get("input", ""))],
+                    metadatas=[{"runnable": self.name, "model": self.model, "key": key,
+                                "expires_at": time.time() + self.ttl}],
+                )
+            except Exception as exc:
+                logger.warning("semantic LLM cache write failed: %s", exc)
+
+    def invoke(self, inputs: Dict[str, Any], config=None, **kwargs) -> Any:
+        if not self.enabled:
+            return self.chain.invoke(inputs, config, **kwargs)
+        key, cached = self.lookup(inputs)
+        if cached is not None:
+            return cached
+        result = self.chain.invoke(inputs, config, **kwargs)
+        self.store(key, inputs, result)
+        return result
+
+    async def ainvoke(self, inputs: Dict[str, Any], config=None, **kwargs) -> Any:
+        if not self.enabled:
+            return await self.chain.ainvoke(inputs, config, **kwargs)
+        key, cached = await asyncio.to_thread(self.lookup, inputs)
+        if cached is not None:
+            return cached
+        result = await self.chain.ainvoke(inputs, config, **kwargs)
+        await asyncio.to_thread(self.store, key, inputs, result)
+        return result
@@ -0,0 +1,406 @@
+"""Per-request traces and process-wide metrics for nodes, LLM calls and tools.
+
+Every graph node, every `create_runnable` chain and every tool call is timed.
+Spans are collected into a per-request `Trace` (shown in the UI). They are
+also aggregated into Prometheus-style counters and histograms, and finished
+requests are logged as one JSON line on the `metrics` logger.
+
+The trace for a request is looked up by the LangGraph thread id, and the
+node that is currently running is kept in a context variable. As a result,
+LLM and tool spans started inside a node, including in worker threads
+started by `parallel.run_parallel`, are attributed to that node.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langgraph.config import get_config
+
+from context import count_tokens
+from llm_cache import cache_hit
+
+logger = logging.getLogger("metrics")
+
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "200"))
+# Optional price table: {"model": [usd per 1k prompt tokens, usd per 1k completion tokens]}
+LLM_PRICES: Dict[str, List[float]] = json.loads(os.getenv("LLM_PRICES", "{}"))
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _labels_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Metrics:
+    """Minimal thread-safe counters and histograms with Prometheus text export."""
+
+    def __init__(self, prefix: str = "team4"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+        self._histograms: Dict[Tuple[str, tuple], List[float]] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def inc(self, name: str, value: float = 1.0, help: str = "", **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._help.setdefault(name, ("counter", help))
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, help: str = "", **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help))
+            # Bucket counts, then sum and count
+            hist = self._histograms.setdefault(key, [0.0] * (len(LATENCY_BUCKETS) + 2))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and histogram sums/counts as plain dicts."""
+        with self._lock:
+            counters = {f"{name}{dict(labels)}": v for (name, labels), v in self._counters.items()}
+            histograms = {f"{name}{dict(labels)}": {"sum": h[-2], "count": h[-1]}
+                          for (name, labels), h in self._histograms.items()}
+        return {"counters": counters, "histograms": histograms}
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            for name, (kind, help) in sorted(self._help.items()):
+                full = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full} {help or name}")
+                lines.append(f"# TYPE {full} {kind}")
+                if kind == "counter":
+                    for (n, labels), v in sorted(self._counters.items()):
+                        if n == name:
+                            lines.append(f"{full}{fmt(labels)} {v}")
+                else:
+                    for (n, labels), h in sorted(self._histograms.items()):
+                        if n != name:
+                            continue
+                        for bound, count in zip(LATENCY_BUCKETS, h):
+                            lines.append(f"{full}_bucket{fmt(labels, [('le', bound)])} {count}")
+                        lines.append(f"{full}_bucket{fmt(labels, [('le', '+Inf')])} {h[-1]}")
+                        lines.append(f"{full}_sum{fmt(labels)} {h[-2]}")
+                        lines.append(f"{full}_count{fmt(labels)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+@dataclass
+class Span:
+    kind: str
+    name: str
+    node: Optional[str]
+    start: float
+    seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    tokens_estimated: bool = False
+    cost: float = 0.0
+    cache_hit: Optional[str] = None
+    tool_calls: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class Trace:
+    thread_id: str
+    query: str = ""
+    started: float = field(default_factory=time.time)
+    seconds: Optional[float] = None
+    spans: List[Span] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Per-node wall time, LLM latency, tokens, cost, tool calls and cache hits."""
+        nodes: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            row = nodes.setdefault(span.node or "-", {
+                "wall_seconds": 0.0, "llm_seconds": 0.0, "llm_calls": 0, "prompt_tokens": 0,
+                "completion_tokens": 0, "cost": 0.0, "tool_calls": 0, "tool_seconds": 0.0, "cache_hits": 0,
+                "errors": 0,
+            })
+            if span.kind == "node":
+                row["wall_seconds"] += span.seconds
+            elif span.kind == "llm":
+                row["llm_seconds"] += span.seconds
+                row["llm_calls"] += 1
+                row["prompt_tokens"] += span.prompt_tokens
+                row["completion_tokens"] += span.completion_tokens
+                row["cost"] += span.cost
+                row["cache_hits"] += int(bool(span.cache_hit))
+            elif span.kind == "tool":
+                row["tool_calls"] += 1
+                row["tool_seconds"] += span.seconds
+            row["errors"] += int(span.error is not None)
+        return dict(nodes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [asdict(s) for s in self.spans]
+        return {"thread_id": self.thread_id, "query": self.query, "started": self.started,
+                "seconds": self.seconds, "nodes": self.summary(), "spans": spans}
+
+
+class Tracer:
+    """Keeps the running trace per thread id and a bounded history of finished ones.
+
+    Traces started implicitly by `get` may never be finished, so at most
+    `history` of them are kept; the oldest is dropped first.
+    """
+
+    def __init__(self, history: int = TRACE_HISTORY):
+        self._lock = threading.Lock()
+        self._active: Dict[str, Trace] = {}
+        self._implicit: "OrderedDict[str, None]" = OrderedDict()
+        self._implicit_limit = max(history, 1)
+        self.finished: deque = deque(maxlen=history)
+
+    def start(self, thread_id: str, query: str = "") -> Trace:
+        trace = Trace(thread_id=thread_id, query=query)
+        with self._lock:
+            self._active[thread_id] = trace
+            self._implicit.pop(thread_id, None)
+        return trace
+
+    def get(self, thread_id: Optional[str]) -> Optional[Trace]:
+        """Running trace for `thread_id`; one is started implicitly for graph runs outside SessionLoop."""
+        if thread_id is None:
+            return None
+        with self._lock:
+            trace = self._active.get(thread_id)
+            if trace is None:
+                trace = self._active[thread_id] = Trace(thread_id=thread_id)
+                self._implicit[thread_id] = None
+                if len(self._implicit) > self._implicit_limit:
+                    # Незакрытую неявную трассу никто не завершит; самая старая уходит
+                    self._active.pop(self._implicit.popitem(last=False)[0], None)
+            return trace
+
+    def finish(self, thread_id: str) -> Optional[Trace]:
+        with self._lock:
+            trace = self._active.pop(thread_id, None)
+            self._implicit.pop(thread_id, None)
+        if trace is None:
+            return None
+        trace.seconds = time.time() - trace.started
+        self.finished.append(trace)
+        metrics.observe("request_seconds", trace.seconds, help="End-to-end request latency")
+        logger.info(json.dumps({"event": "request", **{k: v for k, v in trace.to_dict().items() if k != "spans"}},
+                               ensure_ascii=False, default=str))
+        return trace
+
+    def last(self, thread_id: str) -> Optional[Trace]:
+        """Most recent trace of a thread: the running one, else the last finished."""
+        with self._lock:
+            if thread_id in self._active:
+                return self._active[thread_id]
+        for trace in reversed(self.finished):
+            if trace.thread_id == thread_id:
+                return trace
+        return None
+
+
+metrics = Metrics()
+tracer = Tracer()
+
+# (trace, node) of the node currently executing in this context
+_current: contextvars.ContextVar[Optional[Tuple[Trace, str]]] = contextvars.ContextVar("current_node", default=None)
+
+
+def _thread_id() -> Optional[str]:
+    try:
+        return get_config().get("configurable", {}).get("thread_id")
+    except RuntimeError:
+        return None
+
+
+def _record(span: Span, trace: Optional[Trace]):
+    if trace is not None:
+        trace.add(span)
+    logger.debug(json.dumps({"event": "span", **asdict(span)}, ensure_ascii=False, default=str))
+
+
+def _finish_node(name: str, trace: Optional[Trace], span: Span):
+    span.seconds = time.perf_counter() - span.start
+    metrics.observe("node_seconds", span.seconds, help="Wall time per graph node", node=name)
+    if span.error:
+        metrics.inc("errors_total", help="Failed nodes, LLM and tool calls", kind="node", name=name)
+    _record(span, trace)
+
+
+def instrument_node(name: str, func: Callable) -> Callable:
+    """Wrap a sync or async graph node with a timed span."""
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def anode(state):
+            trace = tracer.get(_thread_id())
+            token = _current.set((trace, name) if trace else None)
+            span = Span("node", name, name, time.perf_counter())
+            try:
+                return await func(state)
+            except BaseException as exc:
+                span.error = repr(exc)
+                raise
+            finally:
+                _current.reset(token)
+                _finish_node(name, trace, span)
+        return anode
+
+    @wraps(func)
+    def node(state):
+        trace = tracer.get(_thread_id())
+        token = _current.set((trace, name) if trace else None)
+        span = Span("node", name, name, time.perf_counter())
+        try:
+            return func(state)
+        except BaseException as exc:
+            span.error = repr(exc)
+            raise
+        finally:
+            _current.reset(token)
+            _finish_node(name, trace, span)
+    return node
+
+
+def _current_span(kind: str, name: str) -> Tuple[Span, Optional[Trace]]:
+    current = _current.get()
+    trace, node = current if current else (None, None)
+    return Span(kind, name, node, time.perf_counter()), trace
+
+
+def _usage(result: Any, inputs: Dict[str, Any]) -> Tuple[int, int, bool]:
+    usage = getattr(result, "usage_metadata", None) or {}
+    if usage:
+        return int(usage.get("input_tokens", 0)), int(usage.get("output_tokens", 0)), False
+    token_usage = (getattr(result, "response_metadata", None) or {}).get("token_usage") or {}
+    if token_usage:
+        return int(token_usage.get("prompt_tokens", 0)), int(token_usage.get("completion_tokens", 0)), False
+    # Streaming responses may come without usage: estimate from the text
+    prompt = str(inputs.get("input", "")) + "".join(
+        str(getattr(m, "content", m)) for m in inputs.get("agent_scratchpad") or [])
+    content = getattr(result, "content", "")
+    return count_tokens(prompt), count_tokens(content if isinstance(content, str) else str(content)), True
+
+
+class InstrumentedRunnable:
+    """Times a runnable and records token usage, cost, tool calls and cache hits."""
+
+    def __init__(self, runnable, name: str, model: str):
+        self.runnable = runnable
+        self.name = name
+        self.model = model
+
+    def _finish(self, span: Span, trace: Optional[Trace], inputs: Dict[str, Any], result: Any):
+        span.seconds = time.perf_counter() - span.start
+        labels = {"runnable": self.name, "model": self.model}
+        if span.error:
+            metrics.inc("errors_total", help="Failed nodes, LLM and tool calls", kind="llm", name=self.name)
+            _record(span, trace)
+            return
+        span.cache_hit = cache_hit(result)
+        span.tool_calls = len(getattr(result, "tool_calls", None) or [])
+        metrics.observe("llm_seconds", span.seconds, help="LLM call latency, cache hits included", **labels)
+        if span.cache_hit:
+            metrics.inc("llm_cache_hits_total", help="LLM responses served from cache", level=span.cache_hit,
+                        **labels)
+        else:
+            span.prompt_tokens, span.completion_tokens, span.tokens_estimated = _usage(result, inputs)
+            prices = LLM_PRICES.get(self.model)
+            if prices:
+                span.cost = (span.prompt_tokens * prices[0] + span.completion_tokens * prices[1]) / 1000
+                metrics.inc("llm_cost_usd_total", span.cost, help="Estimated LLM spend", **labels)
+            metrics.inc("llm_tokens_total", span.prompt_tokens, help="LLM tokens", kind="prompt", **labels)
+            metrics.inc("llm_tokens_total", span.completion_tokens, kind="completion", **labels)
+        if span.tool_calls:
+            metrics.inc("llm_tool_calls_total", span.tool_calls, help="Tool calls requested by the LLM", **labels)
+        _record(span, trace)
+
+    def invoke(self, inputs: Dict[str, Any], config=None, **kwargs) -> Any:
+        span, trace = _current_span("llm", self.name)
+        result = None
+        try:
+            result = self.runnable.invoke(inputs, config, **kwargs)
+            return result
+        except BaseException as exc:
+            span.error = repr(exc)
+            raise
+        finally:
+            self._finish(span, trace, inputs, result)
+
+    async def ainvoke(self, inputs: Dict[str, Any], config=None, **kwargs) -> Any:
+        span, trace = _current_span("llm", self.name)
+        result = None
+        try:
+            result = await self.runnable.ainvoke(inputs, config, **kwargs)
+            return result
+        except BaseException as exc:
+            span.error = repr(exc)
+            raise
+        finally:
+            self._finish(span, trace, inputs, result)
+
+
+def _finish_tool(span: Span, trace: Optional[Trace]):
+    span.seconds = time.perf_counter() - span.start
+    metrics.inc("tool_calls_total", help="Executed tool calls", tool=span.name)
+    metrics.observe("tool_seconds", span.seconds, help="Tool call latency", tool=span.name)
+    if span.error:
+        metrics.inc("errors_total", kind="tool", name=span.name)
+    _record(span, trace)
+
+
+def instrument_tool(func: Callable) -> Callable:
+    """Wrap `run_tool_call`-style functions taking an LLM tool call dict."""
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def atool(tc):
+            span, trace = _current_span("tool", tc.get("name", "tool"))
+            try:
+                return await func(tc)
+            except BaseException as exc:
+                span.error = repr(exc)
+                raise
+            finally:
+                _finish_tool(span, trace)
+        return atool
+
+    @wraps(func)
+    def tool(tc):
+        span, trace = _current_span("tool", tc.get("name", "tool"))
+        try:
+            return func(tc)
+        except BaseException as exc:
+            span.error = repr(exc)
+            raise
+        finally:
+            _finish_tool(span, trace)
+    return tool
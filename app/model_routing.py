@@ -0,0 +1,366 @@
+"""Per-node choice between the Qwen and DeepSeek backends.
+
+Every runnable has an ordered list of candidate backends (registry names of
+the chat models): its primary from `agents.lazy_runnable`, then the other
+provider, unless MODEL_POLICIES overrides it. For each call the router:
+    * skips backends whose circuit breaker is open (too many consecutive
+      429/5xx/connection errors, until the cool-down expires);
+    * moves a backend down the list when its measured latency (EWMA) and
+      error rate make it clearly worse than the next candidate, or when
+      it is much more expensive (optional, see LLM_PRICES);
+    * fails over to the next candidate on a retryable error;
+    * for latency-critical nodes (MODEL_HEDGE_NODES), sends a hedged copy
+      of the request to the next candidate if the first one has not
+      answered within the hedge delay, and takes whichever finishes first.
+The whole call - the limiter's retries, failover and the hedged copy - is
+bounded by MODEL_CALL_DEADLINE: past it the caller gets a TimeoutError, and
+no retry or failover is started that would outlive it.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from llm_cache import cache_hit
+from metrics import LLM_PRICES, metrics
+from resources import ResourceUnavailable
+from throttle import call_deadline, is_retryable
+
+logger = logging.getLogger(__name__)
+
+# Runnable name -> backends in order of preference, e.g. {"synthesizer": ["llm"]}
+MODEL_POLICIES: Dict[str, List[str]] = json.loads(os.getenv("MODEL_POLICIES", "{}"))
+
+MODEL_HEDGE_NODES = {n for n in os.getenv("MODEL_HEDGE_NODES", "router,simple").split(",") if n}
+MODEL_HEDGE_MIN_DELAY = float(os.getenv("MODEL_HEDGE_MIN_DELAY", "1.5"))
+MODEL_HEDGE_FACTOR = float(os.getenv("MODEL_HEDGE_FACTOR", "2.0"))
+# Switch the primary only when it is this many times worse than the alternative
+MODEL_SWITCH_FACTOR = float(os.getenv("MODEL_SWITCH_FACTOR", "2.0"))
+# Seconds of latency one dollar per 1k tokens is worth; 0 ignores cost
+MODEL_COST_WEIGHT = float(os.getenv("MODEL_COST_WEIGHT", "0"))
+BREAKER_FAILURES = int(os.getenv("MODEL_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("MODEL_BREAKER_COOLDOWN", "30"))
+# Seconds for one routed call including retries, failover and hedging; 0 disables the limit
+MODEL_CALL_DEADLINE = float(os.getenv("MODEL_CALL_DEADLINE", "180"))
+EWMA_ALPHA = 0.2
+
+
+@dataclass
+class BackendStats:
+    """Live latency/error estimate and circuit breaker of one backend."""
+    latency: Optional[float] = None
+    error_rate: float = 0.0
+    calls: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    opened_at: Optional[float] = None
+    half_open: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def available(self) -> bool:
+        """Closed, or open with the cool-down over and no trial in flight. Does not change state."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            return not self.half_open and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN
+
+    def dispatch(self):
+        """Called right before a request is sent: after the cool-down it becomes the one trial request."""
+        with self.lock:
+            if self.opened_at is not None and not self.half_open \
+                    and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN:
+                self.half_open = True
+
+    def abandon(self):
+        """The request was cancelled without an outcome; let the next one be the trial."""
+        with self.lock:
+            self.half_open = False
+
+    def success(self, seconds: Optional[float]):
+        with self.lock:
+            self.calls += 1
+            self.consecutive_failures = 0
+            self.opened_at, self.half_open = None, False
+            self.error_rate *= 1 - EWMA_ALPHA
+            if seconds is not None:
+                self.latency = seconds if self.latency is None else \
+                    (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * seconds
+
+    def failure(self) -> bool:
+        """Record a failed call; returns True if the breaker has just opened."""
+        with self.lock:
+            self.calls += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA
+            if self.half_open or (self.opened_at is None and self.consecutive_failures >= BREAKER_FAILURES):
+                self.opened_at, self.half_open = time.monotonic(), False
+                return True
+            return False
+
+
+class ModelRouter:
+    def __init__(self, policies: Dict[str, List[str]] = MODEL_POLICIES):
+        self.policies = policies
+        self._stats: Dict[str, BackendStats] = {}
+        self._lock = threading.Lock()
+
+    def stats(self, backend: str) -> BackendStats:
+        with self._lock:
+            return self._stats.setdefault(backend, BackendStats())
+
+    def _score(self, backend: str, model: str) -> Optional[float]:
+        stats = self.stats(backend)
+        if stats.latency is None:
+            return None
+        prices = LLM_PRICES.get(model) or [0.0, 0.0]
+        return stats.latency * (1 + 4 * stats.error_rate) + MODEL_COST_WEIGHT * sum(prices)
+
+    def policy(self, name: str, primary: str, backends: List[str]) -> List[str]:
+        """Configured candidates of a runnable, or its primary followed by the other backends."""
+        return self.policies.get(name) or [primary] + [b for b in backends if b != primary]
+
+    def order(self, name: str, backends: List[str], models: Dict[str, str]) -> List[str]:
+        """Candidates for this call, best first; backends with an open breaker go last."""
+        ordered = list(backends)
+        if len(ordered) > 1:
+            first, second = self._score(ordered[0], models.get(ordered[0], "")), \
+                self._score(ordered[1], models.get(ordered[1], ""))
+            if first is not None and second is not None and first > MODEL_SWITCH_FACTOR * second:
+                ordered[0], ordered[1] = ordered[1], ordered[0]
+        healthy = [b for b in ordered if self.stats(b).available()]
+        return healthy + [b for b in ordered if b not in healthy]
+
+    def hedge_delay(self, name: str, backend: str) -> Optional[float]:
+        if name not in MODEL_HEDGE_NODES:
+            return None
+        latency = self.stats(backend).latency
+        return max(MODEL_HEDGE_MIN_DELAY, MODEL_HEDGE_FACTOR * latency) if latency else MODEL_HEDGE_MIN_DELAY * 2
+
+    def record(self, name: str, backend: str, seconds: float, result: Any = None,
+               error: Optional[BaseException] = None):
+        stats = self.stats(backend)
+        if error is None:
+            # Cache hits say nothing about the provider's latency
+            stats.success(None if cache_hit(result) else seconds)
+            return
+        if not is_retryable(error):
+            # 400-класс (длина контекста, схема инструментов) - ошибка запроса, а не провайдера
+            stats.success(None)
+            return
+        if stats.failure():
+            logger.warning("circuit breaker opened for %s after %s", backend, error)
+            metrics.inc("model_breaker_open_total", help="Circuit breaker trips", backend=backend)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            items = list(self._stats.items())
+        return {
+            backend: {"latency": s.latency, "error_rate": round(s.error_rate, 3), "calls": s.calls,
+                      "failures": s.failures, "open": s.opened_at is not None}
+            for backend, s in items
+        }
+
+
+model_router = ModelRouter()
+
+
+class RoutedRunnable:
+    """Runnable that dispatches each call to one of several backend chains.
+
+    Args:
+        name (str): Runnable name, selects the policy.
+        factories (Dict[str, Callable]): Backend name -> builder of its chain, in policy order.
+            Chains are built on first use, so a provider without credentials
+            only fails (and trips its breaker) when it is actually needed.
+        models (Dict[str, str]): Backend name -> model name, for cost.
+    """
+
+    def __init__(self, name: str, factories: Dict[str, Callable[[], Any]], models: Optional[Dict[str, str]] = None,
+                 router: ModelRouter = model_router):
+        self.name = name
+        self.factories = factories
+        self.models = models or {}
+        self.router = router
+        self._chains: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._runner: Optional[ThreadPoolExecutor] = None
+
+    def _chain(self, backend: str):
+        with self._lock:
+            if backend not in self._chains:
+                try:
+                    self._chains[backend] = self.factories[backend]()
+                except ResourceUnavailable:
+                    raise
+                except Exception as exc:
+                    raise ResourceUnavailable(f"{backend} unavailable: {exc}") from exc
+            return self._chains[backend]
+
+    def _call(self, backend: str, inputs, config, kwargs):
+        self.router.stats(backend).dispatch()
+        started = time.perf_counter()
+        try:
+            result = self._chain(backend).invoke(inputs, config, **kwargs)
+        except BaseException as exc:
+            self.router.record(self.name, backend, time.perf_counter() - started, error=exc)
+            raise
+        self.router.record(self.name, backend, time.perf_counter() - started, result)
+        return result
+
+    async def _acall(self, backend: str, inputs, config, kwargs):
+        self.router.stats(backend).dispatch()
+        started = time.perf_counter()
+        try:
+            result = await self._chain(backend).ainvoke(inputs, config, **kwargs)
+        except asyncio.CancelledError:
+            # Проигравший хедж отменён: исход неизвестен, пробный запрос не засчитываем
+            self.router.stats(backend).abandon()
+            raise
+        except BaseException as exc:
+            self.router.record(self.name, backend, time.perf_counter() - started, error=exc)
+            raise
+        self.router.record(self.name, backend, time.perf_counter() - started, result)
+        return result
+
+    def _submit(self, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix=f"hedge-{self.name}")
+        # Keep the node's context (LangGraph config, current trace span) in the pool thread
+        return self._executor.submit(contextvars.copy_context().run, self._call, *args)
+
+    @staticmethod
+    def _silent(config):
+        # The hedged copy must not stream its tokens into the UI next to the primary
+        return {**(config or {}), "callbacks": []}
+
+    def _can_hedge(self, candidates: List[str]) -> bool:
+        # order() ставит бэкенды с открытым breaker последними, но всё равно возвращает их
+        return len(candidates) > 1 and self.router.stats(candidates[1]).available()
+
+    @staticmethod
+    def _expired() -> bool:
+        deadline = call_deadline.get()
+        return deadline is not None and time.monotonic() >= deadline
+
+    def _timeout(self) -> TimeoutError:
+        metrics.inc("model_deadline_exceeded_total", help="Routed calls cut off by MODEL_CALL_DEADLINE",
+                    runnable=self.name)
+        return TimeoutError(f"{self.name}: no answer within {MODEL_CALL_DEADLINE:g}s")
+
+    def _failover(self, backend: str, exc: BaseException, remaining: List[str]):
+        if not remaining or not is_retryable(exc) or self._expired():
+            raise exc
+        logger.warning("%s: %s failed (%s), failing over to %s", self.name, backend, exc, remaining[0])
+        metrics.inc("model_failovers_total", help="Calls retried on another backend", runnable=self.name,
+                    source=backend, target=remaining[0])
+
+    def invoke(self, inputs: Dict[str, Any], config=None, **kwargs) -> Any:
+        if MODEL_CALL_DEADLINE <= 0:
+            return self._invoke(inputs, config, kwargs)
+        if self._runner is None:
+            self._runner = ThreadPoolExecutor(max_workers=32, thread_name_prefix=f"call-{self.name}")
+        # Отдельный пул, не пул хеджей: ожидающий вызов не должен занимать слот, нужный его хеджу
+        token = call_deadline.set(time.monotonic() + MODEL_CALL_DEADLINE)
+        try:
+            future = self._runner.submit(contextvars.copy_context().run, self._invoke, inputs, config, kwargs)
+        finally:
+            call_deadline.reset(token)
+        try:
+            return future.result(timeout=MODEL_CALL_DEADLINE)
+        except FutureTimeout:
+            # The call keeps running in the pool until its current attempt ends; its result is dropped
+            raise self._timeout() from None
+
+    def _invoke(self, inputs: Dict[str, Any], config, kwargs) -> Any:
+        candidates = self.router.order(self.name, list(self.factories), self.models)
+        delay = self.router.hedge_delay(self.name, candidates[0])
+        if delay is not None and self._can_hedge(candidates):
+            return self._hedged(candidates, inputs, config, kwargs, delay)
+        for i, backend in enumerate(candidates):
+            try:
+                return self._call(backend, inputs, config, kwargs)
+            except Exception as exc:
+                self._failover(backend, exc, candidates[i + 1:])
+
+    def _hedged(self, candidates: List[str], inputs, config, kwargs, delay: float) -> Any:
+        primary = self._submit(candidates[0], inputs, config, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done and primary.exception() is None:
+            return primary.result()
+        if done:
+            self._failover(candidates[0], primary.exception(), candidates[1:])
+            return self._call(candidates[1], inputs, config, kwargs)
+
+        metrics.inc("model_hedges_total", help="Hedged requests sent", runnable=self.name, target=candidates[1])
+        hedge = self._submit(candidates[1], inputs, self._silent(config), kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The loser keeps running in the pool; its result is dropped
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def ainvoke(self, inputs: Dict[str, Any], config=None, **kwargs) -> Any:
+        if MODEL_CALL_DEADLINE <= 0:
+            return await self._ainvoke(inputs, config, kwargs)
+        token = call_deadline.set(time.monotonic() + MODEL_CALL_DEADLINE)
+        try:
+            # wait_for runs the call in a task that copies the context, deadline included
+            return await asyncio.wait_for(self._ainvoke(inputs, config, kwargs), MODEL_CALL_DEADLINE)
+        except asyncio.TimeoutError:
+            if not self._expired():
+                # A timeout of the provider's client, not of the deadline
+                raise
+            raise self._timeout() from None
+        finally:
+            call_deadline.reset(token)
+
+    async def _ainvoke(self, inputs: Dict[str, Any], config, kwargs) -> Any:
+        candidates = self.router.order(self.name, list(self.factories), self.models)
+        delay = self.router.hedge_delay(self.name, candidates[0])
+        if delay is not None and self._can_hedge(candidates):
+            return await self._ahedged(candidates, inputs, config, kwargs, delay)
+        for i, backend in enumerate(candidates):
+            try:
+                return await self._acall(backend, inputs, config, kwargs)
+            except Exception as exc:
+                self._failover(backend, exc, candidates[i + 1:])
+
+    async def _ahedged(self, candidates: List[str], inputs, config, kwargs, delay: float) -> Any:
+        primary = asyncio.ensure_future(self._acall(candidates[0], inputs, config, kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done and primary.exception() is None:
+            return primary.result()
+        if done:
+            self._failover(candidates[0], primary.exception(), candidates[1:])
+            return await self._acall(candidates[1], inputs, config, kwargs)
+
+        metrics.inc("model_hedges_total", help="Hedged requests sent", runnable=self.name, target=candidates[1])
+        hedge = asyncio.ensure_future(self._acall(candidates[1], inputs, self._silent(config), kwargs))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
@@ -1,20 +1,42 @@
+import os
+from typing import Any, Dict
+
+from langchain_core.messages import HumanMessage
 from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
 
+from checkpoints import SqliteCheckpointer
+from metrics import instrument_node
 from agents import AgentState, router_node, simple_node, analyzer_node, retriever_node, checker_node, \
-    counter_argument_node, synthesizer_node
-
-workflow = StateGraph(state_schema=AgentState)
-
-workflow.add_node("router", router_node)
-workflow.add_node("simple", simple_node)
-workflow.add_node("analyzer", analyzer_node)
-workflow.add_node("retriever", retriever_node)
-workflow.add_node("checker", checker_node)
-workflow.add_node("counter_argument", counter_argument_node)
-workflow.add_node("synthesizer", synthesizer_node)
-
-workflow.set_entry_point("router")
+    counter_argument_node, synthesizer_node, arouter_node, asimple_node, aanalyzer_node, aretriever_node, \
+    achecker_node, acounter_argument_node, asynthesizer_node, MAX_RETRIEVAL_ROUNDS
+
+SYNC_NODES = {
+    "router": router_node,
+    "simple": simple_node,
+    "analyzer": analyzer_node,
+    "retriever": retriever_node,
+    "checker": checker_node,
+    "counter_argument": counter_argument_node,
+    "synthesizer": synthesizer_node,
+}
+
+ASYNC_NODES = {
+    "router": arouter_node,
+    "simple": asimple_node,
+    "analyzer": aanalyzer_node,
+    "retriever": aretriever_node,
+    "checker": achecker_node,
+    "counter_argument": acounter_argument_node,
+    "synthesizer": asynthesizer_node,
+}
+
+
+def initial_state(query: str) -> Dict[str, Any]:
+    """Input for one query run; per-query keys start empty, the thread keeps only `messages`."""
+    return {"query": query, "sub_queries": [], "data": {}, "verified_facts": {}, "counter_arguments": {},
+            "messages": [HumanMessage(content=query)], "final_answer": "", "retrieval_round": 0,
+            "missing_sub_queries": []}
 
 
 def route_mode(state: AgentState):
@@ -25,32 +47,57 @@ def route_mode(state: AgentState):
         return "analyzer"
 
 
-workflow.add_conditional_edges("router", route_mode, {"simple": "simple", "analyzer": "analyzer"})
-
-workflow.add_edge("simple", END)
-workflow.add_edge("analyzer", "retriever")
-workflow.add_edge("retriever", "checker")
-
-
 def check_condition(state: AgentState):
-    if any("needs_more" in msg.content.lower() for msg in state["messages"][-5:]):  # Check recent
+    # Checker fills missing_sub_queries only while the round budget allows another pass
+    if state.get("missing_sub_queries") and state.get("retrieval_round", 0) < MAX_RETRIEVAL_ROUNDS:
         return "retriever"
     else:
-        return "counter_argument"
+        return "checked"
+
+
+def facts_checked(state: AgentState):
+    """Точка сборки ветки фактов: пишет только в барьер перед синтезатором"""
+    return {}
+
+
+def build_workflow(nodes) -> StateGraph:
+    workflow = StateGraph(state_schema=AgentState)
+
+    for name, node in nodes.items():
+        workflow.add_node(name, instrument_node(name, node))
+
+    workflow.set_entry_point("router")
+
+    workflow.add_conditional_edges("router", route_mode, {"simple": "simple", "analyzer": "analyzer"})
+
+    workflow.add_edge("simple", END)
+    # После анализатора две ветки идут параллельно: факты (retriever <-> checker)
+    # и контраргументы, которым нужны только запрос и подзапросы
+    workflow.add_edge("analyzer", "retriever")
+    workflow.add_edge("analyzer", "counter_argument")
+    workflow.add_edge("retriever", "checker")
+
+    workflow.add_conditional_edges("checker", check_condition,
+                                   {"retriever": "retriever", "checked": "checked"})
+    workflow.add_node("checked", facts_checked)
 
+    # Синтезатор ждёт обе ветки, сколько бы раундов ни заняла проверка
+    workflow.add_edge(["checked", "counter_argument"], "synthesizer")
+    workflow.add_edge("synthesizer", END)
+    return workflow
 
-workflow.add_conditional_edges("checker", check_condition,
-                               {"retriever": "retriever", "counter_argument": "counter_argument"})
 
-workflow.add_edge("counter_argument", "synthesizer")
-workflow.add_edge("synthesizer", END)
+workflow = build_workflow(SYNC_NODES)
+async_workflow = build_workflow(ASYNC_NODES)
 
-checkpointer = MemorySaver()
+# История диалогов на диске с ограничением по глубине и TTL; "memory" оставлен для отладки
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "sqlite")
+checkpointer = SqliteCheckpointer() if CHECKPOINT_BACKEND == "sqlite" else MemorySaver()
 graph = workflow.compile(checkpointer=checkpointer)
+# Тот же граф на async-узлах: ainvoke/astream без блокирующих вызовов
+async_graph = async_workflow.compile(checkpointer=checkpointer)
 
 if __name__ == "__main__":
-    initial_state = {"query": "Время жизни самой известной женщины-программиста", "sub_queries": [], "data": {},
-                     "verified_facts": {}, "counter_arguments": {}, "messages": []}
     config = {"configurable": {"thread_id": "example_thread"}}
-    result = graph.invoke(initial_state, config=config)
+    result = graph.invoke(initial_state("Время жизни самой известной женщины-программиста"), config=config)
     print(result["final_answer"])
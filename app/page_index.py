@@ -0,0 +1,95 @@
+"""BM25 inverted index over the text of fetched pages."""
+
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+SNIPPET_CHARS = 800
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class InvertedIndex:
+    """In-memory BM25 index over the text of fetched trusted pages.
+
+    Pages are indexed once per fetch; lookups only touch the postings of
+    the query terms instead of scanning every page.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, url: str, text: str):
+        """Index (or re-index) the text of one page."""
+        terms = tokenize(text)
+        with self._lock:
+            self._remove(url)
+            for term, tf in Counter(terms).items():
+                self.postings[term][url] = tf
+            self.docs[url] = {"text": text, "length": len(terms), "indexed_at": time.time()}
+            self._total_length += len(terms)
+
+    def _remove(self, url: str):
+        old = self.docs.pop(url, None)
+        if old is None:
+            return
+        self._total_length -= old["length"]
+        for term in set(tokenize(old["text"])):
+            self.postings[term].pop(url, None)
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def fresh(self, url: str, ttl: float) -> bool:
+        doc = self.docs.get(url)
+        return doc is not None and time.time() - doc["indexed_at"] < ttl
+
+    def search(self, query: str, urls: Optional[Iterable[str]] = None, k: int = 5) -> List[Dict[str, Any]]:
+        """Rank indexed pages by BM25 score for `query`.
+
+        Args:
+            query (str): Search query.
+            urls (Optional[Iterable[str]]): Restrict the search to these pages.
+            k (int): Maximum number of results.
+
+        Returns:
+            List[Dict[str, Any]]: Results with url, score and snippet, best first.
+        """
+        allowed = set(urls) if urls is not None else None
+        with self._lock:
+            n_docs = len(self.docs)
+            if not n_docs:
+                return []
+            avg_length = self._total_length / n_docs
+            scores: Dict[str, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term, {})
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for url, tf in postings.items():
+                    if allowed is not None and url not in allowed:
+                        continue
+                    length = self.docs[url]["length"]
+                    scores[url] += idf * tf * (self.k1 + 1) / (
+                        tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [{"url": url, "score": round(score, 3), "snippet": snippet(self.docs[url]["text"], query)}
+                    for url, score in ranked]
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def snippet(text: str, query: str, width: int = SNIPPET_CHARS) -> str:
+    """Window of `text` around the first query term found in it."""
+    lowered = text.lower()
+    positions = [lowered.find(term) for term in tokenize(query)]
+    positions = [p for p in positions if p >= 0]
+    start = max(min(positions) - width // 4, 0) if positions else 0
+    return text[start:start + width].strip()
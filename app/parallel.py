@@ -0,0 +1,214 @@
+"""Bounded thread-pool and asyncio fan-out used by the graph nodes."""
+
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TaskResult:
+    """Outcome of one item processed by `run_parallel`.
+
+    Attributes:
+        item (Any): Input item the task was started for.
+        value (Any): Return value of the task, None if it did not finish.
+        error (Optional[BaseException]): Exception raised by the task.
+        timed_out (bool): True if the task exceeded its timeout or the budget.
+    """
+    item: Any
+    value: Any = None
+    error: Optional[BaseException] = None
+    timed_out: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.timed_out
+
+
+def run_parallel(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_workers: int = 4,
+    timeout: Optional[float] = None,
+    budget: Optional[float] = None,
+) -> List[TaskResult]:
+    """Run `func` over `items` on a bounded worker pool.
+
+    Results are returned in the order of `items`, regardless of the order
+    in which tasks finish, so callers can build deterministic outputs.
+
+    Args:
+        func (Callable): Function applied to every item.
+        items (Iterable): Items to process.
+        max_workers (int): Concurrency cap. 1 or less runs items inline.
+        timeout (Optional[float]): Per-item limit in seconds, counted from
+            the moment the item actually starts running.
+        budget (Optional[float]): Overall limit in seconds. When it runs
+            out, unfinished items are reported as timed out and whatever
+            has completed is returned.
+
+    Returns:
+        List[TaskResult]: One result per item, in input order.
+    """
+    items = list(items)
+    results = [TaskResult(item=item) for item in items]
+    if not items:
+        return results
+
+    deadline = time.monotonic() + budget if budget is not None else None
+
+    if max_workers <= 1:
+        for res in results:
+            if deadline is not None and time.monotonic() >= deadline:
+                res.timed_out = True
+                continue
+            try:
+                res.value = func(res.item)
+            except Exception as exc:
+                res.error = exc
+        return results
+
+    started = {}
+
+    def call(index):
+        started[index] = time.monotonic()
+        return func(items[index])
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    try:
+        # Each task runs in a copy of the caller's context (current trace span, LangGraph config)
+        futures = {executor.submit(contextvars.copy_context().run, call, i): i for i in range(len(items))}
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            waits = [0.5]
+            if deadline is not None:
+                waits.append(deadline - now)
+            if timeout is not None:
+                waits += [started[futures[f]] + timeout - now for f in pending if futures[f] in started]
+            done, pending = wait(pending, timeout=max(min(waits), 0), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                res = results[futures[future]]
+                try:
+                    res.value = future.result()
+                except Exception as exc:
+                    res.error = exc
+
+            now = time.monotonic()
+            expired = set()
+            for future in pending:
+                index = futures[future]
+                over_budget = deadline is not None and now >= deadline
+                over_timeout = timeout is not None and index in started and now - started[index] >= timeout
+                if over_budget or over_timeout:
+                    future.cancel()
+                    results[index].timed_out = True
+                    expired.add(future)
+            pending -= expired
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    timed_out = sum(res.timed_out for res in results)
+    if timed_out:
+        logger.warning("run_parallel: %d of %d tasks timed out", timed_out, len(items))
+    return results
+
+
+async def run_parallel_async(
+    func: Callable[[Any], Awaitable[Any]],
+    items: Iterable[Any],
+    max_concurrency: int = 4,
+    timeout: Optional[float] = None,
+    budget: Optional[float] = None,
+) -> List[TaskResult]:
+    """Async counterpart of `run_parallel` for coroutine functions.
+
+    Args:
+        func (Callable): Coroutine function applied to every item.
+        items (Iterable): Items to process.
+        max_concurrency (int): Maximum number of items awaited at once.
+        timeout (Optional[float]): Per-item limit in seconds, counted from
+            the moment the item acquires a slot.
+        budget (Optional[float]): Overall limit in seconds.
+
+    Returns:
+        List[TaskResult]: One result per item, in input order.
+    """
+    items = list(items)
+    results = [TaskResult(item=item) for item in items]
+    if not items:
+        return results
+
+    semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+
+    async def call(res):
+        async with semaphore:
+            try:
+                res.value = await asyncio.wait_for(func(res.item), timeout)
+            except asyncio.TimeoutError:
+                res.timed_out = True
+            except Exception as exc:
+                res.error = exc
+
+    tasks = [asyncio.ensure_future(call(res)) for res in results]
+    done, pending = await asyncio.wait(tasks, timeout=budget)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        for res, task in zip(results, tasks):
+            if task in pending:
+                res.timed_out = True
+                res.value = None
+
+    timed_out = sum(res.timed_out for res in results)
+    if timed_out:
+        logger.warning("run_parallel_async: %d of %d tasks timed out", timed_out, len(items))
+    return results
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait for the same result (or exception) instead of
+    starting their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run `func` once per in-flight `key`.
+
+        Returns:
+            Tuple[Any, bool]: The result and True if it was shared with
+            another caller rather than computed by this one.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            future.set_result(func())
+        except BaseException as exc:
+            future.set_exception(exc)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return future.result(), False
@@ -0,0 +1,139 @@
+"""Sub-query planning for the analyzer.
+
+The analyzer used to split the raw model output on newlines, so headers,
+numbering and paraphrased duplicates all became sub-queries, each costing a
+Chroma query, an LLM call and several searches in the retriever. The
+analyzer now answers with a JSON list of {"query", "priority"} objects and
+the plan is:
+    * parsed (falling back to cleaned-up lines if the model ignored the format);
+    * ordered by priority, 1 being the most important;
+    * collapsed: a sub-query whose embedding is within PLANNER_DUP_SIMILARITY
+      (cosine) of a higher-priority one with the same numbers is dropped;
+      "... in 2010" and "... in 2020" embed almost identically but a
+      comparison needs both;
+    * split into sub-queries the verified cache already answers, which skip
+      retrieval, and the rest;
+    * cut to PLANNER_MAX_SUB_QUERIES sub-queries to retrieve.
+"""
+
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from answer_cache import same_numbers
+from embeddings import embed_cached
+from evidence import normalize_text
+from vectorstore import cache_get_many
+
+logger = logging.getLogger(__name__)
+
+PLANNER_ENABLED = os.getenv("PLANNER_ENABLED", "1") == "1"
+PLANNER_MAX_SUB_QUERIES = int(os.getenv("PLANNER_MAX_SUB_QUERIES", "5"))
+PLANNER_DUP_SIMILARITY = float(os.getenv("PLANNER_DUP_SIMILARITY", "0.95"))
+DEFAULT_PRIORITY = 3
+
+_BULLET_RE = re.compile(r"^\s*(?:[-*•]+|\d+[.)]|#+)\s*")
+_JSON_RE = re.compile(r"\[.*\]", re.DOTALL)
+
+
+@dataclass
+class SubQuery:
+    query: str
+    priority: int = DEFAULT_PRIORITY
+
+
+@dataclass
+class Plan:
+    """Planned sub-queries and what was removed, for the CoT note."""
+    sub_queries: List[str] = field(default_factory=list)
+    answered: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    duplicates: List[str] = field(default_factory=list)
+    over_cap: List[str] = field(default_factory=list)
+
+
+def _priority(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PRIORITY
+
+
+def parse_sub_queries(content: str) -> List[SubQuery]:
+    """Sub-queries from the analyzer output, in the order the model gave them.
+
+    Accepts the JSON list the prompt asks for (objects or plain strings,
+    optionally inside a code fence); anything else is read line by line
+    with bullets and numbering stripped and headings ("...:") skipped.
+    """
+    match = _JSON_RE.search(content)
+    if match:
+        try:
+            items = json.loads(match.group(0))
+            parsed = [
+                SubQuery(str(item.get("query", "")).strip(), _priority(item.get("priority")))
+                if isinstance(item, dict) else SubQuery(str(item).strip())
+                for item in items
+            ]
+            return [sq for sq in parsed if sq.query]
+        except (ValueError, AttributeError):
+            logger.debug("analyzer output is not valid JSON, falling back to lines")
+
+    sub_queries = []
+    for line in content.splitlines():
+        line = _BULLET_RE.sub("", line).strip().strip("`")
+        if line and not line.endswith(":") and line not in ("[", "]"):
+            sub_queries.append(SubQuery(line))
+    return sub_queries
+
+
+def collapse_duplicates(sub_queries: List[SubQuery], threshold: float = PLANNER_DUP_SIMILARITY):
+    """Drop sub-queries too similar to an earlier (higher-priority) one with the same numbers.
+
+    Returns:
+        Tuple[List[SubQuery], List[str]]: Kept sub-queries and the dropped texts.
+    """
+    if len(sub_queries) < 2:
+        return sub_queries, []
+    vectors = embed_cached([normalize_text(sq.query) for sq in sub_queries])
+    kept, dropped = [], []
+    for i, sq in enumerate(sub_queries):
+        similar = [j for j in kept if same_numbers(sub_queries[j].query, sq.query)]
+        if similar and float((vectors[similar] @ vectors[i]).max()) >= threshold:
+            dropped.append(sq.query)
+        else:
+            kept.append(i)
+    return [sub_queries[i] for i in kept], dropped
+
+
+def plan_sub_queries(content: str, max_sub_queries: int = PLANNER_MAX_SUB_QUERIES) -> Plan:
+    """Turn the analyzer output into the sub-queries to retrieve."""
+    parsed = parse_sub_queries(content)
+    if not PLANNER_ENABLED:
+        return Plan(sub_queries=[sq.query for sq in parsed])
+
+    # Stable sort keeps the model's order within one priority
+    ordered = sorted(parsed, key=lambda sq: sq.priority)
+    plan, seen, unique = Plan(), set(), []
+    for sq in ordered:
+        key = normalize_text(sq.query)
+        if key in seen:
+            plan.duplicates.append(sq.query)
+        else:
+            seen.add(key)
+            unique.append(sq)
+    try:
+        unique, similar = collapse_duplicates(unique)
+        plan.duplicates += similar
+    except Exception as exc:
+        logger.warning("sub-query dedupe failed, keeping all: %s", exc)
+
+    queries = [sq.query for sq in unique]
+    cached = cache_get_many(queries)
+    plan.answered = {q: fact for q, fact in zip(queries, cached) if fact}
+    remaining = [q for q in queries if q not in plan.answered]
+    plan.sub_queries = list(plan.answered) + remaining[:max_sub_queries]
+    plan.over_cap = remaining[max_sub_queries:]
+    return plan
@@ -1,8 +1,12 @@
 simple_prompt = "You are a simple search assistant. Provide a quick answer using search."
 runnable_prompt = "You are a router. Classify the query as 'simple' or 'pro'. Output only the mode."
-analyzer_prompt = "Break the query into sub-queries for multi-hop reasoning."
+analyzer_prompt = """Break the query into sub-queries for multi-hop reasoning.
+    Return only a JSON array of objects with two fields: "query" (a self-contained search query) and
+    "priority" (1 = essential to answer, 5 = nice to have). Do not repeat the same question in other words."""
 retriever_prompt = "Retrieve data from multiple sources using search and scrape. Rerank results semantically."
-checker_prompt = "Verify facts by cross-checking sources. If gaps, return 'needs_more'."
+checker_prompt = """Verify facts by cross-checking sources. If gaps, return 'needs_more'.
+    When returning 'needs_more', add a line 'MISSING:' followed by the sub-queries (the '## ' headings
+    of the input) that lack data, one per line, copied exactly."""
 counter_prompt = """You are a Counter-Argument Agent. Your role is to:
     1. Find opposing viewpoints and alternative perspectives on the topic
     2. Search for critical analysis and dissenting opinions
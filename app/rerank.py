@@ -0,0 +1,125 @@
+"""Local semantic reranking of retrieved evidence.
+
+The retriever used to append raw search output, 2000-character scrapes and
+cached facts to `data[sq]` unranked, and the checker and synthesizer paid
+for all of it. After retrieval, the evidence of every sub-query is now:
+    * split into chunks of about RERANK_CHUNK_TOKENS tokens along sentence
+      boundaries, with duplicate chunks dropped;
+    * embedded locally in one batch for all sub-queries (`embed_cached`
+      memoises vectors by content hash, so evidence carried over from an
+      earlier round is not re-embedded);
+    * scored by cosine similarity to its sub-query with one matrix product;
+    * cut to the best RERANK_TOP_K chunks that fit in RERANK_BUDGET_TOKENS.
+Cached facts from the verified cache are always kept, ahead of the ranked chunks.
+"""
+
+import logging
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from context import count_tokens, truncate_tokens
+from embeddings import embed_cached
+from evidence import split_snippets, text_hash
+
+logger = logging.getLogger(__name__)
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "1") == "1"
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "8"))
+RERANK_BUDGET_TOKENS = int(os.getenv("RERANK_BUDGET_TOKENS", "1200"))
+RERANK_CHUNK_TOKENS = int(os.getenv("RERANK_CHUNK_TOKENS", "120"))
+RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE", "0.0"))
+
+PINNED_PREFIX = "[CACHED FACT]"
+
+
+def chunk_text(text: str, max_tokens: int = RERANK_CHUNK_TOKENS) -> List[str]:
+    """Group sentence-sized snippets into chunks of at most `max_tokens` tokens."""
+    chunks, current, size = [], [], 0
+    for sentence in split_snippets(text):
+        tokens = count_tokens(sentence)
+        if tokens > max_tokens:
+            sentence, tokens = truncate_tokens(sentence, max_tokens), max_tokens
+        if current and size + tokens > max_tokens:
+            chunks.append(" ".join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def split_evidence(items: List[str]) -> Tuple[List[str], List[str]]:
+    """Pinned cached facts and deduplicated chunks of everything else."""
+    pinned, chunks, seen = [], [], set()
+    for item in items:
+        item = item if isinstance(item, str) else str(item)
+        if item.startswith(PINNED_PREFIX):
+            pinned.append(item)
+            continue
+        for chunk in chunk_text(item):
+            h = text_hash(chunk)
+            if h not in seen:
+                seen.add(h)
+                chunks.append(chunk)
+    return pinned, chunks
+
+
+def rerank_evidence(data: Dict[str, List[str]], top_k: int = RERANK_TOP_K,
+                    budget_tokens: int = RERANK_BUDGET_TOKENS) -> Tuple[Dict[str, List[str]], Dict[str, int]]:
+    """Keep the chunks most similar to each sub-query.
+
+    Args:
+        data (Dict[str, List[str]]): Sub-query -> collected evidence.
+        top_k (int): Maximum chunks per sub-query.
+        budget_tokens (int): Token budget per sub-query, pinned facts included.
+
+    Returns:
+        Tuple[Dict[str, List[str]], Dict[str, int]]: Reranked data (best first) and
+        counts of chunks before/after and tokens kept, for the CoT note.
+    """
+    split = {sq: split_evidence(items) for sq, items in data.items() if items}
+    texts = [chunk for _, chunks in split.values() for chunk in chunks]
+    stats = {"chunks": len(texts), "kept": 0, "tokens": 0}
+    if not texts:
+        return data, stats
+
+    queries = list(split)
+    # One batch for every chunk and sub-query; unchanged chunks come from the memo
+    vectors = embed_cached(texts + queries)
+    chunk_vectors, query_vectors = vectors[:len(texts)], vectors[len(texts):]
+
+    reranked = dict(data)
+    offset = 0
+    for q_index, sq in enumerate(queries):
+        pinned, chunks = split[sq]
+        scores = chunk_vectors[offset:offset + len(chunks)] @ query_vectors[q_index]
+        offset += len(chunks)
+
+        kept = list(pinned)
+        used = sum(count_tokens(p) for p in pinned)
+        for index in np.argsort(-scores, kind="stable"):
+            if len(kept) - len(pinned) >= top_k or scores[index] < RERANK_MIN_SCORE:
+                break
+            tokens = count_tokens(chunks[index])
+            if used + tokens > budget_tokens and len(kept) > len(pinned):
+                continue
+            kept.append(chunks[index])
+            used += tokens
+        reranked[sq] = kept
+        stats["kept"] += len(kept) - len(pinned)
+        stats["tokens"] += used
+    return reranked, stats
+
+
+def rerank_safely(data: Dict[str, List[str]]) -> Tuple[Dict[str, List[str]], Dict[str, int]]:
+    """`rerank_evidence` that falls back to the unranked data if the embedding model is unavailable."""
+    if not RERANK_ENABLED:
+        return data, {}
+    try:
+        return rerank_evidence(data)
+    except Exception as exc:
+        logger.warning("evidence rerank failed, keeping unranked data: %s", exc)
+        return data, {}
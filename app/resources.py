@@ -0,0 +1,170 @@
+"""Lazily initialised, process-wide resources (LLM clients, Chroma, runnables).
+
+Modules used to build every client at import time, so a Chroma outage could
+block or crash Streamlit start-up and every cold start paid for all of it.
+Resources are now registered with a factory and created on first use,
+once per process, and shared by all sessions. Creation time is recorded,
+failures are remembered for a short back-off instead of being retried on
+every call, and optional health checks and warm-up hooks can be run in the
+background at start-up.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceUnavailable(RuntimeError):
+    """Raised when a resource failed to initialise and is still in back-off."""
+
+
+@dataclass
+class _Entry:
+    factory: Callable[[], Any]
+    health_check: Optional[Callable[[Any], Any]] = None
+    warmup: Optional[Callable[[Any], Any]] = None
+    retry_after: float = 30.0
+    instance: Any = None
+    created: bool = False
+    init_seconds: Optional[float] = None
+    warmup_seconds: Optional[float] = None
+    failed_at: Optional[float] = None
+    error: Optional[str] = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class Registry:
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        self._warmup_thread: Optional[threading.Thread] = None
+
+    def register(self, name: str, factory: Callable[[], Any], health_check: Optional[Callable[[Any], Any]] = None,
+                 warmup: Optional[Callable[[Any], Any]] = None, retry_after: float = 30.0):
+        """Register a factory. Nothing is created until `get` is called.
+
+        Args:
+            name (str): Resource name.
+            factory (Callable): Builds the resource.
+            health_check (Optional[Callable]): Called with the instance; should raise if unhealthy.
+            warmup (Optional[Callable]): Called with the instance by `warmup()`.
+            retry_after (float): Seconds to wait after a failed creation before trying again.
+        """
+        self._entries[name] = _Entry(factory, health_check, warmup, retry_after)
+
+    def get(self, name: str) -> Any:
+        entry = self._entries[name]
+        if entry.created:
+            return entry.instance
+        with entry.lock:
+            if entry.created:
+                return entry.instance
+            if entry.failed_at is not None and time.monotonic() - entry.failed_at < entry.retry_after:
+                raise ResourceUnavailable(f"{name} unavailable: {entry.error}")
+
+            started = time.perf_counter()
+            try:
+                instance = entry.factory()
+            except Exception as exc:
+                entry.failed_at = time.monotonic()
+                entry.error = str(exc)
+                logger.warning("resource %s failed to initialise: %s", name, exc)
+                raise ResourceUnavailable(f"{name} unavailable: {exc}") from exc
+
+            entry.init_seconds = time.perf_counter() - started
+            entry.instance, entry.created = instance, True
+            entry.failed_at = entry.error = None
+            logger.info("resource %s initialised in %.3fs", name, entry.init_seconds)
+            return instance
+
+    def peek(self, name: str) -> Any:
+        """The instance if it has already been created, else None; never creates it."""
+        entry = self._entries.get(name)
+        return entry.instance if entry is not None and entry.created else None
+
+    def lazy(self, name: str) -> "LazyResource":
+        return LazyResource(self, name)
+
+    def override(self, name: str, instance: Any):
+        """Replace a resource with a ready instance (benchmarks, local stand-ins)."""
+        entry = self._entries.setdefault(name, _Entry(factory=lambda: instance))
+        with entry.lock:
+            entry.instance, entry.created = instance, True
+            entry.failed_at = entry.error = None
+            entry.init_seconds = 0.0
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        """Run health checks on created resources; uncreated ones are reported as pending."""
+        report = {}
+        for name, entry in self._entries.items():
+            if not entry.created:
+                report[name] = {"status": "failed" if entry.error else "pending", "error": entry.error}
+                continue
+            try:
+                if entry.health_check:
+                    entry.health_check(entry.instance)
+                report[name] = {"status": "ok", "error": None}
+            except Exception as exc:
+                report[name] = {"status": "unhealthy", "error": str(exc)}
+        return report
+
+    def warmup(self, names: Optional[Iterable[str]] = None):
+        """Create resources and run their warm-up hooks; failures are logged, not raised."""
+        for name in names or list(self._entries):
+            try:
+                instance = self.get(name)
+                entry = self._entries[name]
+                if entry.warmup and entry.warmup_seconds is None:
+                    started = time.perf_counter()
+                    entry.warmup(instance)
+                    entry.warmup_seconds = time.perf_counter() - started
+            except Exception as exc:
+                logger.warning("warm-up of %s failed: %s", name, exc)
+
+    def warmup_in_background(self, names: Optional[Iterable[str]] = None) -> threading.Thread:
+        """Start `warmup` in a daemon thread once per process."""
+        if self._warmup_thread is None:
+            self._warmup_thread = threading.Thread(target=self.warmup, args=(names,), name="warmup", daemon=True)
+            self._warmup_thread.start()
+        return self._warmup_thread
+
+    def startup_report(self) -> Dict[str, Dict[str, Any]]:
+        """Per-resource initialisation and warm-up timings."""
+        return {
+            name: {
+                "created": entry.created,
+                "init_seconds": entry.init_seconds,
+                "warmup_seconds": entry.warmup_seconds,
+                "error": entry.error,
+            }
+            for name, entry in self._entries.items()
+        }
+
+
+class LazyResource:
+    """Proxy that resolves the registry entry on first attribute access.
+
+    Lets modules keep module-level names like `cache_collection` or
+    `router_runnable` without creating anything at import time.
+    """
+
+    __slots__ = ("_registry", "_name")
+
+    def __init__(self, registry: Registry, name: str):
+        object.__setattr__(self, "_registry", registry)
+        object.__setattr__(self, "_name", name)
+
+    def __getattr__(self, attr):
+        return getattr(self._registry.get(self._name), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._registry.get(self._name)(*args, **kwargs)
+
+    def __repr__(self):
+        return f"<LazyResource {self._name}>"
+
+
+registry = Registry()
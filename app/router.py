@@ -0,0 +1,242 @@
+"""Local routing between the "simple" and "pro" pipelines.
+
+`router_node` used to spend a full LLM round-trip on a two-way
+classification. Local backends answer first; the LLM is consulted only
+when none of them is confident enough, and every LLM decision is logged
+and fed back into the nearest-centroid backend, so the local router keeps
+improving with traffic.
+
+Backends are selected with ROUTER_BACKEND:
+    * "hybrid" (default) - keyword and centroid, LLM fallback;
+    * "keyword" / "centroid" - a single local backend, LLM fallback;
+    * "llm" - always call the LLM (previous behaviour).
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from embeddings import embed, embed_cached
+
+logger = logging.getLogger(__name__)
+
+ROUTER_BACKEND = os.getenv("ROUTER_BACKEND", "hybrid")
+ROUTER_MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.8"))
+ROUTER_LOG_PATH = os.getenv("ROUTER_LOG_PATH", os.path.join(".cache", "router_log.jsonl"))
+ROUTER_MIN_EXAMPLES = int(os.getenv("ROUTER_MIN_EXAMPLES", "20"))
+ROUTER_MAX_EXAMPLES = int(os.getenv("ROUTER_MAX_EXAMPLES", "5000"))
+ROUTER_CENTROID_SCALE = float(os.getenv("ROUTER_CENTROID_SCALE", "25"))
+
+MODES = ("simple", "pro")
+
+
+def label_from_llm(output: str) -> str:
+    """Same rule as `orchestrator.route_mode`: anything without "simple" is "pro"."""
+    return "simple" if "simple" in output.lower() else "pro"
+
+
+@dataclass
+class RouteDecision:
+    mode: str
+    confidence: float
+    backend: str
+
+
+class KeywordRouter:
+    """Hand-written markers of single-fact versus multi-hop questions."""
+
+    name = "keyword"
+
+    PRO_MARKERS = [
+        r"\bсравн", r"\bcompar", r"\bпочему\b", r"\bwhy\b", r"\bвлияни", r"\bimpact\b", r"\beffect",
+        r"\bанализ", r"\banaly[sz]", r"\bплюсы и минусы\b", r"\bpros and cons\b", r"\bистори[яи]\b",
+        r"\bhistory of\b", r"\bтенденц", r"\btrend", r"\bпрогноз", r"\bforecast", r"\bразниц",
+        r"\bdifference", r"\bкак .* связан", r"\bhow .* relate", r"\bпоследстви", r"\bconsequence",
+        r"\bобъясни", r"\bexplain\b", r"\bдоказ", r"\bevidence\b",
+    ]
+    SIMPLE_MARKERS = [
+        r"^(кто|что|где|когда|сколько)\b", r"^(who|what|where|when|how many|how much)\b",
+        r"\bчто такое\b", r"\bwhat is\b", r"\bстолица\b", r"\bcapital of\b", r"\bкурс\b", r"\bпогода\b",
+        r"\bweather\b", r"\bdefine\b", r"\bопредели", r"\bпереведи\b", r"\btranslate\b",
+    ]
+
+    def __init__(self):
+        self._pro = [re.compile(p) for p in self.PRO_MARKERS]
+        self._simple = [re.compile(p) for p in self.SIMPLE_MARKERS]
+
+    def classify(self, query: str) -> Optional[RouteDecision]:
+        text = query.lower().strip()
+        words = len(text.split())
+        score = sum(1.0 for p in self._pro if p.search(text)) - sum(1.0 for p in self._simple if p.search(text))
+        score += 0.5 * (text.count("?") - 1) if text.count("?") > 1 else 0.0
+        score += 1.0 if words > 25 else (-0.5 if words <= 6 else 0.0)
+        score += 0.5 * len(re.findall(r"\b(и|and|а также|as well as)\b", text)) if words > 10 else 0.0
+
+        if score == 0:
+            return None
+        confidence = min(0.5 + 0.15 * abs(score), 0.99)
+        return RouteDecision("pro" if score > 0 else "simple", confidence, self.name)
+
+
+class CentroidRouter:
+    """Nearest centroid over local embeddings, trained from logged LLM decisions.
+
+    Centroids are kept as running sums, so every new labelled example is
+    folded in immediately without re-embedding the history.
+    """
+
+    name = "centroid"
+
+    def __init__(self, log_path: str = ROUTER_LOG_PATH, min_examples: int = ROUTER_MIN_EXAMPLES):
+        self.log_path = log_path
+        self.min_examples = min_examples
+        self._sums: Dict[str, np.ndarray] = {}
+        self._counts: Dict[str, int] = {mode: 0 for mode in MODES}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            examples = self.load_log()
+        if examples:
+            self.train(examples)
+
+    def load_log(self) -> List[Dict[str, str]]:
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                lines = f.readlines()[-ROUTER_MAX_EXAMPLES:]
+        except OSError:
+            return []
+        examples = []
+        for line in lines:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if item.get("mode") in MODES and item.get("query"):
+                examples.append(item)
+        return examples
+
+    def train(self, examples: List[Dict[str, str]]):
+        """Rebuild centroids from labelled examples ({"query", "mode"})."""
+        vectors = embed([e["query"] for e in examples])
+        sums, counts = {}, {mode: 0 for mode in MODES}
+        for example, vector in zip(examples, vectors):
+            mode = example["mode"]
+            sums[mode] = sums.get(mode, 0) + vector
+            counts[mode] += 1
+        with self._lock:
+            self._sums, self._counts = sums, counts
+
+    def add(self, query: str, mode: str):
+        vector = embed_cached([query])[0]
+        with self._lock:
+            self._sums[mode] = self._sums.get(mode, 0) + vector
+            self._counts[mode] += 1
+
+    @property
+    def trained(self) -> bool:
+        return all(self._counts[mode] >= self.min_examples for mode in MODES)
+
+    def classify(self, query: str) -> Optional[RouteDecision]:
+        self._ensure_loaded()
+        if not self.trained:
+            return None
+        vector = embed_cached([query])[0]
+        with self._lock:
+            scores = {}
+            for mode in MODES:
+                centroid = self._sums[mode] / self._counts[mode]
+                scores[mode] = float(vector @ centroid / max(np.linalg.norm(centroid), 1e-12))
+        mode = max(scores, key=scores.get)
+        margin = scores[mode] - min(scores.values())
+        confidence = 1 / (1 + math.exp(-ROUTER_CENTROID_SCALE * margin))
+        return RouteDecision(mode, confidence, self.name)
+
+
+class Router:
+    """Runs the local backends and tracks how often the LLM fallback is needed."""
+
+    def __init__(self, backend: str = ROUTER_BACKEND, min_confidence: float = ROUTER_MIN_CONFIDENCE,
+                 log_path: str = ROUTER_LOG_PATH):
+        self.min_confidence = min_confidence
+        self.log_path = log_path
+        self.centroid = CentroidRouter(log_path)
+        backends = {
+            "hybrid": [KeywordRouter(), self.centroid],
+            "keyword": [KeywordRouter()],
+            "centroid": [self.centroid],
+            "llm": [],
+        }
+        if backend not in backends:
+            raise ValueError(f"Unknown ROUTER_BACKEND: {backend}")
+        self.backends = backends[backend]
+        self._lock = threading.Lock()
+        self.stats = {"local": 0, "fallback": 0, "errors": 0}
+
+    def route_local(self, query: str) -> Optional[RouteDecision]:
+        """Most confident local decision, or None if the LLM should decide.
+
+        Backends are tried in order and later (more expensive) ones are
+        skipped once a confident decision is found.
+        """
+        best = None
+        for backend in self.backends:
+            try:
+                decision = backend.classify(query)
+            except Exception as exc:
+                logger.warning("router backend %s failed: %s", backend.name, exc)
+                with self._lock:
+                    self.stats["errors"] += 1
+                continue
+            if decision and (best is None or decision.confidence > best.confidence):
+                best = decision
+            if best is not None and best.confidence >= self.min_confidence:
+                break
+
+        with self._lock:
+            if best is not None and best.confidence >= self.min_confidence:
+                self.stats["local"] += 1
+                return best
+            self.stats["fallback"] += 1
+        return None
+
+    def record_llm(self, query: str, output: str) -> str:
+        """Log an LLM routing decision and use it as a training example."""
+        mode = label_from_llm(output)
+        try:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"query": query, "mode": mode}, ensure_ascii=False) + "\n")
+        except OSError as exc:
+            logger.warning("router log write failed: %s", exc)
+        if self.centroid in self.backends:
+            try:
+                self.centroid.add(query, mode)
+            except Exception as exc:
+                logger.warning("router centroid update failed: %s", exc)
+        return mode
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self.stats)
+        total = stats["local"] + stats["fallback"]
+        stats["fallback_rate"] = stats["fallback"] / total if total else 0.0
+        return stats
+
+
+router = Router()
@@ -0,0 +1,171 @@
+"""Caching wrapper around the DuckDuckGo search tool.
+
+The retriever, checker and counter-argument nodes often issue near-identical
+queries within one run, and popular questions repeat across users. Results
+are kept in an in-process LRU backed by a SQLite TTL cache so they survive
+restarts, and concurrent identical queries share one upstream request.
+"""
+
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from parallel import SingleFlight
+
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", os.path.join(".cache", "search.sqlite3"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "21600"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2048"))
+
+_WS_RE = re.compile(r"\s+")
+_EDGE_RE = re.compile(r"^[\s\"'«»“”.,!?;:]+|[\s\"'«»“”.,!?;:]+$")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and strip quotes/punctuation at the edges."""
+    return _EDGE_RE.sub("", _WS_RE.sub(" ", query.lower()))
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with per-entry expiry."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SqliteTTLCache:
+    """Persistent key/value store with TTL, shared between processes via SQLite."""
+
+    def __init__(self, path: str, table: str = "search_cache"):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl),
+            )
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),))
+        return cur.rowcount
+
+
+class CachedSearch:
+    """Drop-in replacement for `search_tool.run` / `search_tool.arun`.
+
+    Lookup order is memory LRU, then the persistent cache, then the wrapped
+    tool. Only one upstream request is made for concurrent identical
+    queries. The wrapped tool is still the one bound to the LLM.
+    """
+
+    def __init__(self, tool, ttl: float = SEARCH_CACHE_TTL, maxsize: int = SEARCH_CACHE_SIZE,
+                 path: str = SEARCH_CACHE_PATH):
+        self.tool = tool
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize)
+        self.store = SqliteTTLCache(path)
+        self._flight = SingleFlight()
+        self._stats_lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    @property
+    def name(self) -> str:
+        return self.tool.name
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _fetch(self, key: str, query: str) -> str:
+        cached = self.store.get(key)
+        if cached is not None:
+            self._count("disk_hits")
+            self.memory.set(key, cached, self.ttl)
+            return cached
+
+        self._count("misses")
+        try:
+            result = self.tool.run(query)
+        except Exception:
+            self._count("errors")
+            raise
+        self.memory.set(key, result, self.ttl)
+        self.store.set(key, result, self.ttl)
+        return result
+
+    def run(self, query: str) -> str:
+        key = normalize_query(query)
+        cached = self.memory.get(key)
+        if cached is not None:
+            self._count("memory_hits")
+            return cached
+
+        result, shared = self._flight.do(key, lambda: self._fetch(key, query))
+        if shared:
+            self._count("coalesced")
+        return result
+
+    async def arun(self, query: str) -> str:
+        key = normalize_query(query)
+        cached = self.memory.get(key)
+        if cached is not None:
+            self._count("memory_hits")
+            return cached
+        return await asyncio.to_thread(self.run, query)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters plus hit rate, for logs and the UI."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        return stats
@@ -1,10 +1,25 @@
+import os
+import time
+
 import streamlit as st
-from orchestrator import graph
+from sessions import get_session_loop
+from orchestrator import graph, initial_state
+from resources import registry
+from cache_maintenance import start_background_compaction, cache_metrics
+from metrics import metrics, tracer
+from model_routing import model_router
+from throttle import governor
 from langchain_core.messages import HumanMessage
 from uuid import uuid4
 
 st.set_page_config(page_title="TEAM4_Chat", layout="wide")
 
+# Не чаще одной перерисовки ответа за этот интервал, иначе websocket забивается на каждом токене
+STREAM_REFRESH_SECONDS = float(os.getenv("STREAM_REFRESH_SECONDS", "0.05"))
+# Сколько последних шагов/сообщений показывать целиком; более ранние листаются по страницам
+CHAIN_TAIL_STEPS = int(os.getenv("CHAIN_TAIL_STEPS", "20"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+
 gradient_css = """
 <style>
     .stApp {
@@ -18,18 +33,37 @@ st.markdown(gradient_css, unsafe_allow_html=True)
 title_html = "<h1 style='color:black;'>TEAM4_Chat</h1>"
 st.markdown(title_html, unsafe_allow_html=True)
 
+# Клиенты поднимаются в фоне один раз на процесс, UI не ждёт Chroma и LLM
+registry.warmup_in_background()
+start_background_compaction()
+
+with st.sidebar.expander("Ресурсы"):
+    st.json({"startup": registry.startup_report(), "health": registry.health()})
+
+with st.sidebar.expander("Кэш фактов"):
+    st.json(cache_metrics())
+
+with st.sidebar.expander("Модели"):
+    st.json(model_router.snapshot())
+
+with st.sidebar.expander("Лимиты провайдеров"):
+    st.json(governor.snapshot())
+
+with st.sidebar.expander("Метрики (Prometheus)"):
+    st.code(metrics.render(), language="text")
+
 if "thread_id" not in st.session_state:
-    st.session_state.thread_id = str(uuid4())
-
-if "state" not in st.session_state:
-    st.session_state.state = {
-        "query": "",
-        "sub_queries": [],
-        "data": {},
-        "verified_facts": {},
-        "messages": [],
-        "final_answer": ""
-    }
+    # thread_id живёт в URL, поэтому после перезагрузки страницы или рестарта сервера диалог восстанавливается
+    st.session_state.thread_id = st.query_params.get("thread") or str(uuid4())
+    st.query_params["thread"] = st.session_state.thread_id
+
+if "view" not in st.session_state:
+    # Копия состояния только для отрисовки (CoT, диалог, ответ); входом графа она не служит
+    st.session_state.view = {"messages": [], "final_answer": ""}
+    # Последнее сохранённое состояние треда из чекпоинтера
+    saved = graph.get_state({"configurable": {"thread_id": st.session_state.thread_id}}).values
+    if saved:
+        st.session_state.view.update(saved)
 
 left_col, right_col = st.columns([2, 1])
 
@@ -38,13 +72,61 @@ with right_col:
     chain_placeholder = st.empty()
 
 
+def step_markdown(i: int, msg) -> str:
+    """Markdown одного шага CoT, кэшируется в сессии по индексу сообщения"""
+    cache = st.session_state.setdefault("rendered_steps", {})
+    content = msg.content if isinstance(msg.content, str) else str(msg.content)
+    signature = (msg.__class__.__name__, len(content))
+    cached = cache.get(i)
+    if cached is None or cached[0] != signature:
+        fence = "`" * max(3, max((len(run) for run in content.split("\n") if set(run) == {"`"}), default=0) + 1)
+        cached = (signature, f"**Шаг {i + 1} • {msg.__class__.__name__}**\n{fence}\n{content}\n{fence}")
+        cache[i] = cached
+    return cached[1]
+
+
+def render_pages(label: str, count: int, render_item, key: str):
+    """Старые элементы в свёрнутом блоке, по одной странице за раз"""
+    if count <= 0:
+        return
+    pages = (count + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+    with st.expander(f"{label} ({count})"):
+        page = st.number_input("Страница", 1, pages, pages, key=key) if pages > 1 else 1
+        start = (page - 1) * HISTORY_PAGE_SIZE
+        for i in range(start, min(start + HISTORY_PAGE_SIZE, count)):
+            render_item(i)
+
+
+class ChainRenderer:
+    """Дорисовывает в панель CoT только новые шаги вместо полной перерисовки"""
+
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.box = None
+        self.shown = 0
+
+    def render(self, messages):
+        if self.box is None or len(messages) < self.shown:
+            # Первый вызов или история переписана: ранние шаги по страницам, хвост целиком
+            self.box = self.placeholder.container()
+            self.shown = max(0, len(messages) - CHAIN_TAIL_STEPS)
+            with self.box:
+                render_pages("Ранние шаги", self.shown, lambda i: st.markdown(step_markdown(i, messages[i])),
+                             key="chain_page")
+        for i in range(self.shown, len(messages)):
+            self.box.markdown(step_markdown(i, messages[i]))
+        self.shown = len(messages)
+
+
+chain = ChainRenderer(chain_placeholder)
+
+
 def render_chain_of_thought():
     """Рисуем CoT из реального состояния графа"""
-    messages = st.session_state.state.get("messages", [])
-    with chain_placeholder.container():
-        for i, msg in enumerate(messages):
-            st.markdown(f"### Шаг {i+1} • {msg.__class__.__name__}")
-            st.code(msg.content)
+    chain.render(st.session_state.view.get("messages", []))
+
+
+render_chain_of_thought()
 
 
 with left_col:
@@ -53,24 +135,56 @@ with left_col:
 
     if user_query and st.session_state.get("last_handled") != user_query:
         st.session_state.last_handled = user_query
-        st.session_state.state["messages"].append(HumanMessage(content=user_query))
-        st.session_state.state["query"] = user_query
+        st.session_state.view["messages"] = st.session_state.view["messages"] + [HumanMessage(content=user_query)]
+        st.session_state.view["final_answer"] = ""
 
         config = {"configurable": {"thread_id": st.session_state.thread_id}}
-
-        for update in graph.stream(st.session_state.state, config=config):
-
-            if isinstance(update, dict) and "state" in update:
-                st.session_state.state = update["state"]
+        live_answer = st.empty()
+        streamed, last_paint = "", 0.0
+
+        # Каждый запрос стартует с чистого состояния; история сообщений живёт в чекпоинтере (add_messages)
+        run_input = initial_state(user_query)
+        # Граф выполняется на общем event loop, скрипт сессии только читает обновления
+        for kind, node, payload in get_session_loop().stream_events(run_input, config=config):
+            if kind == "token":
+                # Токены дописываются в один placeholder, CoT при этом не перерисовывается
+                streamed += payload
+                if time.monotonic() - last_paint >= STREAM_REFRESH_SECONDS:
+                    live_answer.markdown(streamed + "▌")
+                    last_paint = time.monotonic()
+                continue
+
+            if isinstance(payload, dict):
+                # Узлы возвращают только изменённые ключи; сообщения дописываются, как в графе
+                view = st.session_state.view
+                view["messages"] = view["messages"] + payload.get("messages", [])
+                view.update({k: v for k, v in payload.items() if k != "messages"})
             render_chain_of_thought()
 
+        live_answer.empty()
+        # Итоговое состояние треда из чекпоинтера, только для отрисовки
+        st.session_state.view.update(graph.get_state(config).values)
+
     st.subheader("Диалог")
 
-    for msg in st.session_state.state.get("messages", []):
+    history = st.session_state.view.get("messages", [])
+    older = max(0, len(history) - HISTORY_PAGE_SIZE)
+
+    def render_message(i: int):
+        msg = history[i]
         role = "user" if isinstance(msg, HumanMessage) else "assistant"
         with st.chat_message(role):
             st.write(msg.content)
 
-    if st.session_state.state.get("final_answer", "Что еще хотите узнать?"):
+    render_pages("Ранние сообщения", older, render_message, key="dialog_page")
+    for i in range(older, len(history)):
+        render_message(i)
+
+    trace = tracer.last(st.session_state.thread_id)
+    if trace is not None:
+        with st.expander(f"Трасса запроса • {trace.seconds or 0:.1f} с"):
+            st.dataframe([{"node": node, **row} for node, row in trace.summary().items()])
+
+    if st.session_state.view.get("final_answer", "Что еще хотите узнать?"):
         st.subheader("Финальный ответ")
-        st.markdown(st.session_state.state["final_answer"])
+        st.markdown(st.session_state.view["final_answer"])
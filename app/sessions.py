@@ -0,0 +1,298 @@
+"""Shared event loop that drives many user sessions through the async graph.
+
+Streamlit runs every session in its own script thread. Instead of blocking
+that thread on the sync graph for the whole pipeline, the script submits the
+run to one process-wide event loop and only consumes the stream updates.
+All sessions share the loop, so concurrency is bounded by I/O wait rather
+than by the number of threads.
+
+Before a run starts, the answer cache is consulted. On a miss, sessions
+asking the same (normalised) query at the same time share one graph
+execution: the first one leads, the others attach to its event stream
+and get the result recorded in their own threads.
+"""
+
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from answer_cache import AnswerCache, answer_cache, is_complete, query_key
+from fetcher import aclose_loop_client
+from metrics import tracer
+from orchestrator import async_graph
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSIONS = int(os.getenv("MAX_CONCURRENT_SESSIONS", "64"))
+
+# Узлы, чьи токены показываются пользователю по мере генерации
+STREAMING_NODES = frozenset({"simple", "synthesizer"})
+
+# Поля итогового состояния, которые копируются в треды сессий, получивших чужой ответ
+SHARED_KEYS = ("final_answer", "sub_queries", "data", "verified_facts", "counter_arguments")
+
+_DONE = object()
+
+
+class Flight:
+    """One graph execution shared by all sessions asking the same query at the same time.
+
+    Events are kept until the run ends, so a session that attaches late
+    replays what it missed and then follows the live stream.
+    """
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.values: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.followers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, event: Any):
+        self.events.append(event)
+        self._notify()
+
+    def finish(self, values: Optional[Dict[str, Any]] = None, error: Optional[BaseException] = None):
+        self.values, self.error, self.done = values, error, True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[Any]:
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+def as_chunks(stream_mode: Any, update: Dict[str, Any], values: Dict[str, Any]) -> List[Any]:
+    """Stream chunks that look like one graph node named "answer_cache" produced `update`."""
+    modes = stream_mode if isinstance(stream_mode, (list, tuple)) else [stream_mode or "values"]
+    payloads = {"updates": {"answer_cache": update}, "values": values}
+    chunks = [(mode, payloads[mode]) for mode in modes if mode in payloads]
+    return chunks if isinstance(stream_mode, (list, tuple)) else [payload for _, payload in chunks]
+
+
+class SessionLoop:
+    """Background asyncio loop executing graph runs for all sessions."""
+
+    def __init__(self, graph=async_graph, max_sessions: int = MAX_SESSIONS, answers: AnswerCache = answer_cache):
+        self.graph = graph
+        self.max_sessions = max_sessions
+        self.answers = answers
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="session-loop", daemon=True)
+        self._semaphore = asyncio.Semaphore(max_sessions)
+        self._flights: Dict[Tuple[str, str], Flight] = {}
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def shutdown(self, timeout: float = 10.0):
+        """Close the clients bound to the loop, then stop the loop and its thread."""
+        if self.loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(aclose_loop_client(), self.loop).result(timeout)
+        except Exception as exc:
+            logger.warning("closing loop clients failed: %s", exc)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self.loop.close()
+
+    async def _settle(self, state: Dict[str, Any], config: Dict[str, Any], update: Dict[str, Any],
+                      note: str) -> Dict[str, Any]:
+        """Record an answer produced elsewhere (cache or another session's run) in this session's thread."""
+        values = {**state, **update, "messages": list(state.get("messages") or []) + [AIMessage(content=note)]}
+        try:
+            await self.graph.aupdate_state(config, values, as_node="synthesizer")
+        except Exception as exc:
+            logger.warning("could not record shared answer for %s: %s", config["configurable"]["thread_id"], exc)
+        return values
+
+    async def _from_cache(self, state: Dict[str, Any], config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        hit = await asyncio.to_thread(self.answers.lookup, state.get("query", ""))
+        if hit is None:
+            return None
+        return await self._settle(state, config, {"final_answer": hit["answer"]},
+                                  f"[cache] answer: {hit['kind']} hit ({hit['age']:.0f}s old)")
+
+    def _join(self, state: Dict[str, Any], mode: str,
+              run: Callable[[Callable[[Any], None]], Awaitable[Dict[str, Any]]]) -> Tuple[Flight, bool]:
+        """Attach to the running flight for this query, or start one; returns (flight, is_leader)."""
+        key = (query_key(state.get("query", "")), mode)
+        flight = self._flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = self._flights[key] = Flight()
+
+        async def lead():
+            try:
+                async with self._semaphore:
+                    values = await run(flight.publish)
+            except BaseException as exc:
+                flight.finish(error=exc)
+                self._flights.pop(key, None)
+                return
+            flight.finish(values)
+            try:
+                # Пока ответ пишется в кэш, новые сессии подхватывают уже завершённый flight
+                if is_complete(values):
+                    await asyncio.to_thread(self.answers.store, state.get("query", ""), values["final_answer"])
+            finally:
+                self._flights.pop(key, None)
+
+        flight.task = asyncio.ensure_future(lead())
+        return flight, True
+
+    async def _follow(self, flight: Flight) -> AsyncIterator[Any]:
+        flight.followers += 1
+        try:
+            async for event in flight.follow():
+                yield event
+        finally:
+            flight.followers -= 1
+            # Все сессии ушли (например, rerun в Streamlit): выполнять граф больше не для кого
+            if not flight.done and flight.followers == 0:
+                flight.task.cancel()
+
+    async def _shared(self, state: Dict[str, Any], config: Dict[str, Any], flight: Flight) -> Dict[str, Any]:
+        update = {k: flight.values[k] for k in SHARED_KEYS if k in flight.values}
+        return await self._settle(state, config, update, "[cache] answer: shared run of an identical query")
+
+    async def astream(self, state: Dict[str, Any], config: Dict[str, Any], **kwargs) -> AsyncIterator[Any]:
+        """Stream graph updates for one session, waiting for a free slot first.
+
+        A cached answer is streamed as a single update of the pseudo-node
+        "answer_cache"; a concurrent identical query is joined instead of
+        running the graph again.
+        """
+        thread_id = config["configurable"]["thread_id"]
+        tracer.start(thread_id, state.get("query", ""))
+        try:
+            values = await self._from_cache(state, config)
+            if values is not None:
+                update = {"final_answer": values["final_answer"], "messages": values["messages"][-1:]}
+                for chunk in as_chunks(kwargs.get("stream_mode"), update, values):
+                    yield chunk
+                return
+
+            async def run(publish):
+                async for chunk in self.graph.astream(state, config=config, **kwargs):
+                    publish(chunk)
+                return (await self.graph.aget_state(config)).values
+
+            flight, leader = self._join(state, repr(kwargs.get("stream_mode")), run)
+            async for chunk in self._follow(flight):
+                yield chunk
+            if not leader:
+                await self._shared(state, config, flight)
+        finally:
+            tracer.finish(thread_id)
+
+    async def arun(self, state: Dict[str, Any], config: Dict[str, Any]) -> Dict[str, Any]:
+        thread_id = config["configurable"]["thread_id"]
+        tracer.start(thread_id, state.get("query", ""))
+        try:
+            values = await self._from_cache(state, config)
+            if values is not None:
+                return values
+
+            async def run(publish):
+                return await self.graph.ainvoke(state, config=config)
+
+            flight, leader = self._join(state, "invoke", run)
+            async for _ in self._follow(flight):
+                pass
+            return flight.values if leader else await self._shared(state, config, flight)
+        finally:
+            tracer.finish(thread_id)
+
+    def run(self, state: Dict[str, Any], config: Dict[str, Any]) -> Dict[str, Any]:
+        """Blocking helper for callers outside the loop."""
+        return asyncio.run_coroutine_threadsafe(self.arun(state, config), self.loop).result()
+
+    def stream(self, state: Dict[str, Any], config: Dict[str, Any], **kwargs) -> Iterator[Any]:
+        """Sync iterator over `astream` for code running in other threads (Streamlit scripts).
+
+        The graph itself runs on the shared loop. If the consumer stops early,
+        for example on a Streamlit rerun, the run is cancelled.
+        """
+        updates: queue.Queue = queue.Queue()
+
+        async def pump():
+            try:
+                async for chunk in self.astream(state, config, **kwargs):
+                    updates.put(chunk)
+            except BaseException as exc:
+                updates.put(exc)
+                raise
+            finally:
+                updates.put(_DONE)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        try:
+            while True:
+                item = updates.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    if isinstance(item, asyncio.CancelledError):
+                        break
+                    raise item
+                yield item
+        finally:
+            if not future.done():
+                future.cancel()
+
+    def stream_events(self, state: Dict[str, Any], config: Dict[str, Any]) -> Iterator[Tuple[str, str, Any]]:
+        """Node updates interleaved with answer tokens, for incremental UIs.
+
+        Yields ("token", node, text) for every chunk generated by the LLM in
+        one of STREAMING_NODES and ("update", node, node_state) once a node
+        has finished. Tokens from the other nodes are dropped here, so the
+        UI only has to append to the answer and re-render on updates.
+        """
+        for mode, chunk in self.stream(state, config, stream_mode=["updates", "messages"]):
+            if mode == "messages":
+                message, metadata = chunk
+                node = metadata.get("langgraph_node")
+                if node in STREAMING_NODES and isinstance(message, AIMessageChunk) \
+                        and isinstance(message.content, str) and message.content:
+                    yield "token", node, message.content
+            elif isinstance(chunk, dict):
+                for node, update in chunk.items():
+                    yield "update", node, update
+
+
+_session_loop: Optional[SessionLoop] = None
+_session_loop_lock = threading.Lock()
+
+
+def get_session_loop() -> SessionLoop:
+    """Process-wide SessionLoop, created on first use."""
+    global _session_loop
+    with _session_loop_lock:
+        if _session_loop is None:
+            _session_loop = SessionLoop()
+            atexit.register(_session_loop.shutdown)
+    return _session_loop
@@ -0,0 +1,368 @@
+"""Shared rate limiting and adaptive concurrency for external providers.
+
+Nothing used to throttle calls to the LLM providers, DuckDuckGo or scraped
+sites. Under load, rate limits and DuckDuckGo bans surfaced as raw
+exceptions inside the nodes. Every outgoing call now goes through the
+`Limiter` of its provider, which combines:
+    * a token bucket (`rate` calls per second, bursts up to `burst`);
+    * an AIMD concurrency limit: it grows by about one slot per window of
+      successful calls and is halved on 429s or when latency exceeds
+      `latency_target`; a 429 also empties the bucket;
+    * fair queuing: waiters are grouped by session (LangGraph thread id),
+      and free slots are handed out round-robin between sessions, so one
+      heavy session cannot starve the others;
+    * retries of 429/5xx/timeouts with exponential backoff and full jitter,
+      honouring Retry-After when the provider sends it.
+For LLM calls this is the only retrying layer: the chat clients are created
+with max_retries=0, and no retry is started that would end past the deadline
+of the routed call (`call_deadline`, set by model_routing.RoutedRunnable).
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from langgraph.config import get_config
+
+from metrics import metrics
+from resources import ResourceUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Provider -> limiter settings; RATE_LIMITS (JSON) overrides individual fields
+PROVIDER_LIMITS: Dict[str, Dict[str, Any]] = {
+    "llm": {"rate": 5, "burst": 10, "concurrency": 8, "max_concurrency": 32, "latency_target": 60, "retries": 2},
+    "deepseek_llm": {"rate": 5, "burst": 10, "concurrency": 8, "max_concurrency": 32, "latency_target": 90,
+                     "retries": 2},
+    "openai": {"rate": 3, "burst": 6, "concurrency": 4, "max_concurrency": 16, "latency_target": 60, "retries": 2},
+    "duckduckgo": {"rate": 1, "burst": 3, "concurrency": 2, "max_concurrency": 4, "latency_target": 10, "retries": 3},
+    "scrape": {"rate": 10, "burst": 20, "concurrency": 16, "max_concurrency": 64, "latency_target": 15,
+               "retries": 1},
+}
+for _provider, _overrides in json.loads(os.getenv("RATE_LIMITS", "{}")).items():
+    PROVIDER_LIMITS[_provider] = {**PROVIDER_LIMITS.get(_provider, {}), **_overrides}
+
+BACKOFF_BASE = float(os.getenv("RATE_LIMIT_BACKOFF_BASE", "0.5"))
+BACKOFF_CAP = float(os.getenv("RATE_LIMIT_BACKOFF_CAP", "8"))
+AIMD_DECREASE = 0.5
+
+# Session of calls made outside a LangGraph run (scripts, batch jobs)
+current_session: contextvars.ContextVar[str] = contextvars.ContextVar("throttle_session", default="default")
+# time.monotonic() by which the current call must finish; retries that would end later are not started
+call_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("call_deadline", default=None)
+
+
+def session_key() -> str:
+    try:
+        thread_id = get_config().get("configurable", {}).get("thread_id")
+    except RuntimeError:
+        thread_id = None
+    return thread_id or current_session.get()
+
+
+def status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_throttled(exc: BaseException) -> bool:
+    """429 from an HTTP API, or DuckDuckGo's rate-limit exception."""
+    if status_code(exc) == 429 or type(exc).__name__ == "RateLimitError":
+        return True
+    message = str(exc).lower()
+    return "ratelimit" in message or "rate limit" in message
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """429, 5xx, timeouts and connection errors are worth retrying or sending to another provider."""
+    if isinstance(exc, (ResourceUnavailable, TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    if is_throttled(exc):
+        return True
+    status = status_code(exc)
+    if status is not None:
+        return status >= 500
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError", "InternalServerError", "ConnectTimeout",
+                                  "ReadTimeout", "ConnectError")
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class _Waiter:
+    event: Optional[threading.Event] = None
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    future: Optional[asyncio.Future] = None
+    granted: bool = False
+
+    def grant(self):
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+class Limiter:
+    """Token bucket plus AIMD concurrency limit with per-session fair queuing.
+
+    Args:
+        name (str): Provider name, used in logs and metrics.
+        rate (float): Sustained calls per second.
+        burst (float): Bucket capacity.
+        concurrency (int): Initial concurrency limit.
+        min_concurrency (int): Floor of the adaptive limit.
+        max_concurrency (int): Ceiling of the adaptive limit.
+        latency_target (Optional[float]): Calls slower than this count as congestion.
+        retries (int): Retries of retryable errors in `call`/`acall`.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, concurrency: int, min_concurrency: int = 1,
+                 max_concurrency: Optional[int] = None, latency_target: Optional[float] = None, retries: int = 2):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.limit = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency or concurrency * 4
+        self.latency_target = latency_target
+        self.retries = retries
+        self.tokens = float(burst)
+        self.in_flight = 0
+        self.stats = {"calls": 0, "throttled": 0, "retries": 0, "errors": 0, "queued": 0}
+        self._refilled = time.monotonic()
+        self._last_decrease = 0.0
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    # --- slots -----------------------------------------------------------------------------------------------
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _dispatch(self):
+        """Grant queued waiters while both a slot and a token are free; caller holds the lock."""
+        while self._queues and self.in_flight < max(int(self.limit), self.min_concurrency):
+            self._refill(time.monotonic())
+            if self.tokens < 1:
+                if self._timer is None:
+                    self._timer = threading.Timer((1 - self.tokens) / self.rate, self._on_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            # Round-robin over sessions: take the head of the first queue, move that session to the back
+            session, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(session)
+            else:
+                del self._queues[session]
+            self.tokens -= 1
+            self.in_flight += 1
+            waiter.grant()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _enqueue(self, waiter: _Waiter, session: str):
+        with self._lock:
+            self._queues.setdefault(session, deque()).append(waiter)
+            self.stats["queued"] += 1
+            self._dispatch()
+
+    def acquire(self, session: Optional[str] = None):
+        waiter = _Waiter(event=threading.Event())
+        self._enqueue(waiter, session or session_key())
+        waiter.event.wait()
+
+    async def aacquire(self, session: Optional[str] = None):
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop=loop, future=loop.create_future())
+        session = session or session_key()
+        self._enqueue(waiter, session)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if not waiter.granted:
+                    queue = self._queues.get(session)
+                    if queue and waiter in queue:
+                        queue.remove(waiter)
+                        if not queue:
+                            del self._queues[session]
+                    raise
+            self.release(0.0, record=False)
+            raise
+
+    def release(self, seconds: float, throttled: bool = False, error: bool = False, record: bool = True):
+        """Free a slot and adapt the limit to the outcome of the call."""
+        with self._lock:
+            self.in_flight -= 1
+            if record:
+                now = time.monotonic()
+                congested = throttled or (self.latency_target is not None and seconds > self.latency_target)
+                if congested:
+                    # At most one decrease per window, so a burst of 429s halves the limit once
+                    if now - self._last_decrease > max(1.0, seconds):
+                        self.limit = max(float(self.min_concurrency), self.limit * AIMD_DECREASE)
+                        self._last_decrease = now
+                    if throttled:
+                        self.tokens = min(self.tokens, 0.0)
+                elif not error:
+                    self.limit = min(float(self.max_concurrency), self.limit + 1 / max(self.limit, 1.0))
+            self._dispatch()
+
+    # --- calls -----------------------------------------------------------------------------------------------
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        return retry_after(exc) or random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def _failed(self, exc: BaseException, attempt: int, retries: int) -> Optional[float]:
+        """Book-keeping for a failed attempt; returns the backoff delay, or None to give up."""
+        throttled = is_throttled(exc)
+        self.stats["throttled" if throttled else "errors"] += 1
+        if throttled:
+            metrics.inc("throttled_total", help="Calls rejected by providers with 429", provider=self.name)
+        if attempt >= retries or not is_retryable(exc):
+            return None
+        delay = self._backoff(attempt, exc)
+        deadline = call_deadline.get()
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        self.stats["retries"] += 1
+        metrics.inc("throttle_retries_total", help="Calls retried after backoff", provider=self.name)
+        return delay
+
+    def call(self, func: Callable[..., Any], *args, retries: Optional[int] = None, **kwargs) -> Any:
+        retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            self.acquire()
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as exc:
+                self.release(time.monotonic() - started, throttled=is_throttled(exc), error=True)
+                delay = self._failed(exc, attempt, retries)
+                if delay is None:
+                    raise
+                logger.info("%s: retrying in %.1fs after %s", self.name, delay, exc)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.release(time.monotonic() - started)
+            self.stats["calls"] += 1
+            return result
+
+    async def acall(self, func: Callable[..., Awaitable[Any]], *args, retries: Optional[int] = None,
+                    **kwargs) -> Any:
+        retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            await self.aacquire()
+            started = time.monotonic()
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                self.release(time.monotonic() - started, record=False)
+                raise
+            except Exception as exc:
+                self.release(time.monotonic() - started, throttled=is_throttled(exc), error=True)
+                delay = self._failed(exc, attempt, retries)
+                if delay is None:
+                    raise
+                logger.info("%s: retrying in %.1fs after %s", self.name, delay, exc)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.release(time.monotonic() - started)
+            self.stats["calls"] += 1
+            return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"limit": round(self.limit, 2), "in_flight": self.in_flight, "tokens": round(self.tokens, 2),
+                    "waiting": sum(len(q) for q in self._queues.values()), **self.stats}
+
+
+class Governor:
+    """Process-wide limiters, one per provider, created on first use."""
+
+    def __init__(self, limits: Dict[str, Dict[str, Any]] = PROVIDER_LIMITS):
+        self.limits = limits
+        self._limiters: Dict[str, Limiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str) -> Limiter:
+        with self._lock:
+            if provider not in self._limiters:
+                settings = self.limits.get(provider) or self.limits["scrape"]
+                self._limiters[provider] = Limiter(provider, **settings)
+            return self._limiters[provider]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {name: limiter.snapshot() for name, limiter in limiters.items()}
+
+    def rate_limiter(self, provider: str):
+        """LangChain `rate_limiter` for chat models that are not called through `Throttled`."""
+        from langchain_core.rate_limiters import BaseRateLimiter
+
+        limiter = self.get(provider)
+
+        class _GovernorRateLimiter(BaseRateLimiter):
+            # Only the bucket and the fair queue apply: the model does not report when the call ends
+            def acquire(self, *, blocking: bool = True) -> bool:
+                limiter.acquire()
+                limiter.release(0.0, record=False)
+                return True
+
+            async def aacquire(self, *, blocking: bool = True) -> bool:
+                await limiter.aacquire()
+                limiter.release(0.0, record=False)
+                return True
+
+        return _GovernorRateLimiter()
+
+
+governor = Governor()
+
+
+class Throttled:
+    """Runnable or tool whose calls go through the provider's limiter.
+
+    Exposes `invoke`/`ainvoke` for chains and `run` for tools, so it can be
+    dropped in front of a `prompt | llm` chain or a search tool.
+    """
+
+    def __init__(self, target: Any, provider: str):
+        self.target = target
+        self.limiter = governor.get(provider)
+
+    def invoke(self, inputs, config=None, **kwargs):
+        return self.limiter.call(self.target.invoke, inputs, config, **kwargs)
+
+    async def ainvoke(self, inputs, config=None, **kwargs):
+        return await self.limiter.acall(self.target.ainvoke, inputs, config, **kwargs)
+
+    def run(self, *args, **kwargs):
+        return self.limiter.call(self.target.run, *args, **kwargs)
@@ -16,8 +16,11 @@ def trace_messages(func):
         if state and "messages" in state:
             st.subheader("Chain of Thought")
             for i, msg in enumerate(state["messages"]):
-                st.markdown(f"**Шаг {i + 1}:** `{msg['role']}`")
-                st.code(msg["content"], language="text")
+                # В state лежат BaseMessage, а не словари
+                role = msg["role"] if isinstance(msg, dict) else msg.type
+                content = msg["content"] if isinstance(msg, dict) else msg.content
+                st.markdown(f"**Шаг {i + 1}:** `{role}`")
+                st.code(content, language="text")
                 st.markdown("---")
         return result
 
@@ -1,63 +1,192 @@
 import chromadb
-from datetime import datetime
+from datetime import datetime, timezone
 import hashlib
+import logging
 import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from embeddings import embed_cached
+from resources import registry
+
+logger = logging.getLogger(__name__)
 
 host = os.getenv("CHROMA_HOST", "localhost")
 port = int(os.getenv("CHROMA_PORT", "8000"))
 
-client = chromadb.HttpClient(host=host, port=port)
+VERIFIED_CACHE_TTL = float(os.getenv("VERIFIED_CACHE_TTL", str(30 * 24 * 3600)))
+HIT_FLUSH_EVERY = int(os.getenv("VERIFIED_CACHE_HIT_FLUSH", "50"))
+# Коллекция в пространстве l2 по единичным векторам: расстояние = 2 - 2 * cos, 0.4 соответствует cos 0.8
+VERIFIED_CACHE_MAX_DISTANCE = float(os.getenv("VERIFIED_CACHE_MAX_DISTANCE", "0.4"))
+
 
-cache_collection = client.get_or_create_collection(
-    name="verified_cache"
+def create_client():
+    return chromadb.HttpClient(host=host, port=port)
+
+
+registry.register("chroma", create_client, health_check=lambda c: c.heartbeat(), retry_after=15)
+registry.register(
+    "verified_cache",
+    lambda: registry.get("chroma").get_or_create_collection(name="verified_cache"),
+    health_check=lambda c: c.count(),
+    retry_after=15,
 )
 
+# Клиент и коллекция создаются при первом обращении, а не при импорте
+client = registry.lazy("chroma")
+cache_collection = registry.lazy("verified_cache")
+
+# Счётчики обращений копятся в памяти и пишутся в метаданные пачкой
+_stats_lock = threading.Lock()
+stats = {"lookups": 0, "hits": 0, "errors": 0}
+_pending_hits: Dict[str, int] = {}
+
 
 def make_hash(text: str) -> str:
     return hashlib.sha256(text.encode()).hexdigest()
 
 
-def cache_get(query: str):
-    h = make_hash(query)
-    result = cache_collection.get(ids=[h])
+def fresh_where(ttl: float = VERIFIED_CACHE_TTL) -> Dict:
+    """Chroma filter that keeps only entries written within `ttl` seconds."""
+    return {"ts": {"$gte": time.time() - ttl}}
 
-    if not result["documents"]:
-        return None
 
+def to_fact(doc: str, meta: Dict) -> Dict:
     return {
-        "facts": result["documents"][0],
-        "source": result["metadatas"][0]["source"],
-        "date": result["metadatas"][0]["date"]
+        "facts": doc,
+        "source": meta["source"],
+        "date": meta["date"]
     }
 
 
-def cache_set(query: str, facts: str, source: str):
-    h = make_hash(query)
-    cache_collection.upsert(
-        ids=[h],
-        documents=[facts],
-        metadatas=[{
-            "source": source,
-            "date": datetime.utcnow().isoformat()
-        }]
-    )
+def record_lookups(lookups: int, hit_ids: Sequence[str] = (), hits: Optional[int] = None, error: bool = False):
+    with _stats_lock:
+        stats["lookups"] += lookups
+        stats["hits"] += len(hit_ids) if hits is None else hits
+        stats["errors"] += int(error)
+        for id_ in hit_ids:
+            _pending_hits[id_] = _pending_hits.get(id_, 0) + 1
+        flush = sum(_pending_hits.values()) >= HIT_FLUSH_EVERY
+    if flush:
+        flush_hits()
+
+
+def flush_hits():
+    """Add accumulated hit counts to the `hits`/`last_hit` metadata of entries."""
+    with _stats_lock:
+        pending = dict(_pending_hits)
+        _pending_hits.clear()
+    if not pending:
+        return
+    try:
+        current = cache_collection.get(ids=list(pending), include=["metadatas"])
+        now = time.time()
+        ids, metadatas = [], []
+        for id_, meta in zip(current["ids"], current["metadatas"]):
+            meta = dict(meta or {})
+            meta["hits"] = int(meta.get("hits", 0)) + pending[id_]
+            meta["last_hit"] = now
+            ids.append(id_)
+            metadatas.append(meta)
+        if ids:
+            cache_collection.update(ids=ids, metadatas=metadatas)
+    except Exception as exc:
+        logger.warning("verified_cache hit flush failed: %s", exc)
+
+
+def cache_get_many(queries: Sequence[str], ttl: float = VERIFIED_CACHE_TTL) -> List[Optional[Dict]]:
+    """Exact lookups for several queries in one round-trip, in input order.
+
+    Entries older than `ttl` are filtered out by Chroma itself.
+    """
+    if not queries:
+        return []
+    hashes = [make_hash(q) for q in queries]
+    try:
+        result = cache_collection.get(ids=list(dict.fromkeys(hashes)), where=fresh_where(ttl))
+    except Exception as exc:
+        logger.warning("verified_cache get failed: %s", exc)
+        record_lookups(len(queries), error=True)
+        return [None for _ in queries]
+
+    found = {
+        id_: to_fact(doc, meta)
+        for id_, doc, meta in zip(result["ids"], result["documents"] or [], result["metadatas"] or [])
+    }
+    record_lookups(len(queries), [h for h in hashes if h in found])
+    return [found.get(h) for h in hashes]
+
+
+def cache_set_many(items: Sequence[Tuple[str, str, str]]):
+    """Upsert several (query, facts, source) entries in one round-trip."""
+    if not items:
+        return
+    # Later duplicates win, as with consecutive cache_set calls
+    latest = {make_hash(query): (query, facts, source) for query, facts, source in items}
+    queries = [query for query, _, _ in latest.values()]
+    now = time.time()
+    try:
+        cache_collection.upsert(
+            ids=list(latest),
+            embeddings=embed_cached(queries).tolist(),
+            documents=[facts for _, facts, _ in latest.values()],
+            metadatas=[{
+                "query": query,
+                "source": source,
+                "date": datetime.now(timezone.utc).isoformat(),
+                "ts": now,
+                "hits": 0,
+                "last_hit": now,
+            } for query, _, source in latest.values()]
+        )
+    except Exception as exc:
+        logger.warning("verified_cache upsert failed: %s", exc)
+
+
+def cache_search_many(queries: Sequence[str], n_results=3, ttl: float = VERIFIED_CACHE_TTL,
+                      max_distance: float = VERIFIED_CACHE_MAX_DISTANCE) -> List[List[Dict]]:
+    """Nearest fresh cached facts for several queries with a single `collection.query`.
+
+    Only neighbours within `max_distance` are returned, and only they count
+    as hits for LFU eviction. Query embeddings are computed locally and
+    memoised, so repeated sub-queries are not re-embedded.
+    """
+    if not queries:
+        return []
+    try:
+        results = cache_collection.query(
+            query_embeddings=embed_cached(list(queries)).tolist(),
+            n_results=n_results,
+            where=fresh_where(ttl),
+            include=["documents", "metadatas", "distances"],
+        )
+    except Exception as exc:
+        logger.warning("verified_cache query failed: %s", exc)
+        record_lookups(len(queries), error=True)
+        return [[] for _ in queries]
 
+    if not results["documents"]:
+        record_lookups(len(queries))
+        return [[] for _ in queries]
 
-def cache_search(query: str, n_results=3):
-    results = cache_collection.query(
-        query_texts=[query],
-        n_results=n_results
-    )
+    close = [
+        [(id_, doc, meta) for id_, doc, meta, distance in zip(ids, docs, metas, distances) if distance <= max_distance]
+        for ids, docs, metas, distances in zip(results["ids"], results["documents"], results["metadatas"],
+                                               results["distances"])
+    ]
+    record_lookups(len(queries), [id_ for found in close for id_, _, _ in found],
+                   hits=sum(1 for found in close if found))
+    return [[to_fact(doc, meta) for _, doc, meta in found] for found in close]
 
-    if not results["documents"]:
-        return []
 
-    output = []
-    for doc, meta in zip(results["documents"][0], results["metadatas"][0]):
-        output.append({
-            "facts": doc,
-            "source": meta["source"],
-            "date": meta["date"]
-        })
+def cache_get(query: str):
+    return cache_get_many([query])[0]
 
-    return output
+
+def cache_set(query: str, facts: str, source: str):
+    cache_set_many([(query, facts, source)])
+
+
+def cache_search(query: str, n_results=3):
+    return cache_search_many([query], n_results=n_results)[0]
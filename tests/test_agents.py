@@ -0,0 +1,63 @@
+from langchain_core.messages import AIMessage
+
+from agents import MAX_RETRIEVAL_ROUNDS, apply_verification, parse_missing
+
+SUB_QUERIES = ["Population of Paris 2020", "Population of Paris", "GDP of France"]
+
+
+def make_state(retrieval_round=1, empty=("GDP of France",)):
+    return {
+        "sub_queries": SUB_QUERIES,
+        "data": {sq: [] if sq in empty else [f"data for {sq}"] for sq in SUB_QUERIES},
+        "verified_facts": {},
+        "retrieval_round": retrieval_round,
+    }
+
+
+def verify(text, state):
+    return apply_verification(state, AIMessage(content=text), text, "unknown")
+
+
+def test_missing_lines_match_whole_headings_only():
+    assert parse_missing("needs_more\nMISSING:\n## Population of Paris\n", make_state()) == [
+        "Population of Paris", "GDP of France"]
+    assert parse_missing("needs_more\nMISSING:\n1. population of paris 2020.", make_state(empty=())) == [
+        "Population of Paris 2020"]
+
+
+def test_explicitly_empty_missing_list_keeps_only_empty_sub_queries():
+    assert parse_missing("needs_more\nMISSING: none", make_state()) == ["GDP of France"]
+    assert parse_missing("needs_more\nMISSING:\n", make_state(empty=())) == []
+
+
+def test_without_a_usable_list_every_sub_query_is_retried():
+    assert parse_missing("needs_more", make_state(empty=())) == SUB_QUERIES
+    assert parse_missing("needs_more\nMISSING:\n- something else", make_state(empty=())) == SUB_QUERIES
+
+
+def test_needs_more_schedules_the_missing_sub_queries():
+    update, verified = verify("needs_more\nMISSING:\nPopulation of Paris", make_state())
+    assert not verified
+    assert update["missing_sub_queries"] == ["Population of Paris", "GDP of France"]
+    assert "verified_facts" not in update
+
+
+def test_needs_more_without_anything_to_retry_is_incomplete_and_not_verified():
+    update, verified = verify("needs_more\nMISSING: none", make_state(empty=()))
+    assert not verified
+    assert update["missing_sub_queries"] == []
+    assert update["verified_facts"]["complete"] is False
+
+
+def test_needs_more_after_the_last_round_is_incomplete():
+    update, verified = verify("needs_more", make_state(retrieval_round=MAX_RETRIEVAL_ROUNDS))
+    assert not verified
+    assert update["verified_facts"]["complete"] is False
+    assert "Retrieval budget exhausted" in update["messages"][-1].content
+
+
+def test_confirmed_facts_are_verified():
+    update, verified = verify("All facts confirmed.", make_state())
+    assert verified
+    assert update["verified_facts"] == {"facts": "All facts confirmed.", "source": "unknown"}
+    assert update["missing_sub_queries"] == []
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+import answer_cache
+from answer_cache import AnswerCache, is_complete, normalize_query, query_key, same_numbers
+from test_planner import embed_without_numbers
+
+
+class Collection:
+    """In-memory stand-in for the Chroma collection: cosine distance and the `ts` freshness filter."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for key, vector, doc, meta in zip(ids, embeddings, documents, metadatas):
+            self.entries[key] = (np.asarray(vector), doc, meta)
+
+    def _fresh(self, where):
+        return {k: e for k, e in self.entries.items() if e[2]["ts"] >= where["ts"]["$gte"]}
+
+    def get(self, ids, where, include):
+        found = [(k, e) for k, e in self._fresh(where).items() if k in ids]
+        return {"ids": [k for k, _ in found], "documents": [e[1] for _, e in found],
+                "metadatas": [e[2] for _, e in found]}
+
+    def query(self, query_embeddings, n_results, where, include):
+        vector = np.asarray(query_embeddings[0])
+        ranked = sorted((1 - float(e[0] @ vector), k, e) for k, e in self._fresh(where).items())[:n_results]
+        return {"ids": [[k for _, k, _ in ranked]], "documents": [[e[1] for _, _, e in ranked]],
+                "metadatas": [[e[2] for _, _, e in ranked]], "distances": [[d for d, _, _ in ranked]]}
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = Collection()
+    monkeypatch.setattr(answer_cache, "answer_collection", collection)
+    monkeypatch.setattr(answer_cache, "embed_cached", embed_without_numbers)
+    return collection
+
+
+def test_normalisation_folds_case_whitespace_and_punctuation():
+    assert normalize_query("  What is  the GDP of France?! ") == "what is the gdp of france"
+    assert query_key("GDP of France?") == query_key("gdp of   france")
+
+
+def test_same_numbers_compares_every_number_in_order():
+    assert same_numbers("ВВП в 2020 году", "ВВП РФ за 2020")
+    assert not same_numbers("ВВП в 2020", "ВВП в 2021")
+    assert not same_numbers("ВВП в 2020", "ВВП")
+    assert not same_numbers("с 2010 по 2020", "с 2020 по 2010")
+
+
+def test_only_complete_answers_are_worth_caching():
+    assert is_complete({"final_answer": "a"})
+    assert not is_complete({"final_answer": ""})
+    assert not is_complete({"final_answer": "a", "verified_facts": {"complete": False}})
+
+
+def test_exact_hit_from_memory_and_from_the_collection(collection):
+    cache = AnswerCache(ttl=60, max_distance=0)
+    assert cache.lookup("GDP of France") is None
+    cache.store("GDP of France", "answer")
+    assert cache.lookup("gdp of france?")["kind"] == "exact"
+
+    # A fresh process has an empty LRU but finds the entry in Chroma
+    hit = AnswerCache(ttl=60, max_distance=0).lookup("GDP of France")
+    assert (hit["answer"], hit["kind"], hit["query"]) == ("answer", "exact", "GDP of France")
+
+
+def test_entries_past_the_ttl_are_ignored(collection):
+    AnswerCache(ttl=60).store("GDP of France", "answer")
+    key = query_key("GDP of France")
+    collection.entries[key][2]["ts"] -= 120
+    assert AnswerCache(ttl=60).lookup("GDP of France") is None
+
+
+def test_near_duplicates_need_the_same_numbers(collection):
+    AnswerCache(ttl=60).store("population of Moscow in 2020", "12.6 million")
+    cache = AnswerCache(ttl=60, max_distance=0.2)
+    assert cache.lookup("population of Moscow in 2021") is None
+    hit = cache.lookup("the population of Moscow in 2020")
+    assert hit["kind"] == "semantic"
+    assert hit["answer"] == "12.6 million"
+
+
+def test_semantic_lookup_is_off_by_default_and_errors_are_misses(collection, monkeypatch):
+    AnswerCache(ttl=60).store("population of Moscow in 2020", "12.6 million")
+    assert AnswerCache(ttl=60, max_distance=0).lookup("the population of Moscow in 2020") is None
+
+    def broken(**kwargs):
+        raise RuntimeError("chroma down")
+
+    monkeypatch.setattr(collection, "get", broken)
+    assert AnswerCache(ttl=60).lookup("anything") is None
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+import batch
+from batch import completed_ids, open_output, read_queries
+
+
+def write_lines(path, lines):
+    path.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+
+
+def test_read_queries_accepts_objects_and_strings(tmp_path):
+    path = tmp_path / "queries.jsonl"
+    write_lines(path, ['{"query": "a", "id": "x"}', '"b"', "", '{"id": 7}', '{"query": "c"}'])
+    assert list(read_queries(str(path))) == [{"query": "a", "id": "x"}, {"query": "b", "id": 2},
+                                            {"query": "c", "id": 5}]
+
+
+def test_completed_ids_skip_errors_and_a_line_cut_by_a_crash(tmp_path):
+    path = tmp_path / "results.jsonl"
+    assert completed_ids(str(path)) == set()
+    path.write_text('{"id": 1, "answer": "a"}\n{"id": "2", "error": "boom"}\n{"id": 3, "ans', encoding="utf-8")
+    assert completed_ids(str(path)) == {"1"}
+
+
+def test_open_output_terminates_a_partial_last_line(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text('{"id": 1}\n{"id": 2, "ans', encoding="utf-8")
+    with open_output(str(path)) as out:
+        out.write('{"id": 2}\n')
+    assert path.read_text(encoding="utf-8").splitlines() == ['{"id": 1}', '{"id": 2, "ans', '{"id": 2}']
+    assert completed_ids(str(path)) == {"1", "2"}
+
+    with open_output(str(path)) as out:
+        out.write('{"id": 3}\n')
+    assert path.read_text(encoding="utf-8").endswith('{"id": 2}\n{"id": 3}\n')
+
+
+def test_rerun_resumes_only_failed_queries_with_new_thread_ids(tmp_path, monkeypatch):
+    queries, output = tmp_path / "queries.jsonl", tmp_path / "results.jsonl"
+    write_lines(queries, ['"ok"', '"flaky"', '"ok too"'])
+    seen = []
+
+    def run_query(item):
+        seen.append(item)
+        if item["query"] == "flaky" and [i["query"] for i in seen].count("flaky") == 1:
+            return {"id": item["id"], "query": item["query"], "seconds": 0.0, "error": "boom"}
+        return {"id": item["id"], "query": item["query"], "seconds": 0.0, "answer": "a"}
+
+    monkeypatch.setattr(batch, "run_query", run_query)
+    args = [str(queries), str(output), "--mode", "thread", "--progress", "0"]
+    with pytest.raises(SystemExit) as first:
+        batch.main(args)
+    assert first.value.code == 1
+    with pytest.raises(SystemExit) as second:
+        batch.main(args)
+    assert second.value.code == 0
+
+    assert len(seen) == 4
+    assert seen[3]["query"] == "flaky"
+    first_try = next(item for item in seen[:3] if item["query"] == "flaky")
+    assert first_try["thread_id"] != seen[3]["thread_id"]
+    assert seen[3]["thread_id"].endswith("-2")
+    assert completed_ids(str(output)) == {"1", "2", "3"}
+    assert len([json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]) == 4
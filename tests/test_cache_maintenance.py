@@ -0,0 +1,64 @@
+import numpy as np
+
+import cache_maintenance
+from cache_maintenance import find_duplicates
+
+
+def meta(query=None, hits=0, ts=0.0):
+    entry = {"source": "s", "date": "d", "ts": ts, "hits": hits}
+    if query is not None:
+        entry["query"] = query
+    return entry
+
+
+def test_queries_with_different_numbers_are_never_duplicates():
+    vector = [1.0, 0.0, 0.0]
+    ids = ["2020", "2021", "paraphrase"]
+    metadatas = [meta("ВВП России в 2020", hits=3), meta("ВВП России в 2021"), meta("ВВП РФ в 2020", ts=1.0)]
+    assert find_duplicates(ids, metadatas, [vector] * 3, threshold=0.99) == ["paraphrase"]
+
+
+def test_most_used_then_newest_entry_survives():
+    ids = ["old", "new", "popular"]
+    metadatas = [meta("q", ts=1.0), meta("q", ts=2.0), meta("q", hits=5, ts=0.0)]
+    assert sorted(find_duplicates(ids, metadatas, [[1.0, 0.0]] * 3, threshold=0.99)) == ["new", "old"]
+
+
+def test_entries_without_a_stored_query_are_kept():
+    metadatas = [meta(), meta(), meta("q")]
+    assert find_duplicates(["a", "b", "c"], metadatas, [[1.0, 0.0]] * 3, threshold=0.99) == []
+
+
+def test_blocks_give_the_same_result_as_one_pass(monkeypatch):
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(40, 16))
+    embeddings = np.concatenate([base, base[rng.integers(0, 40, 120)] + rng.normal(scale=0.01, size=(120, 16))])
+    ids = [str(i) for i in range(len(embeddings))]
+    metadatas = [meta("q", hits=int(h), ts=float(i)) for i, h in enumerate(rng.integers(0, 4, len(ids)))]
+    whole = find_duplicates(ids, metadatas, list(embeddings), threshold=0.99)
+    monkeypatch.setattr(cache_maintenance, "DEDUPE_BLOCK", 7)
+    assert find_duplicates(ids, metadatas, list(embeddings), threshold=0.99) == whole
+    assert len(whole) == 120
+
+
+def test_cache_metrics_reads_the_size_recorded_in_the_background(monkeypatch):
+    class Collection:
+        calls = 0
+
+        def count(self):
+            Collection.calls += 1
+            return 42
+
+    monkeypatch.setattr(cache_maintenance, "cache_collection", Collection())
+    monkeypatch.setattr(cache_maintenance, "last_size", {"size": None})
+    assert cache_maintenance.cache_metrics()["size"] is None
+    assert cache_maintenance.refresh_size() == 42
+    assert [cache_maintenance.cache_metrics()["size"] for _ in range(3)] == [42, 42, 42]
+    assert Collection.calls == 1
+
+
+def test_entry_ts_reads_naive_legacy_dates_as_utc():
+    assert cache_maintenance.entry_ts({"ts": 5}) == 5.0
+    assert cache_maintenance.entry_ts({"date": "1970-01-01T01:00:00"}) == 3600.0
+    assert cache_maintenance.entry_ts({"date": "1970-01-01T01:00:00+00:00"}) == 3600.0
+    assert cache_maintenance.entry_ts({}) == 0.0
@@ -0,0 +1,104 @@
+import operator
+from typing import Annotated, List, TypedDict
+
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.graph import END, START, StateGraph
+
+from checkpoints import PRUNE_SLACK, SqliteCheckpointer
+
+
+@pytest.fixture
+def saver(tmp_path):
+    return SqliteCheckpointer(path=str(tmp_path / "checkpoints.sqlite3"), max_history=3, thread_ttl=60,
+                              gc_interval=float("inf"))
+
+
+def put(saver, thread_id, values, parent=None, changed=None):
+    """Write a checkpoint holding `values`; only `changed` channels (all by default) get new versions."""
+    parent_versions = parent.checkpoint["channel_versions"] if parent else {}
+    changed = list(values) if changed is None else changed
+    new_versions = {channel: saver.get_next_version(parent_versions.get(channel), None) for channel in changed}
+    checkpoint = {**empty_checkpoint(), "channel_values": dict(values),
+                  "channel_versions": {**parent_versions, **new_versions}}
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    if parent:
+        config["configurable"]["checkpoint_id"] = parent.config["configurable"]["checkpoint_id"]
+    saver.put(config, checkpoint, {"source": "loop", "step": len(parent_versions)}, new_versions)
+    return saver.get_tuple({"configurable": {"thread_id": thread_id}})
+
+
+def count(saver, table, thread_id):
+    return saver._conn.execute(f"SELECT COUNT(*) FROM {table} WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+
+
+def test_put_get_tuple_list_round_trip(saver):
+    first = put(saver, "t1", {"question": "q", "answer": ""})
+    assert first.checkpoint["channel_values"] == {"question": "q", "answer": ""}
+    assert first.metadata["step"] == 0
+    assert first.parent_config is None
+
+    # Unchanged channels are read from the parent's blobs
+    second = put(saver, "t1", {"question": "q", "answer": "a"}, parent=first, changed=["answer"])
+    assert second.checkpoint["channel_values"] == {"question": "q", "answer": "a"}
+    assert second.parent_config == first.config
+    assert count(saver, "blobs", "t1") == 3
+
+    listed = list(saver.list({"configurable": {"thread_id": "t1"}}))
+    assert [item.config for item in listed] == [second.config, first.config]
+    assert list(saver.list(None, limit=1))[0].config == second.config
+    assert [item.config for item in saver.list({"configurable": {"thread_id": "t1"}}, before=second.config)] \
+        == [first.config]
+    assert saver.get_tuple(first.config).checkpoint["channel_values"]["answer"] == ""
+    assert saver.get_tuple({"configurable": {"thread_id": "other"}}) is None
+
+
+def test_put_writes_are_returned_as_pending(saver):
+    first = put(saver, "t1", {"question": "q"})
+    saver.put_writes(first.config, [("answer", "draft"), ("notes", ["n"])], task_id="task-1")
+    saver.put_writes(first.config, [("answer", "ignored")], task_id="task-1")
+    assert saver.get_tuple(first.config).pending_writes == [("task-1", "answer", "draft"),
+                                                            ("task-1", "notes", ["n"])]
+
+
+def test_prune_keeps_max_history_and_drops_orphaned_blobs(saver):
+    latest = put(saver, "t1", {"question": "q", "step": 0})
+    for step in range(1, saver.max_history + PRUNE_SLACK + 1):
+        latest = put(saver, "t1", {"question": "q", "step": step}, parent=latest, changed=["step"])
+
+    assert count(saver, "checkpoints", "t1") == saver.max_history
+    # The last max_history versions of "step" plus the one version of "question" they all share
+    assert count(saver, "blobs", "t1") == saver.max_history + 1
+    assert latest.checkpoint["channel_values"] == {"question": "q", "step": saver.max_history + PRUNE_SLACK}
+    for item in saver.list({"configurable": {"thread_id": "t1"}}):
+        assert set(item.checkpoint["channel_values"]) == {"question", "step"}
+
+
+def test_gc_removes_threads_past_ttl(saver):
+    put(saver, "old", {"question": "q"})
+    put(saver, "fresh", {"question": "q"})
+    saver._conn.execute("UPDATE checkpoints SET created_at = created_at - ? WHERE thread_id = 'old'",
+                        (saver.thread_ttl + 1,))
+
+    assert saver.gc() == 1
+    assert saver.get_tuple({"configurable": {"thread_id": "old"}}) is None
+    assert count(saver, "blobs", "old") == 0
+    assert saver.get_tuple({"configurable": {"thread_id": "fresh"}}) is not None
+    assert saver.gc() == 0
+
+
+def test_graph_state_survives_a_new_checkpointer(tmp_path):
+    class State(TypedDict):
+        messages: Annotated[List[str], operator.add]
+
+    workflow = StateGraph(State)
+    workflow.add_node("echo", lambda state: {"messages": [f"echo {len(state['messages'])}"]})
+    workflow.add_edge(START, "echo")
+    workflow.add_edge("echo", END)
+    path = str(tmp_path / "checkpoints.sqlite3")
+    config = {"configurable": {"thread_id": "session"}}
+
+    workflow.compile(checkpointer=SqliteCheckpointer(path=path)).invoke({"messages": ["hi"]}, config)
+    graph = workflow.compile(checkpointer=SqliteCheckpointer(path=path))
+    assert graph.invoke({"messages": ["again"]}, config)["messages"] == ["hi", "echo 1", "again", "echo 3"]
+    assert len(list(graph.get_state_history(config))) > 2
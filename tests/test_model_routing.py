@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import model_routing
+from model_routing import BREAKER_FAILURES, BackendStats, ModelRouter, RoutedRunnable
+from throttle import call_deadline
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(model_routing.time, "monotonic", clock)
+    monkeypatch.setattr(model_routing, "BREAKER_COOLDOWN", 30.0)
+    return clock
+
+
+def trip(stats):
+    opened = [stats.failure() for _ in range(BREAKER_FAILURES)]
+    assert opened == [False] * (BREAKER_FAILURES - 1) + [True]
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    stats = BackendStats()
+    stats.failure()
+    stats.success(1.0)
+    assert stats.consecutive_failures == 0
+    trip(stats)
+    assert not stats.available()
+    clock.now += 29
+    assert not stats.available()
+
+
+def test_after_the_cooldown_only_one_trial_is_let_through(clock):
+    stats = BackendStats()
+    trip(stats)
+    clock.now += 30
+    assert stats.available()
+    stats.dispatch()
+    assert stats.half_open
+    assert not stats.available()
+
+
+def test_failed_trial_reopens_and_successful_trial_closes(clock):
+    stats = BackendStats()
+    trip(stats)
+    clock.now += 30
+    stats.dispatch()
+    assert stats.failure()
+    assert not stats.available()
+
+    clock.now += 30
+    stats.dispatch()
+    stats.success(2.0)
+    assert stats.opened_at is None and not stats.half_open
+    assert stats.available()
+
+
+def test_abandoned_trial_lets_the_next_call_try(clock):
+    stats = BackendStats()
+    trip(stats)
+    clock.now += 30
+    stats.dispatch()
+    stats.abandon()
+    assert stats.available()
+
+
+def test_client_errors_do_not_count_against_the_provider(clock):
+    router = ModelRouter(policies={})
+    for _ in range(BREAKER_FAILURES):
+        router.record("node", "llm", 0.1, error=HTTPError(400))
+    assert router.stats("llm").available()
+    for _ in range(BREAKER_FAILURES):
+        router.record("node", "llm", 0.1, error=HTTPError(503))
+    assert not router.stats("llm").available()
+
+
+def test_open_backends_go_last_and_slow_primary_is_demoted(clock):
+    router = ModelRouter(policies={})
+    router.stats("a").success(10.0)
+    router.stats("b").success(1.0)
+    assert router.order("node", ["a", "b"], {}) == ["b", "a"]
+    trip(router.stats("b"))
+    assert router.order("node", ["a", "b"], {}) == ["a", "b"]
+
+
+def test_routed_call_fails_over_on_retryable_errors_only(clock):
+    class Chain:
+        def __init__(self, error=None):
+            self.error = error
+
+        def invoke(self, inputs, config=None):
+            if self.error:
+                raise self.error
+            return "answer"
+
+    router = ModelRouter(policies={})
+    runnable = RoutedRunnable("node", {"a": lambda: Chain(HTTPError(503)), "b": Chain}, router=router)
+    assert runnable.invoke({}) == "answer"
+    assert router.stats("a").failures == 1
+
+    runnable = RoutedRunnable("node", {"a": lambda: Chain(HTTPError(400)), "b": Chain}, router=router)
+    with pytest.raises(HTTPError):
+        runnable.invoke({})
+
+
+class Slow:
+    def __init__(self, gate):
+        self.gate = gate
+
+    def invoke(self, inputs, config=None):
+        self.gate.wait()
+        return "late"
+
+    async def ainvoke(self, inputs, config=None):
+        await asyncio.sleep(5)
+        return "late"
+
+
+def test_deadline_bounds_the_whole_routed_call(monkeypatch):
+    monkeypatch.setattr(model_routing, "MODEL_CALL_DEADLINE", 0.2)
+    gate = threading.Event()
+    runnable = RoutedRunnable("node", {"a": lambda: Slow(gate)}, router=ModelRouter(policies={}))
+    try:
+        with pytest.raises(TimeoutError, match="no answer within 0.2s"):
+            runnable.invoke({})
+    finally:
+        gate.set()
+    with pytest.raises(TimeoutError, match="no answer within 0.2s"):
+        asyncio.run(runnable.ainvoke({}))
+    # The cancelled attempt says nothing about the provider
+    assert runnable.router.stats("a").failures == 0
+
+
+def test_no_failover_past_the_deadline():
+    class Chain:
+        def invoke(self, inputs, config=None):
+            raise HTTPError(503)
+
+    runnable = RoutedRunnable("node", {"a": Chain, "b": lambda: pytest.fail("failover after the deadline")},
+                              router=ModelRouter(policies={}))
+    token = call_deadline.set(time.monotonic() - 1)
+    try:
+        with pytest.raises(HTTPError):
+            runnable._invoke({}, None, {})
+    finally:
+        call_deadline.reset(token)
@@ -0,0 +1,47 @@
+from page_index import InvertedIndex, snippet
+
+
+def make_index():
+    index = InvertedIndex()
+    index.add("gdp", "GDP growth in France was 2 percent. GDP per capita rose.")
+    index.add("population", "Population of France grew slowly; growth of cities continued.")
+    index.add("weather", "Rain in Paris. " * 20)
+    return index
+
+
+def test_rarer_and_more_frequent_terms_rank_higher():
+    results = make_index().search("gdp growth")
+    assert [r["url"] for r in results] == ["gdp", "population"]
+    assert results[0]["score"] > results[1]["score"] > 0
+
+
+def test_search_can_be_restricted_to_some_pages_and_capped():
+    index = make_index()
+    assert [r["url"] for r in index.search("france growth", urls=["population", "weather"])] == ["population"]
+    assert len(index.search("france", k=1)) == 1
+    assert index.search("unknown words") == []
+    assert InvertedIndex().search("france") == []
+
+
+def test_reindexing_a_page_replaces_its_postings():
+    index = make_index()
+    index.add("gdp", "Inflation report.")
+    assert [r["url"] for r in index.search("gdp")] == []
+    assert [r["url"] for r in index.search("inflation")] == ["gdp"]
+    assert index._total_length == sum(doc["length"] for doc in index.docs.values())
+    assert all(postings for postings in index.postings.values())
+
+
+def test_freshness_follows_the_ttl():
+    index = make_index()
+    assert index.fresh("gdp", ttl=60)
+    assert not index.fresh("gdp", ttl=0)
+    assert not index.fresh("missing", ttl=60)
+
+
+def test_snippet_is_centred_on_the_first_query_term():
+    text = "x" * 1000 + " target word " + "y" * 1000
+    window = snippet(text, "target", width=100)
+    assert "target" in window
+    assert len(window) <= 100
+    assert snippet("no match here", "absent", width=5) == "no ma"
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from parallel import run_parallel, run_parallel_async
+
+
+@pytest.fixture
+def gate():
+    """Blocked tasks wait on this; it is opened at the end so no worker outlives the test."""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_results_keep_input_order_and_capture_errors():
+    def func(item):
+        time.sleep(0.05 * (3 - item))
+        if item == 1:
+            raise ValueError("bad")
+        return item * 10
+
+    results = run_parallel(func, [0, 1, 2], max_workers=3)
+    assert [r.value for r in results] == [0, None, 20]
+    assert isinstance(results[1].error, ValueError)
+    assert [r.ok for r in results] == [True, False, True]
+
+
+def test_timeout_counts_from_the_start_of_each_item(gate):
+    def func(item):
+        if item == "stuck":
+            gate.wait()
+        time.sleep(0.1)
+        return item
+
+    # With one worker busy on "stuck", the queued items start late but each gets its full timeout
+    results = run_parallel(func, ["stuck", "a", "b"], max_workers=2, timeout=0.5)
+    assert [r.timed_out for r in results] == [True, False, False]
+    assert [r.value for r in results[1:]] == ["a", "b"]
+
+
+def test_budget_returns_what_finished_in_time(gate):
+    def func(item):
+        if item == "stuck":
+            gate.wait()
+        return item
+
+    started = time.monotonic()
+    results = run_parallel(func, ["a", "stuck", "b"], max_workers=3, budget=0.2)
+    assert time.monotonic() - started < 1.0
+    assert [(r.value, r.timed_out) for r in results] == [("a", False), (None, True), ("b", False)]
+
+
+def test_inline_run_stops_at_the_budget():
+    def func(item):
+        time.sleep(0.15)
+        return item
+
+    results = run_parallel(func, [1, 2, 3], max_workers=1, budget=0.2)
+    assert [r.timed_out for r in results] == [False, False, True]
+
+
+def test_async_timeout_and_budget():
+    async def func(item):
+        await asyncio.sleep(item)
+        return item
+
+    results = asyncio.run(run_parallel_async(func, [0.0, 5.0], max_concurrency=2, timeout=0.1))
+    assert [(r.value, r.timed_out) for r in results] == [(0.0, False), (None, True)]
+
+    results = asyncio.run(run_parallel_async(func, [0.0, 5.0], max_concurrency=2, budget=0.1))
+    assert [(r.value, r.timed_out) for r in results] == [(0.0, False), (None, True)]
+
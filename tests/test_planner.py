@@ -0,0 +1,68 @@
+import json
+import re
+
+import numpy as np
+import pytest
+
+import planner
+from benchmark import HashEmbeddingFunction
+from planner import SubQuery, collapse_duplicates, parse_sub_queries, plan_sub_queries
+
+_DIGITS = re.compile(r"\d+")
+
+
+def embed_without_numbers(texts):
+    """Stand-in for a sentence embedding: numbers barely move the vector, so year pairs look identical."""
+    vectors = np.asarray(HashEmbeddingFunction()([_DIGITS.sub("", t) for t in texts]), dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+@pytest.fixture(autouse=True)
+def stand_ins(monkeypatch):
+    monkeypatch.setattr(planner, "embed_cached", embed_without_numbers)
+    monkeypatch.setattr(planner, "cache_get_many", lambda queries: [None] * len(queries))
+
+
+def test_parse_json_plan_and_fallback_lines():
+    content = '```json\n[{"query": "a b", "priority": 2}, "c d", {"query": " "}, {"query": "e", "priority": "x"}]\n```'
+    assert parse_sub_queries(content) == [SubQuery("a b", 2), SubQuery("c d"), SubQuery("e")]
+    assert parse_sub_queries("Sub-queries:\n1. first one\n- second one\n## third one") == [
+        SubQuery("first one"), SubQuery("second one"), SubQuery("third one")]
+
+
+def test_year_pair_is_not_collapsed():
+    plan = [SubQuery("население Москвы в 2010"), SubQuery("население Москвы в 2020")]
+    kept, dropped = collapse_duplicates(plan, threshold=0.95)
+    assert kept == plan
+    assert dropped == []
+
+
+def test_paraphrase_with_same_numbers_is_collapsed():
+    plan = [SubQuery("население Москвы в 2010", 1), SubQuery("Население  москвы в 2010 году", 2)]
+    # The extra word keeps the two just below identical, like a real paraphrase
+    kept, dropped = collapse_duplicates(plan, threshold=0.8)
+    assert kept == plan[:1]
+    assert dropped == ["Население  москвы в 2010 году"]
+
+
+def test_plan_orders_by_priority_dedupes_and_caps():
+    content = json.dumps([
+        {"query": "ВВП Японии в 2008", "priority": 2},
+        {"query": "ВВП Германии в 2008", "priority": 1},
+        {"query": "вВп японии   в 2008", "priority": 3},
+        {"query": "ВВП Японии в 2020", "priority": 2},
+        {"query": "безработица в Германии", "priority": 5},
+    ], ensure_ascii=False)
+    plan = plan_sub_queries(content, max_sub_queries=3)
+    assert plan.sub_queries == ["ВВП Германии в 2008", "ВВП Японии в 2008", "ВВП Японии в 2020"]
+    assert plan.duplicates == ["вВп японии   в 2008"]
+    assert plan.over_cap == ["безработица в Германии"]
+
+
+def test_plan_keeps_cached_sub_queries_outside_the_cap(monkeypatch):
+    fact = {"facts": "f", "source": "s", "date": "d"}
+    monkeypatch.setattr(planner, "cache_get_many", lambda queries: [fact if q == "b" else None for q in queries])
+    plan = plan_sub_queries('["a", "b", "c"]', max_sub_queries=1)
+    assert plan.answered == {"b": fact}
+    assert plan.sub_queries == ["b", "a"]
+    assert plan.over_cap == ["c"]
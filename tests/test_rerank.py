@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import rerank
+from rerank import PINNED_PREFIX, rerank_evidence, split_evidence
+
+TOPICS = ["apple", "banana", "cherry"]
+
+
+def embed_topics(texts):
+    """Stand-in for a sentence embedding: one axis per topic word and one for every other word."""
+    words = [t.lower().split() for t in texts]
+    vectors = np.array([[w.count(topic) for topic in TOPICS] + [sum(x not in TOPICS for x in w) + 0.1] for w in words],
+                       dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture(autouse=True)
+def stand_ins(monkeypatch):
+    monkeypatch.setattr(rerank, "embed_cached", embed_topics)
+    # One token per word keeps the budget arithmetic readable
+    monkeypatch.setattr(rerank, "count_tokens", lambda text: len(text.split()))
+
+
+def test_split_keeps_cached_facts_apart_and_drops_duplicate_chunks():
+    pinned, chunks = split_evidence([f"{PINNED_PREFIX} apple facts", "Apple pie", "apple   PIE", "banana bread"])
+    assert pinned == [f"{PINNED_PREFIX} apple facts"]
+    assert chunks == ["Apple pie", "banana bread"]
+
+
+def test_chunks_are_ranked_by_similarity_and_capped_at_top_k():
+    data = {"apple": ["cherry jam", "apple apple", "apple banana", "banana split"]}
+    reranked, stats = rerank_evidence(data, top_k=2, budget_tokens=100)
+    assert reranked["apple"] == ["apple apple", "apple banana"]
+    assert stats == {"chunks": 4, "kept": 2, "tokens": 4}
+
+
+def test_budget_skips_chunks_that_do_not_fit_but_keeps_smaller_ones():
+    data = {"apple": ["apple apple apple apple apple", "apple apple apple apple pie pie", "apple cake"]}
+    reranked, _ = rerank_evidence(data, top_k=5, budget_tokens=7)
+    assert reranked["apple"] == ["apple apple apple apple apple", "apple cake"]
+
+
+def test_best_chunk_is_kept_even_over_budget_and_pinned_facts_come_first():
+    fact = f"{PINNED_PREFIX} apple"
+    data = {"apple": ["apple apple apple apple", fact], "banana": [], "cherry": ["cherry"]}
+    reranked, stats = rerank_evidence(data, top_k=5, budget_tokens=2)
+    assert reranked["apple"] == [fact, "apple apple apple apple"]
+    assert reranked["banana"] == []
+    assert reranked["cherry"] == ["cherry"]
+    assert stats["kept"] == 2
+
+
+def test_rerank_safely_falls_back_to_unranked_data(monkeypatch):
+    def broken(texts):
+        raise RuntimeError("model not loaded")
+
+    monkeypatch.setattr(rerank, "embed_cached", broken)
+    data = {"apple": ["banana", "apple"]}
+    assert rerank.rerank_safely(data) == (data, {})
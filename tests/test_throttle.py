@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+import throttle
+from throttle import AIMD_DECREASE, Limiter
+
+
+class HTTPError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+        self.response = type("Response", (), {"headers": headers or {}})()
+
+
+class Flaky:
+    """Fails with the given errors one by one, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+    async def acall(self):
+        return self()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(throttle.time, "sleep", delays.append)
+    return delays
+
+
+def limiter(**kwargs):
+    settings = {"rate": 1000, "burst": 1000, "concurrency": 4, "max_concurrency": 8, "retries": 2}
+    return Limiter("test", **{**settings, **kwargs})
+
+
+def test_successes_grow_the_limit_additively_up_to_the_ceiling():
+    lim = limiter()
+    for _ in range(4):
+        lim.acquire("s")
+        lim.release(0.1)
+    assert lim.limit == pytest.approx(5.0, abs=0.1)
+    for _ in range(200):
+        lim.acquire("s")
+        lim.release(0.1)
+    assert lim.limit == lim.max_concurrency
+
+
+def test_a_burst_of_429s_halves_the_limit_once_and_empties_the_bucket():
+    lim = limiter(concurrency=8)
+    for _ in range(3):
+        lim.acquire("s")
+        lim.release(0.1, throttled=True, error=True)
+    assert lim.limit == 8 * AIMD_DECREASE
+    assert lim.tokens <= 0.0
+
+
+def test_slow_calls_count_as_congestion_but_plain_errors_do_not():
+    lim = limiter(latency_target=1.0)
+    lim.acquire("s")
+    lim.release(0.5, error=True)
+    assert lim.limit == 4
+    lim.acquire("s")
+    lim.release(2.0)
+    assert lim.limit == 4 * AIMD_DECREASE
+
+
+def test_free_slots_go_round_robin_between_sessions():
+    lim = limiter(concurrency=1, max_concurrency=1)
+    lim.acquire("busy")
+    granted = []
+    waiters = {}
+    for session, name in [("heavy", "h1"), ("heavy", "h2"), ("heavy", "h3"), ("light", "l1")]:
+        waiters[name] = throttle._Waiter(event=throttle.threading.Event())
+        lim._enqueue(waiters[name], session)
+    for _ in range(4):
+        lim.release(0.1)
+        granted.append(next(name for name, w in waiters.items() if w.granted and name not in granted))
+    assert granted == ["h1", "l1", "h2", "h3"]
+
+
+def test_retryable_errors_are_retried_with_capped_jittered_backoff(sleeps):
+    func = Flaky(HTTPError(503), HTTPError(429))
+    lim = limiter()
+    assert lim.call(func) == "ok"
+    assert func.calls == 3
+    assert len(sleeps) == 2
+    assert all(0 <= delay <= min(throttle.BACKOFF_CAP, throttle.BACKOFF_BASE * 2 ** i)
+               for i, delay in enumerate(sleeps))
+    assert lim.stats["retries"] == 2
+    assert lim.stats["throttled"] == 1
+
+
+def test_retry_after_overrides_the_backoff(sleeps):
+    assert limiter().call(Flaky(HTTPError(429, {"retry-after": "7"}))) == "ok"
+    assert sleeps == [7.0]
+
+
+def test_client_errors_and_exhausted_retries_are_raised(sleeps):
+    func = Flaky(HTTPError(400))
+    with pytest.raises(HTTPError):
+        limiter().call(func)
+    assert func.calls == 1
+
+    func = Flaky(*[HTTPError(500)] * 3)
+    lim = limiter()
+    with pytest.raises(HTTPError):
+        lim.call(func)
+    assert func.calls == 3
+    assert lim.in_flight == 0
+
+
+def test_acall_retries_like_call(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(throttle.asyncio, "sleep", sleep)
+    func = Flaky(TimeoutError("slow"))
+    assert asyncio.run(limiter().acall(func.acall)) == "ok"
+    assert func.calls == 2
+    assert len(delays) == 1
+
+
+def test_no_retry_is_started_past_the_call_deadline(sleeps):
+    func = Flaky(HTTPError(429, {"retry-after": "30"}))
+    token = throttle.call_deadline.set(throttle.time.monotonic() + 10)
+    try:
+        with pytest.raises(HTTPError):
+            limiter().call(func)
+    finally:
+        throttle.call_deadline.reset(token)
+    assert func.calls == 1
+    assert sleeps == []
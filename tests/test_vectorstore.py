@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+import vectorstore
+from vectorstore import cache_search_many
+
+
+class Collection:
+    def __init__(self, results):
+        self.results = results
+
+    def query(self, query_embeddings, n_results, where, include):
+        return self.results
+
+
+@pytest.fixture(autouse=True)
+def stand_ins(monkeypatch):
+    monkeypatch.setattr(vectorstore, "embed_cached", lambda texts: np.zeros((len(texts), 3), dtype=np.float32))
+    monkeypatch.setattr(vectorstore, "stats", {"lookups": 0, "hits": 0, "errors": 0})
+    monkeypatch.setattr(vectorstore, "_pending_hits", {})
+    monkeypatch.setattr(vectorstore, "HIT_FLUSH_EVERY", 1000)
+
+
+def test_only_neighbours_within_distance_are_returned_and_counted(monkeypatch):
+    meta = {"source": "s", "date": "d"}
+    monkeypatch.setattr(vectorstore, "cache_collection", Collection({
+        "ids": [["close", "far"], ["far-only"]],
+        "documents": [["close fact", "far fact"], ["other fact"]],
+        "metadatas": [[meta, meta], [meta]],
+        "distances": [[0.1, 0.9], [1.2]],
+    }))
+
+    found = cache_search_many(["q1", "q2"], max_distance=0.4)
+
+    assert found == [[{"facts": "close fact", "source": "s", "date": "d"}], []]
+    assert vectorstore._pending_hits == {"close": 1}
+    assert vectorstore.stats == {"lookups": 2, "hits": 1, "errors": 0}